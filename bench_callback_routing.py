@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк маршрутизации N8N callback'ов к пользователю
+
+Сравнивает прежний линейный поиск по user_sessions с обратным индексом
+request_id -> user_id при 10k и 100k активных сессий.
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+logging.disable(logging.WARNING)
+
+from bot import TargetAudienceBot, WAITING_FOR_IDEAL_CLIENT
+from session_store import UserSession
+
+LOOKUPS = 2000
+
+
+def legacy_scan(bot, request_id):
+    """Прежний алгоритм: перебор всех сессий"""
+    for uid, session in bot.user_sessions.items():
+        if session.n8n_request_id == request_id:
+            return uid
+    return None
+
+
+def populate(bot, sessions):
+    bot.user_sessions.clear()
+    bot.n8n_request_index.clear()
+    for user_id in range(1, sessions + 1):
+        session = UserSession(state=WAITING_FOR_IDEAL_CLIENT)
+        bot.user_sessions.set(user_id, session)
+        bot._bind_n8n_request(user_id, session, f"{user_id}_1700000000")
+
+
+def measure(func, bot, request_ids):
+    started = time.perf_counter()
+    for request_id in request_ids:
+        assert func(request_id) is not None
+    return (time.perf_counter() - started) / len(request_ids)
+
+
+def main():
+    bot = TargetAudienceBot()
+
+    print(f"{'Сессий':>8} | {'Линейный поиск':>16} | {'Индекс':>10} | {'Ускорение':>9}")
+    print("-" * 54)
+    for sessions in (10_000, 100_000):
+        populate(bot, sessions)
+        # Запросы равномерно по всему диапазону пользователей
+        step = max(1, sessions // LOOKUPS)
+        request_ids = [f"{user_id}_1700000000" for user_id in range(1, sessions + 1, step)]
+
+        scan = measure(lambda rid: legacy_scan(bot, rid), bot, request_ids)
+        indexed = measure(bot._find_user_by_n8n_request, bot, request_ids)
+
+        print(f"{sessions:>8} | {scan * 1e6:>13.1f} мкс | {indexed * 1e6:>7.2f} мкс | {scan / indexed:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
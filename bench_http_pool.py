@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: время рукопожатий, сэкономленное общим HTTP пулом на один анализ
+
+Поднимает 9 локальных HTTPS серверов (самоподписанный сертификат через openssl,
+при его отсутствии - HTTP) и сравнивает два способа отправки 9 webhook'ов:
+- как раньше: новый TCPConnector + ClientSession на каждый POST
+- через общий PooledHTTPClient с keep-alive
+"""
+
+import asyncio
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from http_client_pool import PooledHTTPClient
+
+HOSTS = 9
+ANALYSES = 30
+
+
+def make_server_ssl_context(workdir):
+    """Создает самоподписанный сертификат, если доступен openssl"""
+    if not shutil.which('openssl'):
+        return None
+    cert = os.path.join(workdir, 'cert.pem')
+    key = os.path.join(workdir, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key,
+         '-out', cert, '-days', '1', '-subj', '/CN=localhost'],
+        check=True, capture_output=True
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def start_servers(server_ssl):
+    async def handler(request):
+        await request.read()
+        return web.json_response({'status': 'accepted'})
+
+    app = web.Application()
+    app.router.add_post('/webhook', handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    urls = []
+    scheme = 'https' if server_ssl else 'http'
+    for _ in range(HOSTS):
+        site = web.TCPSite(runner, '127.0.0.1', 0, ssl_context=server_ssl)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        urls.append(f'{scheme}://127.0.0.1:{port}/webhook')
+    return runner, urls
+
+
+async def analysis_without_pool(urls, client_ssl, payload):
+    for url in urls:
+        connector = aiohttp.TCPConnector(ssl=client_ssl)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async with session.post(url, json=payload) as response:
+                await response.read()
+
+
+async def analysis_with_pool(urls, client, payload):
+    for url in urls:
+        async with client.post(url, json=payload) as response:
+            await response.read()
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        server_ssl = make_server_ssl_context(workdir)
+        runner, urls = await start_servers(server_ssl)
+
+        client = PooledHTTPClient()
+        await client.start()
+        payload = {'event_type': 'target_audience_analysis', 'user_data': {'profession': 'benchmark'}}
+
+        try:
+            started = time.perf_counter()
+            for _ in range(ANALYSES):
+                await analysis_without_pool(urls, client.ssl_context, payload)
+            without_pool = (time.perf_counter() - started) / ANALYSES
+
+            started = time.perf_counter()
+            for _ in range(ANALYSES):
+                await analysis_with_pool(urls, client, payload)
+            with_pool = (time.perf_counter() - started) / ANALYSES
+
+            stats = client.get_stats()
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    created = sum(s['connections_created'] for s in stats.values())
+    reused = sum(s['connections_reused'] for s in stats.values())
+
+    print(f"Протокол: {'HTTPS' if server_ssl else 'HTTP'}, хостов: {HOSTS}, анализов: {ANALYSES}")
+    print(f"Без пула:  {without_pool * 1000:8.2f} мс на анализ ({HOSTS} рукопожатий)")
+    print(f"С пулом:   {with_pool * 1000:8.2f} мс на анализ")
+    print(f"Экономия:  {(without_pool - with_pool) * 1000:8.2f} мс на анализ")
+    print(f"Соединений создано: {created}, переиспользовано: {reused}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
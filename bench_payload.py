@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк построения тела webhook-запросов
+
+Сравнивает на анализе из 9 систем:
+- прежний путь: словарь с safe_json_value и datetime.now() для каждой системы
+  плюс json.dumps (так кодирует aiohttp при json=...)
+- шаблон PayloadTemplate: общая часть кодируется один раз, поля подставляются в байты
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import payload_builder
+from payload_builder import PayloadTemplate
+
+RUNS = 5000
+WEBHOOKS = [f"webhook_{i}" for i in range(1, 10)]
+
+USER_DATA = {
+    'profession': 'Психолог, работающий с тревожностью и выгоранием' * 3,
+    'segmentation': 'Женщины 25-45 лет, работающие в найме, с высшим образованием' * 3,
+    'ideal_client': 'Менеджер среднего звена, которая устала и хочет перемен' * 5
+}
+
+SPREADSHEET_INFO = {
+    'spreadsheet_id': '1AbCdEfGhIjKlMnOpQrStUvWxYz0123456789',
+    'spreadsheet_url': 'https://docs.google.com/spreadsheets/d/1AbCdEfGhIjKlMnOpQrStUvWxYz0123456789',
+    'sheet_title': 'Анализ ЦА - Психолог - 20.09.2024 17:16',
+    'created_at': datetime.now()
+}
+
+
+def legacy_payload(user_data, spreadsheet_info, webhook_name, user_id):
+    """Прежний _prepare_payload_with_spreadsheet"""
+    def safe_json_value(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        elif not isinstance(value, (str, int, float, bool, type(None))):
+            return str(value)
+        return value
+
+    return {
+        "event_type": "target_audience_analysis",
+        "timestamp": datetime.now().isoformat(),
+        "user_id": str(user_id),
+        "webhook_name": webhook_name,
+        "telegram_user_id": user_id,
+        "user_data": {
+            "profession": user_data.get('profession', ''),
+            "segmentation": user_data.get('segmentation', ''),
+            "ideal_client_portrait": user_data.get('ideal_client', '')
+        },
+        "spreadsheet_info": {
+            "spreadsheet_id": safe_json_value(spreadsheet_info.get('spreadsheet_id', '')),
+            "spreadsheet_url": safe_json_value(spreadsheet_info.get('spreadsheet_url', '')),
+            "sheet_title": safe_json_value(spreadsheet_info.get('sheet_title', '')),
+            "created_at": safe_json_value(spreadsheet_info.get('created_at', ''))
+        },
+        "analysis_data": {
+            "analysis_date": datetime.now().strftime("%d.%m.%Y"),
+            "characteristics": "Заполнить на основе описания",
+            "pain_points": "Заполнить на основе описания",
+            "needs_and_desires": "Заполнить на основе описания",
+            "communication_channels": "Заполнить на основе исследования",
+            "recommendations": "Заполнить после анализа"
+        }
+    }
+
+
+def run_legacy():
+    for run in range(RUNS):
+        for name in WEBHOOKS:
+            json.dumps(legacy_payload(USER_DATA, SPREADSHEET_INFO, name, run)).encode('utf-8')
+
+
+def run_template():
+    for run in range(RUNS):
+        template = PayloadTemplate(USER_DATA, SPREADSHEET_INFO, run)
+        for name in WEBHOOKS:
+            template.render(name, f"{run}:{name}")
+
+
+def measure(func):
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) / (RUNS * len(WEBHOOKS))
+
+
+def main():
+    legacy = measure(run_legacy)
+    print(f"{'Вариант':<34} | {'на запрос':>10} | {'ускорение':>9}")
+    print("-" * 60)
+    print(f"{'словарь + json.dumps (прежний)':<34} | {legacy * 1e6:>7.2f} мкс | {'1.0x':>9}")
+
+    saved = payload_builder.orjson
+    payload_builder.orjson = None
+    try:
+        stdlib = measure(run_template)
+    finally:
+        payload_builder.orjson = saved
+    print(f"{'шаблон + json':<34} | {stdlib * 1e6:>7.2f} мкс | {legacy / stdlib:>8.1f}x")
+
+    if saved is not None:
+        fast = measure(run_template)
+        print(f"{'шаблон + orjson':<34} | {fast * 1e6:>7.2f} мкс | {legacy / fast:>8.1f}x")
+    else:
+        print("orjson не установлен - вариант с orjson пропущен")
+
+
+if __name__ == '__main__':
+    main()
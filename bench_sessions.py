@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти сессий пользователей
+
+Сравнивает при 100k и 1M сессий:
+- прежний формат: словарь user_id -> dict с ответами, состоянием,
+  n8n_request_id и дублирующим словарем user_data
+- SessionStore с UserSession (__slots__)
+
+Строки ответов общие для обоих вариантов (пул из 1000 значений),
+поэтому измеряется только собственный объем структур сессий.
+"""
+
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+logging.disable(logging.WARNING)
+
+from session_store import SessionStore, UserSession
+
+WAITING_FOR_IDEAL_CLIENT = 2
+ANSWERS = [(f"Профессия {i}", f"Сегмент {i}", f"Идеальный клиент {i}") for i in range(1000)]
+REQUEST_IDS = [f"{i}_1700000000" for i in range(1000)]
+
+
+def build_legacy(count):
+    sessions = {}
+    for user_id in range(count):
+        profession, segmentation, ideal_client = ANSWERS[user_id % 1000]
+        sessions[user_id] = {
+            'state': WAITING_FOR_IDEAL_CLIENT,
+            'profession': profession,
+            'segmentation': segmentation,
+            'ideal_client': ideal_client,
+            'n8n_request_id': REQUEST_IDS[user_id % 1000],
+            'user_data': {
+                'profession': profession,
+                'segmentation': segmentation,
+                'ideal_client': ideal_client
+            }
+        }
+    return sessions
+
+
+def build_store(count):
+    store = SessionStore(idle_ttl=3600, max_sessions=count)
+    for user_id in range(count):
+        profession, segmentation, ideal_client = ANSWERS[user_id % 1000]
+        store.set(user_id, UserSession(WAITING_FOR_IDEAL_CLIENT, profession, segmentation,
+                                       ideal_client, REQUEST_IDS[user_id % 1000]))
+    return store
+
+
+def measure(build, count):
+    """Память (байт), занятая построенными сессиями"""
+    tracemalloc.start()
+    result = build(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    print(f"{'Сессий':>9} | {'dict (МБ)':>10} | {'SessionStore (МБ)':>18} | {'байт/сессия':>15} | {'Экономия':>8}")
+    print("-" * 74)
+    for count in (100_000, 1_000_000):
+        legacy = measure(build_legacy, count)
+        compact = measure(build_store, count)
+        print(f"{count:>9} | {legacy / 2**20:>10.1f} | {compact / 2**20:>18.1f} | "
+              f"{legacy // count:>6} → {compact // count:>5} | {legacy / compact:>7.1f}x")
+
+    # Оценка, которую показывает /sessions, против измеренной
+    store = build_store(100_000)
+    estimated = store.get_stats()['memory_bytes']
+    print(f"\nОценка get_stats() для 100k сессий: {estimated / 2**20:.1f} МБ "
+          f"(строки ответов считаются в каждой сессии, поэтому оценка выше измеренной)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк создания таблицы анализа: запросы и время на одну таблицу
+
+Заглушка отвечает записанными ответами Sheets API (структура и размер как у
+настоящих ответов) с задержкой, близкой к задержке API. Сравниваются:
+
+- два запроса (как было): spreadsheets.create, затем values.update в A1
+- один запрос: create с данными, оформлением и свойствами листа
+- резервный путь: пустой create и один batchUpdate (API не принял данные)
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+logging.disable(logging.WARNING)
+
+from aiohttp import web
+
+from google_minimal_service import GoogleMinimalService
+import sheets_layout
+
+TABLES = 20
+PARALLEL = 5
+# Задержки ответа заглушки по методам, сек (порядок задержек настоящего API, уменьшен в 4 раза)
+LATENCY = {'create': 0.200, 'values.update': 0.090, 'batchUpdate': 0.110}
+
+USER_DATA = {
+    'profession': 'Психолог',
+    'segmentation': 'Женщины 30-45 лет, предприниматели, кризис выгорания',
+    'ideal_client': 'Владелица небольшого бизнеса, готова к долгосрочной терапии'
+}
+
+# Записанные ответы (идентификаторы заменены)
+RECORDED = {
+    'create': {
+        'spreadsheetId': '{id}',
+        'properties': {
+            'title': '{title}', 'locale': 'ru_RU', 'autoRecalc': 'ON_CHANGE', 'timeZone': 'Etc/GMT',
+            'defaultFormat': {
+                'backgroundColor': {'red': 1, 'green': 1, 'blue': 1}, 'padding': {'top': 2, 'right': 3, 'bottom': 2, 'left': 3},
+                'verticalAlignment': 'BOTTOM', 'wrapStrategy': 'OVERFLOW_CELL',
+                'textFormat': {'foregroundColor': {}, 'fontFamily': 'arial,sans,sans-serif', 'fontSize': 10,
+                               'bold': False, 'italic': False, 'strikethrough': False, 'underline': False}
+            },
+            'spreadsheetTheme': {'primaryFontFamily': 'Arial', 'themeColors': [
+                {'colorType': name, 'color': {'rgbColor': {'red': 0.26, 'green': 0.52, 'blue': 0.96}}}
+                for name in ('TEXT', 'BACKGROUND', 'ACCENT1', 'ACCENT2', 'ACCENT3', 'ACCENT4', 'ACCENT5', 'ACCENT6', 'LINK')
+            ]}
+        },
+        'sheets': [{'properties': {'sheetId': 0, 'title': 'Лист1', 'index': 0, 'sheetType': 'GRID',
+                                   'gridProperties': {'rowCount': 1000, 'columnCount': 26}}}],
+        'spreadsheetUrl': 'https://docs.google.com/spreadsheets/d/{id}/edit'
+    },
+    'values.update': {'spreadsheetId': '{id}', 'updatedRange': "'Лист1'!A1:B6",
+                      'updatedRows': 6, 'updatedColumns': 2, 'updatedCells': 11},
+    'batchUpdate': {'spreadsheetId': '{id}', 'replies': [{}, {}, {}, {}, {}]}
+}
+
+
+class RecordedSheetsStub:
+    """Отвечает записанными ответами; считает запросы по методам"""
+
+    def __init__(self, reject_grid_data=False):
+        self.reject_grid_data = reject_grid_data
+        self.calls = {}
+        self.created = 0
+        self.url = None
+        self._runner = None
+
+    async def start(self):
+        app = web.Application(client_max_size=16 * 1024 ** 2)
+        app.router.add_post('/v4/spreadsheets', self.create)
+        app.router.add_put('/v4/spreadsheets/{id}/values/{range}', self.update_values)
+        app.router.add_post('/v4/spreadsheets/{id}:batchUpdate', self.batch_update)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _reply(self, method, spreadsheet_id, title=''):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(LATENCY[method])
+        body = json.dumps(RECORDED[method], ensure_ascii=False)
+        body = body.replace('{id}', spreadsheet_id).replace('{title}', title)
+        return web.Response(text=body, content_type='application/json')
+
+    async def create(self, request):
+        body = await request.json()
+        self.created += 1
+        if self.reject_grid_data and 'sheets' in body:
+            self.calls['create'] = self.calls.get('create', 0) + 1
+            return web.json_response({'error': {'code': 400, 'message': 'Invalid data[0]'}}, status=400)
+        return await self._reply('create', f'bench-{self.created}', body['properties']['title'])
+
+    async def update_values(self, request):
+        await request.read()
+        return await self._reply('values.update', request.match_info['id'])
+
+    async def batch_update(self, request):
+        await request.read()
+        return await self._reply('batchUpdate', request.match_info['id'])
+
+
+class Credentials:
+    token = 'bench-token'
+    expiry = None
+
+    def refresh(self, request):
+        pass
+
+
+async def two_requests(service, client, user_data):
+    """Прежний порядок: пустой create, затем values.update"""
+    current_date = '01.01.2026'
+    title = f"[{current_date}] – {user_data['profession']}"
+    spreadsheet = await client.create_spreadsheet({'properties': {'title': title}})
+    await client.update_values(spreadsheet['spreadsheetId'], 'A1',
+                               sheets_layout.analysis_rows(user_data, current_date))
+
+
+async def one_request(service, client, user_data):
+    await service._create_spreadsheet(client, user_data)
+
+
+async def run_strategy(name, create, reject_grid_data=False):
+    stub = RecordedSheetsStub(reject_grid_data=reject_grid_data)
+    await stub.start()
+    service = GoogleMinimalService(credentials=Credentials(), base_url=stub.url)
+    client = service.sheets_client
+    await client.start()
+    await create(service, client, USER_DATA)  # Прогрев соединения и запоминание отказа
+    stub.calls.clear()
+
+    # Последовательно: время одной таблицы для пользователя
+    started = time.perf_counter()
+    for _ in range(TABLES):
+        await create(service, client, USER_DATA)
+    sequential = (time.perf_counter() - started) / TABLES * 1000
+    calls = sum(stub.calls.values()) / TABLES
+
+    # Параллельно: пропускная способность
+    semaphore = asyncio.Semaphore(PARALLEL)
+
+    async def limited():
+        async with semaphore:
+            await create(service, client, USER_DATA)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(TABLES)))
+    parallel = (time.perf_counter() - started) / TABLES * 1000
+
+    await service.close()
+    await stub.stop()
+    return name, calls, sequential, parallel
+
+
+async def main():
+    # Сервис печатает ход создания каждой таблицы - в бенчмарке это лишнее
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [
+            await run_strategy('create + values.update', two_requests),
+            await run_strategy('create с данными', one_request),
+            await run_strategy('create + batchUpdate', one_request, reject_grid_data=True),
+        ]
+    print(f"{TABLES} таблиц, задержки заглушки: " +
+          ', '.join(f"{method} {latency * 1000:.0f} мс" for method, latency in LATENCY.items()))
+    print(f"{'Способ':>24} | {'запросов':>8} | {'мс/таблица':>10} | {f'мс/таблица ({PARALLEL} паралл.)':>22}")
+    print("-" * 74)
+    for name, calls, sequential, parallel in results:
+        print(f"{name:>24} | {calls:>8.1f} | {sequential:>10.0f} | {parallel:>22.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк задержки доставки обновлений Telegram: polling против webhook
+
+Локальный сервер-заглушка изображает Bot API с сетевой задержкой в одну
+сторону DELAY. Обновления появляются в случайные моменты (поток Пуассона),
+задержка - от появления обновления на стороне Telegram до вызова
+обработчика в Application.
+
+- polling: Updater бота держит long poll getUpdates; обновление, пришедшее
+  во время ответа на предыдущий запрос, ждет следующего запроса
+- webhook: заглушка отправляет каждое обновление POST'ом на маршрут
+  webhook сервера бота, как это делает Telegram
+"""
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+logging.disable(logging.WARNING)
+
+import aiohttp
+from aiohttp import web
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+import config
+from telegram_webhook import SECRET_HEADER, TelegramUpdateIngress
+from webhook_server import WebhookServer
+
+TOKEN = '123456:BENCH'
+SECRET = 'bench-secret'
+DELAY = 0.025     # Сетевая задержка в одну сторону, сек
+UPDATES = 400
+RATE = 40.0       # Обновлений в секунду
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeTelegram:
+    """Заглушка Bot API: getMe, webhook методы и long poll getUpdates"""
+
+    def __init__(self):
+        self.updates = []          # Неподтвержденные обновления
+        self.emitted = {}          # update_id -> момент появления
+        self.new_update = asyncio.Event()
+        self.get_updates_calls = 0
+        self.webhook_url = None
+        self.port = free_port()
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', self.port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await request.post()
+        await asyncio.sleep(DELAY)  # Запрос бота идет до Telegram
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'getUpdates':
+            result = await self._get_updates(int(params.get('offset', 0) or 0), float(params.get('timeout', 10) or 0))
+        else:
+            result = True
+        await asyncio.sleep(DELAY)  # Ответ идет обратно
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, offset: int, timeout: float):
+        self.get_updates_calls += 1
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        deadline = time.monotonic() + timeout
+        while not self.updates and time.monotonic() < deadline:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+        return list(self.updates)
+
+    def emit(self, update_id: int) -> dict:
+        update = {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': int(time.time()),
+                'chat': {'id': 7, 'type': 'private'},
+                'from': {'id': 7, 'is_bot': False, 'first_name': 'Тест'},
+                'text': f'сообщение {update_id}'
+            }
+        }
+        self.emitted[update_id] = time.perf_counter()
+        self.updates.append(update)
+        self.new_update.set()
+        return update
+
+
+async def run_mode(mode: str):
+    telegram = FakeTelegram()
+    await telegram.start()
+    received = {}
+    done = asyncio.Event()
+
+    async def record(update, context):
+        received[update.update_id] = time.perf_counter()
+        if len(received) == UPDATES:
+            done.set()
+
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(f'http://127.0.0.1:{telegram.port}/bot')
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, record))
+
+    server = None
+    async with application:
+        await application.start()
+        if mode == 'polling':
+            await application.updater.start_polling(poll_interval=0.0, timeout=10)
+        else:
+            ingress = TelegramUpdateIngress(application, secret_token=SECRET)
+            server = WebhookServer(SimpleNamespace(telegram_ingress=ingress), host='127.0.0.1', port=free_port())
+            await server.start_server()
+            url = f'http://127.0.0.1:{server.port}{config.TELEGRAM_WEBHOOK_PATH}'
+
+        random.seed(1)
+        async with aiohttp.ClientSession() as session:
+            pushes = set()
+            connections = asyncio.Semaphore(config.TELEGRAM_WEBHOOK_MAX_CONNECTIONS)
+
+            async def push(update):
+                # Telegram отправляет обновление на webhook через сеть
+                async with connections:
+                    await asyncio.sleep(DELAY)
+                    async with session.post(url, json=update, headers={SECRET_HEADER: SECRET}) as response:
+                        await response.read()
+
+            for update_id in range(1, UPDATES + 1):
+                await asyncio.sleep(random.expovariate(RATE))
+                update = telegram.emit(update_id)
+                if mode == 'webhook':
+                    task = asyncio.create_task(push(update))
+                    pushes.add(task)
+                    task.add_done_callback(pushes.discard)
+
+            await asyncio.wait_for(done.wait(), timeout=60)
+            await asyncio.gather(*pushes)
+
+        if mode == 'polling':
+            await application.updater.stop()
+        await application.stop()
+    if server is not None:
+        await server.stop_server()
+    await telegram.stop()
+
+    latencies = sorted((received[uid] - telegram.emitted[uid]) * 1000 for uid in received)
+    return latencies, telegram.get_updates_calls
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    print(f"Задержка сети в одну сторону: {DELAY * 1000:.0f} мс, {UPDATES} обновлений, {RATE:.0f}/сек\n")
+    print(f"{'Режим':>8} | {'p50':>7} | {'p95':>7} | {'p99':>7} | {'среднее':>8} | {'getUpdates':>10}")
+    print("-" * 62)
+    for mode in ('polling', 'webhook'):
+        latencies, calls = asyncio.run(run_mode(mode))
+        print(f"{mode:>8} | {percentile(latencies, 0.5):>5.1f}мс | {percentile(latencies, 0.95):>5.1f}мс | "
+              f"{percentile(latencies, 0.99):>5.1f}мс | {statistics.mean(latencies):>6.1f}мс | {calls:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,15 @@ from webhook_service import WebhookService
 from n8n_webhook_service import N8NWebhookService
 from sequential_webhook_service import SequentialWebhookService
 from webhook_server import WebhookServer
+from http_client_pool import start_http_client, close_http_client
+from deadline_scheduler import get_deadline_scheduler
+from pipeline_outbox import PipelineOutbox
+from progress_sink import create_progress_sink
+from telegram_rate_limiter import TelegramRateLimiter, PRIORITY_NOTIFICATION
+from pipeline_job_runner import PipelineJobRunner
+from session_store import SessionStore, UserSession
+from state_backend import get_state_backend
+from telegram_webhook import MODE_WEBHOOK, run_webhook_mode
 import config
 
 # Настройка логирования
@@ -25,6 +34,16 @@ logger = logging.getLogger(__name__)
 WAITING_FOR_PROFESSION = 1
 WAITING_FOR_SEGMENTATION = 2
 WAITING_FOR_IDEAL_CLIENT = 3
+PROCESSING = 4  # Данные собраны, анализ выполняется в фоне
+
+# Сколько ждать таблицу от N8N, прежде чем продолжить без нее
+N8N_TIMEOUT_SECONDS = 300
+
+# Пауза перед повторной постановкой анализов из outbox, не поместившихся в очередь
+RESUME_RETRY_SECONDS = 30
+
+# Канал общего состояния: ответы систем для анализа, который выполняет другая реплика
+CHANNEL_WEBHOOK_RESPONSE = 'webhook_response'
 
 async def retry_telegram_request(func, max_retries=3, delay=1):
     """Повторяет запрос к Telegram API при ошибках соединения"""
@@ -38,6 +57,9 @@ async def retry_telegram_request(func, max_retries=3, delay=1):
             await asyncio.sleep(delay)
             delay *= 2  # Экспоненциальная задержка
         except RetryAfter as e:
+            # Обычно RetryAfter уже обработан TelegramRateLimiter; здесь число повторов тоже ограничено
+            if attempt == max_retries - 1:
+                raise e
             logger.warning(f"Rate limit. Ждем {e.retry_after} секунд...")
             await asyncio.sleep(e.retry_after)
         except Exception as e:
@@ -56,11 +78,143 @@ class TargetAudienceBot:
         if hasattr(config, 'N8N_OUTGOING_WEBHOOK_URL') and config.N8N_OUTGOING_WEBHOOK_URL:
             self.n8n_service.set_outgoing_webhook(config.N8N_OUTGOING_WEBHOOK_URL)
         
-        self.user_sessions = {}  # Хранение данных пользователей
+        # Общее состояние реплик (STATE_BACKEND): по умолчанию - память процесса
+        self.state_backend = get_state_backend()
+        
+        # Сессии диалога: неактивные вытесняются по TTL, при превышении лимита - самые старые.
+        # Сессии с выполняющимся анализом (очередь, ожидание таблицы) не вытесняются
+        self.user_sessions = SessionStore(on_evict=self._on_session_evicted, backend=self.state_backend,
+                                          is_pinned=self._is_session_pinned)
+        self.n8n_request_index = {}  # Обратный индекс: n8n request_id -> user_id
+        self.n8n_deadlines = {}  # Дедлайны N8N запросов: request_id -> Deadline
+        self.deadline_scheduler = get_deadline_scheduler()
         
-        # Запускаем webhook сервер
+        # Webhook сервер запускается в event loop бота (см. post_init)
         self.webhook_server = WebhookServer(self, host='0.0.0.0', port=config.WEBHOOK_PORT)
-        self.webhook_server.start_server()
+        
+        # Прием обновлений Telegram через тот же сервер (только в режиме webhook)
+        self.telegram_ingress = None
+        
+        # Фоновые задачи обработки (ссылки храним, чтобы задачи не собрал GC)
+        self._background_tasks = set()
+        
+        # Анализы выполняются воркерами в фоне, по одному на пользователя
+        self.job_runner = PipelineJobRunner()
+        
+        # Все исходящие запросы к Telegram проходят через планировщик лимитов (см. main)
+        self.rate_limiter = TelegramRateLimiter()
+        
+        # Журнал шагов анализа: незавершенные отправки продолжаются после перезапуска
+        self.outbox = PipelineOutbox() if config.OUTBOX_ENABLED else None
+        self.sequential_webhook_service.outbox = self.outbox
+    
+    async def post_init(self, application: Application):
+        """Хук запуска Application: поднимаем общие ресурсы в event loop бота"""
+        await start_http_client()
+        await self.state_backend.start()
+        self.state_backend.subscribe(CHANNEL_WEBHOOK_RESPONSE, self._on_shared_webhook_response)
+        if self.outbox is not None:
+            await self.outbox.start()
+        await self.job_runner.start()
+        await self.google_service.start()
+        await self.webhook_server.start_server()
+        
+        # Продолжаем анализы, прерванные перезапуском
+        if self.outbox is not None:
+            self._resume_unfinished_runs(await self.outbox.load_unfinished_runs())
+    
+    async def post_shutdown(self, application: Application):
+        """Хук остановки Application: освобождаем общие ресурсы"""
+        await self.webhook_server.stop_server()
+        
+        # Прерываем отправки: незавершенные шаги останутся в outbox
+        for task in list(self._background_tasks):
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self.job_runner.stop()
+        
+        if self.outbox is not None:
+            await self.outbox.close()
+        await self.state_backend.close()
+        await self.google_service.close()
+        self.sequential_webhook_service.latency_tracker.save()
+        await close_http_client()
+    
+    def _format_ready_timeouts(self) -> str:
+        """Текущие адаптивные таймауты ожидания 'ready' по системам"""
+        tracker = self.sequential_webhook_service.latency_tracker
+        return ', '.join(
+            f"{name}: {tracker.timeout(name, 'ready'):.0f} сек"
+            for name in self.sequential_webhook_service.webhooks
+        ) or 'нет систем'
+    
+    def _format_circuit_states(self) -> str:
+        """Системы с открытым или полуоткрытым выключателем"""
+        circuits = self.sequential_webhook_service.circuit_breakers.get_stats()
+        broken = [
+            f"{name}: {stats['state']} (повтор через {stats['retry_after_seconds']:.0f} сек)"
+            for name, stats in circuits.items() if stats['state'] != 'closed'
+        ]
+        return ', '.join(broken) or 'все закрыты'
+    
+    def _format_telegram_queues(self) -> str:
+        """Глубина очередей исходящих запросов к Telegram по приоритетам"""
+        stats = self.rate_limiter.get_stats()
+        queues = ', '.join(
+            f"{name}: {queue['depth']} (макс. {queue['max_depth']}, ожидание {queue['avg_wait_ms']} мс)"
+            for name, queue in stats['queues'].items()
+        )
+        return f"{queues}; RetryAfter: {stats['retry_after_total']}"
+    
+    @staticmethod
+    def _new_run_id(user_id: int) -> str:
+        """Уникальный ID анализа (для outbox)"""
+        return f"{user_id}_{int(time.time() * 1000)}"
+    
+    async def _enqueue_pipeline(self, user_id: int, job, name: str, session: UserSession = None) -> bool:
+        """
+        Ставит анализ пользователя в очередь воркеров
+        
+        Если очередь переполнена, сессия завершается: иначе она осталась бы
+        в PROCESSING и каждое сообщение получало бы "анализ уже выполняется".
+        """
+        if self.job_runner.submit(user_id, job, name=name):
+            return True
+        self._end_session(user_id, session)
+        await self.safe_send_message(
+            user_id,
+            "⚠️ Сейчас выполняется слишком много анализов. Попробуйте позже: /start"
+        )
+        return False
+    
+    def _resume_unfinished_runs(self, runs):
+        """Ставит анализы из outbox в очередь; не поместившиеся повторяются позже"""
+        rejected = self._submit_resumed_runs(runs)
+        if rejected:
+            self._spawn_background(self._retry_resumed_runs(rejected))
+    
+    def _submit_resumed_runs(self, runs):
+        """Возвращает анализы, которые очередь отклонила"""
+        return [
+            run for run in runs
+            if not self.job_runner.submit(run['user_id'], lambda run=run: self._resume_pipeline(run), name=run['run_id'])
+        ]
+    
+    async def _retry_resumed_runs(self, runs):
+        """Повторяет постановку отклоненных анализов, пока очередь не примет все (они остаются в outbox)"""
+        while runs:
+            logger.warning(f"⚠️ Очередь анализов заполнена: {len(runs)} анализов из outbox "
+                           f"({', '.join(run['run_id'] for run in runs)}) будут продолжены "
+                           f"через {RESUME_RETRY_SECONDS} сек")
+            await asyncio.sleep(RESUME_RETRY_SECONDS)
+            runs = self._submit_resumed_runs(runs)
+    
+    def _spawn_background(self, coro):
+        """Запускает корутину фоновой задачей в event loop бота"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
     
     async def safe_send_message(self, chat_id: int, text: str, reply_markup=None, max_retries=3):
         """Безопасная отправка сообщения с повторными попытками"""
@@ -98,6 +252,75 @@ class TargetAudienceBot:
             logger.error(f"Ошибка очистки пула соединений: {e}")
             return False
     
+    def _set_session(self, user_id: int, session: UserSession):
+        """Заменяет сессию пользователя, снимая привязку старого N8N запроса"""
+        self._end_session(user_id)
+        self.user_sessions.set(user_id, session)
+    
+    def _end_session(self, user_id: int, session: UserSession = None):
+        """
+        Удаляет сессию пользователя вместе с записью в индексе N8N запросов
+        
+        Если передана session, удаляется только она: фоновый анализ не сотрет
+        новую сессию, начатую пользователем через /start.
+        """
+        if session is not None:
+            session = self.user_sessions.discard(user_id, session)
+        else:
+            session = self.user_sessions.pop(user_id, None)
+        if session and session.n8n_request_id:
+            self._unbind_n8n_request(session.n8n_request_id)
+    
+    @staticmethod
+    def _is_session_pinned(session: UserSession) -> bool:
+        """Анализ выполняется: сессия нужна до _end_session"""
+        return session.state == PROCESSING
+    
+    def _on_session_evicted(self, user_id: int, session: UserSession, reason: str):
+        """Сессия вытеснена хранилищем (неактивность или лимит): снимаем привязку N8N"""
+        logger.info(f"🧹 Сессия пользователя {user_id} вытеснена ({reason})")
+        if session.n8n_request_id:
+            self._unbind_n8n_request(session.n8n_request_id)
+    
+    def _bind_n8n_request(self, user_id: int, session: UserSession, request_id: str):
+        """Привязывает N8N запрос к сессии пользователя (сессия и индекс обновляются вместе)"""
+        session.n8n_request_id = request_id
+        self.n8n_request_index[request_id] = user_id
+    
+    def _unbind_n8n_request(self, request_id: str, stale: bool = False):
+        """
+        Снимает привязку N8N запроса после ответа, таймаута или завершения сессии
+        
+        stale=True - запрос уже обработала другая реплика: ее сессия могла
+        завершиться, поэтому локальная копия только сбрасывается, а не записывается.
+        """
+        deadline = self.n8n_deadlines.pop(request_id, None)
+        if deadline is not None:
+            deadline.cancel()
+        
+        user_id = self.n8n_request_index.pop(request_id, None)
+        session = self.user_sessions.peek(user_id)
+        if session and session.n8n_request_id == request_id:
+            if stale:
+                self.user_sessions.forget(user_id, session)
+            else:
+                session.n8n_request_id = None
+                self.user_sessions.save(user_id, session)
+        return user_id
+    
+    def _find_user_by_n8n_request(self, request_id: str):
+        """Находит пользователя по request_id за O(1)"""
+        user_id = self.n8n_request_index.get(request_id)
+        if user_id is None:
+            return None
+        
+        session = self.user_sessions.peek(user_id)
+        if not session or session.n8n_request_id != request_id:
+            # Индекс устарел - сессию заменили без снятия привязки
+            self.n8n_request_index.pop(request_id, None)
+            return None
+        return user_id
+    
     def normalize_spreadsheet_info(self, spreadsheet_info: Dict[str, Any]) -> Dict[str, Any]:
         """Нормализация данных о таблице для совместимости"""
         normalized = spreadsheet_info.copy()
@@ -127,7 +350,7 @@ class TargetAudienceBot:
         user_id = update.effective_user.id
         
         # Сброс сессии пользователя
-        self.user_sessions[user_id] = {}
+        self._set_session(user_id, UserSession())
         
         # Создание кнопки "Начать анализ ЦА"
         keyboard = [[InlineKeyboardButton("🎯 Начать анализ ЦА", callback_data='start_analysis')]]
@@ -180,7 +403,16 @@ class TargetAudienceBot:
         
 📊 **Статистика:**
 • Активных N8N запросов: {len(pending_requests)}
+• Из них ожидают / завершены: {self.n8n_service.get_pending_requests_count()} / {self.n8n_service.get_completed_requests_count()}
+• Память хранилища запросов: {pending_requests.get_stats()['memory_bytes'] // 1024} КБ
 • Активных пользовательских сессий: {active_sessions}
+• Записей в индексе request_id → пользователь: {len(self.n8n_request_index)}
+• Шагов в ожидании ответа 'ready': {self.sequential_webhook_service.get_waiters_count()}
+• Активных дедлайнов: {self.deadline_scheduler.get_pending_count()} (макс. опоздание: {self.deadline_scheduler.get_stats()['lateness_max_ms']} мс)
+• Таймауты систем ('ready'): {self._format_ready_timeouts()}
+• Выключатели систем: {self._format_circuit_states()}
+• Очереди Telegram: {self._format_telegram_queues()}
+• Анализы: {self.job_runner.get_stats()['busy']} выполняется, {self.job_runner.get_stats()['queued']} в очереди
 
 📋 **Активные N8N запросы:**
 """
@@ -201,6 +433,29 @@ class TargetAudienceBot:
         
         await update.message.reply_text(debug_info)
 
+    async def admin_sessions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Админская команда: сессии пользователей и занимаемая ими память"""
+        user_id = update.effective_user.id
+        
+        # Простая проверка на админа
+        admin_ids = [8098626207]  # Замените на ваш Telegram ID
+        
+        if user_id not in admin_ids:
+            await update.message.reply_text("❌ У вас нет прав для выполнения этой команды")
+            return
+        
+        stats = self.user_sessions.get_stats()
+        per_session = stats['memory_bytes'] // stats['sessions'] if stats['sessions'] else 0
+        
+        await update.message.reply_text(f"""👥 **Сессии пользователей:**
+
+• Активных сессий: {stats['sessions']} из {stats['max_sessions']}
+• Память: {stats['memory_bytes'] // 1024} КБ (~{per_session} байт на сессию)
+• Вытеснено по неактивности (>{int(stats['idle_ttl_seconds'])} сек): {stats['evicted_idle']}
+• Вытеснено по лимиту: {stats['evicted_lru']}
+• Записей в индексе request_id → пользователь: {len(self.n8n_request_index)}
+""")
+
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на кнопки"""
         query = update.callback_query
@@ -210,7 +465,7 @@ class TargetAudienceBot:
         
         if query.data == 'start_analysis':
             # Начало анализа - запрос профессии
-            self.user_sessions[user_id] = {'state': WAITING_FOR_PROFESSION}
+            self._set_session(user_id, UserSession(state=WAITING_FOR_PROFESSION))
             
             await query.edit_message_text(
                 f"📝 {config.QUESTIONS['profession']}"
@@ -221,20 +476,21 @@ class TargetAudienceBot:
         user_id = update.effective_user.id
         user_text = update.message.text
         
-        # Проверяем, есть ли активная сессия
-        if user_id not in self.user_sessions:
+        # Проверяем, есть ли активная сессия (прошлое сообщение могла обработать другая реплика)
+        session = await self.user_sessions.load(user_id)
+        if session is None:
             await update.message.reply_text(
                 "Пожалуйста, начните с команды /start"
             )
             return
         
-        session = self.user_sessions[user_id]
-        state = session.get('state')
+        state = session.state
         
         if state == WAITING_FOR_PROFESSION:
             # Сохраняем профессию и переходим к следующему вопросу
-            session['profession'] = user_text
-            session['state'] = WAITING_FOR_SEGMENTATION
+            session.profession = user_text
+            session.state = WAITING_FOR_SEGMENTATION
+            self.user_sessions.save(user_id, session)
             
             await update.message.reply_text(
                 f"✅ Профессия сохранена: {user_text}\n\n"
@@ -243,8 +499,9 @@ class TargetAudienceBot:
             
         elif state == WAITING_FOR_SEGMENTATION:
             # Сохраняем сегментацию и переходим к следующему вопросу
-            session['segmentation'] = user_text
-            session['state'] = WAITING_FOR_IDEAL_CLIENT
+            session.segmentation = user_text
+            session.state = WAITING_FOR_IDEAL_CLIENT
+            self.user_sessions.save(user_id, session)
             
             await update.message.reply_text(
                 f"✅ Сегментация сохранена!\n\n"
@@ -253,91 +510,77 @@ class TargetAudienceBot:
             
         elif state == WAITING_FOR_IDEAL_CLIENT:
             # Сохраняем описание клиента и создаем документ
-            session['ideal_client'] = user_text
+            session.ideal_client = user_text
+            session.state = PROCESSING
+            self.user_sessions.save(user_id, session)
             
             await update.message.reply_text(
                 "✅ Портрет идеального клиента сохранен!\n\n"
                 "📊 Создаю Google-таблицу с анализом ЦА... Пожалуйста, подождите."
             )
             
-            # Отправка данных в N8N для создания таблицы
+            # Отправка в N8N (до 30 сек) тоже идет в очереди: обработчик сразу освобождается
             await update.message.reply_text("📤 Отправляю данные в N8N для создания таблицы...")
+            await self._enqueue_pipeline(
+                user_id, lambda: self._submit_to_n8n(user_id, session), name=f"{user_id}:n8n", session=session
+            )
             
-            try:
-                # Отправляем данные в N8N
-                request_id = await self.n8n_service.send_data_to_n8n(user_id, {
-                    'profession': session['profession'],
-                    'segmentation': session['segmentation'],
-                    'ideal_client': session['ideal_client']
-                })
-                
-                # Новая логика: сначала ждем ответа от N8N, потом отправляем webhook'и последовательно
-                # Пока только отправляем в N8N и ждем ответа
-                webhook_status = ""
-                
-                if request_id:
-                    # Сохраняем request_id и данные пользователя в сессии
-                    session['n8n_request_id'] = request_id
-                    session['user_data'] = {
-                        'profession': session['profession'],
-                        'segmentation': session['segmentation'],
-                        'ideal_client': session['ideal_client']
-                    }
-                    
-                    await update.message.reply_text(
-                        f"📊 Процесс запущен:\n"
-                        f"✅ Данные отправлены в N8N\n"
-                        f"📝 ID запроса: {request_id}\n\n"
-                        f"⏳ Ожидаю создания таблицы в N8N...\n"
-                        f"📋 После создания таблицы начну последовательную отправку в 9 систем"
-                    )
-                    
-                    # НЕ очищаем сессию - ждем ответа от N8N
-                    # Устанавливаем таймаут для N8N (5 минут)
-                    asyncio.create_task(self._n8n_timeout_handler(user_id, request_id))
-                else:
-                    # N8N не сработал - отправляем webhook'и без таблицы
-                    await update.message.reply_text(
-                        f"⚠️ N8N недоступен - таблица не создана\n"
-                        f"🚀 Продолжаю отправку данных в 9 систем без таблицы..."
-                    )
-                    
-                    # Отправляем в системы без информации о таблице
-                    await self._start_sequential_webhooks_without_table(user_id, session)
-                    
-                    await update.message.reply_text(
-                        f"📊 Процесс завершен:\n"
-                        f"❌ Таблица: Не создана (N8N недоступен)\n"
-                        f"✅ Данные отправлены во все доступные системы\n\n"
-                        f"💡 Анализ ЦА завершен без таблицы"
-                    )
-                    
-            except Exception as e:
-                logger.error(f"Ошибка при отправке в N8N: {e}")
-                await update.message.reply_text(
-                    f"❌ Ошибка N8N сервиса: {str(e)}\n"
-                    f"🚀 Продолжаю отправку в системы без таблицы..."
-                )
-                
-                # При ошибке N8N тоже отправляем webhook'и
-                await self._start_sequential_webhooks_without_table(user_id, session)
-                
-                await update.message.reply_text(
-                    f"📊 Процесс завершен:\n"
-                    f"❌ Таблица: Ошибка N8N\n"
-                    f"✅ Данные отправлены во все доступные системы\n\n"
-                    f"💡 Анализ ЦА завершен без таблицы"
-                )
-            
-            # Очищаем сессию пользователя только если это НЕ N8N запрос
-            if 'n8n_request_id' not in session:
-                del self.user_sessions[user_id]
+            # Сессия завершится, когда фоновый анализ закончится
+        
+        elif state == PROCESSING:
+            await update.message.reply_text(
+                "⏳ Ваш анализ уже выполняется. Я пришлю результат, когда он будет готов."
+            )
         
         else:
             await update.message.reply_text(
                 "Я не понимаю. Пожалуйста, используйте команду /start для начала."
             )
     
+    async def _submit_to_n8n(self, user_id: int, session: UserSession):
+        """Фоновая отправка данных в N8N; без ответа N8N анализ продолжается без таблицы"""
+        try:
+            request_id = await self.n8n_service.send_data_to_n8n(user_id, session.user_data)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке в N8N: {e}")
+            await self.safe_send_message(
+                user_id,
+                f"❌ Ошибка N8N сервиса: {str(e)}\n"
+                f"{self._fallback_notice()}"
+            )
+            await self._run_pipeline_without_table(user_id, session, "Ошибка N8N")
+            return
+        
+        if not request_id:
+            # N8N не сработал - отправляем webhook'и без таблицы
+            await self.safe_send_message(
+                user_id,
+                f"⚠️ N8N недоступен\n"
+                f"{self._fallback_notice()}"
+            )
+            await self._run_pipeline_without_table(user_id, session, "Не создана (N8N недоступен)")
+            return
+        
+        # Сохраняем request_id в сессии (ответы уже в ней)
+        self._bind_n8n_request(user_id, session, request_id)
+        self.user_sessions.save(user_id, session)
+        
+        # НЕ очищаем сессию - ждем ответа от N8N
+        # Регистрируем таймаут N8N (5 минут); ответ N8N его отменит
+        self.n8n_deadlines[request_id] = self.deadline_scheduler.schedule(
+            N8N_TIMEOUT_SECONDS, self._on_n8n_deadline, user_id, request_id,
+            name=f"n8n:{request_id}"
+        )
+        
+        await self.safe_send_message(
+            user_id,
+            f"📊 Процесс запущен:\n"
+            f"✅ Данные отправлены в N8N\n"
+            f"📝 ID запроса: {request_id}\n\n"
+            f"⏳ Ожидаю создания таблицы в N8N...\n"
+            f"📋 После создания таблицы начну последовательную отправку в 9 систем"
+        )
+    
     def _format_text_analysis(self, session):
         """Форматирование анализа ЦА в текстовом виде"""
         current_date = datetime.now().strftime("%d.%m.%Y")
@@ -346,13 +589,13 @@ class TargetAudienceBot:
 📅 Дата: {current_date}
 
 **Профессия эксперта:**
-{session['profession']}
+{session.profession}
 
 **Сегментация эксперта:**
-{session['segmentation']}
+{session.segmentation}
 
 **Портрет идеального клиента:**
-{session['ideal_client']}
+{session.ideal_client}
 
 ---
 
@@ -369,6 +612,11 @@ class TargetAudienceBot:
     async def handle_n8n_webhook(self, webhook_data):
         """Обработка входящего webhook от N8N с информацией о созданной таблице"""
         try:
+            # Запрос могла отправить другая реплика - подхватываем его из общего состояния
+            request_id = webhook_data.get('request_id')
+            if self.state_backend.shared and request_id and request_id not in self.n8n_request_index:
+                await self._adopt_n8n_request(request_id)
+            
             # Передаем данные в N8N сервис
             success = self.n8n_service.handle_incoming_webhook(webhook_data)
             
@@ -381,15 +629,18 @@ class TargetAudienceBot:
                 logger.error('Webhook без request_id')
                 return False
             
-            # Находим пользователя по request_id
-            user_id = None
-            for uid, session in self.user_sessions.items():
-                if session.get('n8n_request_id') == request_id:
-                    user_id = uid
-                    break
+            # Находим пользователя по request_id через обратный индекс
+            user_id = self._find_user_by_n8n_request(request_id)
             
             if not user_id:
                 logger.warning(f'Пользователь не найден для request_id: {request_id}')
+                await self._notify_lost_request(request_id)
+                return False
+            
+            # Повторный ответ N8N или ответ, пришедший на другую реплику, цепочку не запустит
+            if not await self.n8n_service.claim_request(request_id):
+                logger.warning(f'Ответ N8N для request_id {request_id} уже обработан')
+                self._unbind_n8n_request(request_id, stale=True)
                 return False
             
             # Получаем информацию о таблице
@@ -404,8 +655,17 @@ class TargetAudienceBot:
             logger.info(f'  - Request ID: {request_id}')
             logger.info(f'  - Spreadsheet Info: {spreadsheet_info}')
             
-            # Уведомляем пользователя о готовой таблице и запускаем последовательные webhook'и  
-            await self._start_sequential_webhooks(user_id, spreadsheet_info)
+            # Запрос завершен: повторный webhook или таймаут больше не запустят цепочку
+            session = self.user_sessions.peek(user_id)
+            self._unbind_n8n_request(request_id)
+            
+            # Уведомляем пользователя о готовой таблице и запускаем последовательные webhook'и.
+            # Отправка длится минуты, поэтому N8N получает ответ сразу, а цепочка идет в фоне.
+            # Сессия передается в задачу: повторный поиск мог бы ее не найти
+            await self._enqueue_pipeline(
+                user_id, lambda: self._start_sequential_webhooks(user_id, spreadsheet_info, session),
+                name=request_id, session=session
+            )
             
             return True
             
@@ -413,6 +673,31 @@ class TargetAudienceBot:
             logger.error(f'Ошибка обработки N8N webhook: {e}')
             return False
     
+    async def _notify_lost_request(self, request_id: str):
+        """
+        Таблица пришла, но сессии пользователя уже нет: сообщаем об этом
+        
+        Только если запрос еще ожидал ответа (claim удался) - повторный ответ
+        N8N после завершенного анализа пользователя не беспокоит.
+        """
+        entry = self.n8n_service.pending_requests.get(request_id)
+        if entry is None or not await self.n8n_service.claim_request(request_id):
+            return
+        await self.safe_send_message(
+            entry['user_id'],
+            "⚠️ Таблица готова, но данные вашего анализа не сохранились. "
+            "Пожалуйста, начните заново: /start"
+        )
+    
+    async def _adopt_n8n_request(self, request_id: str):
+        """Привязывает к локальной сессии N8N запрос, отправленный другой репликой"""
+        user_id = await self.n8n_service.adopt_request(request_id)
+        if user_id is None:
+            return
+        session = await self.user_sessions.load(user_id)
+        if session is not None and session.n8n_request_id == request_id:
+            self.n8n_request_index[request_id] = user_id
+    
     async def _notify_user_about_spreadsheet(self, user_id, spreadsheet_info):
         """Уведомление пользователя о готовой таблице"""
         try:
@@ -441,13 +726,15 @@ class TargetAudienceBot:
                          f"🔗 Ссылка: {spreadsheet_url}\n"
                          f"📊 ID: {spreadsheet_id}\n\n"
                          f"Таблица содержит анализ вашей целевой аудитории.",
-                    reply_markup=reply_markup
+                    reply_markup=reply_markup,
+                    rate_limit_args={'priority': PRIORITY_NOTIFICATION}
                 )
                 
                 # Предложение начать новый анализ
                 await self.application.bot.send_message(
                     chat_id=user_id,
-                    text="Хотите провести еще один анализ? Напишите /start"
+                    text="Хотите провести еще один анализ? Напишите /start",
+                    rate_limit_args={'priority': PRIORITY_NOTIFICATION}
                 )
                 
             else:
@@ -457,13 +744,15 @@ class TargetAudienceBot:
                 await self.application.bot.send_message(
                     chat_id=user_id,
                     text=f"❌ Ошибка создания таблицы в N8N:\n{error_message}\n\n"
-                         f"Попробуйте создать анализ заново."
+                         f"Попробуйте создать анализ заново.",
+                    rate_limit_args={'priority': PRIORITY_NOTIFICATION}
                 )
                 
         except Exception as e:
             logger.error(f'Ошибка уведомления пользователя {user_id}: {e}')
 
-    async def _start_sequential_webhooks(self, user_id: int, spreadsheet_info: Dict[str, Any]):
+    async def _start_sequential_webhooks(self, user_id: int, spreadsheet_info: Dict[str, Any],
+                                         session: UserSession = None):
         """Запускает последовательную отправку webhook'ов после получения таблицы от N8N"""
         try:
             # Проверяем что application инициализировано
@@ -471,13 +760,16 @@ class TargetAudienceBot:
                 logger.error(f'Application не инициализировано для пользователя {user_id}')
                 return
                 
-            # Получаем данные пользователя из сессии
-            if user_id not in self.user_sessions:
+            if session is None:
                 logger.error(f'Сессия пользователя {user_id} не найдена')
+                await self.safe_send_message(
+                    user_id,
+                    "⚠️ Таблица готова, но данные вашего анализа не сохранились. "
+                    "Пожалуйста, начните заново: /start"
+                )
                 return
                 
-            session = self.user_sessions[user_id]
-            user_data = session.get('user_data', {})
+            user_data = session.user_data
             
             # Нормализуем данные о таблице
             spreadsheet_info = self.normalize_spreadsheet_info(spreadsheet_info)
@@ -489,52 +781,39 @@ class TargetAudienceBot:
             keyboard = [[InlineKeyboardButton("📊 Открыть таблицу", url=spreadsheet_url)]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=f"🎉 Таблица создана!\n\n"
-                     f"📋 Название: {sheet_title}\n"
-                     f"🔗 Ссылка: {spreadsheet_url}\n\n"
-                     f"🚀 Теперь начинаю последовательную отправку в 9 систем...",
+            # Сообщение о таблице одновременно служит статусом отправки
+            progress = create_progress_sink(
+                self.application.bot, user_id,
+                header=f"🎉 Таблица создана!\n\n"
+                       f"📋 Название: {sheet_title}\n"
+                       f"🔗 Ссылка: {spreadsheet_url}\n\n"
+                       f"🚀 Теперь начинаю последовательную отправку в 9 систем...",
                 reply_markup=reply_markup
             )
-            
-            # Функция для уведомлений о прогрессе
-            async def progress_callback(message: str):
-                await self.application.bot.send_message(
-                    chat_id=user_id,
-                    text=message
-                )
+            await progress.start()
             
             # Запускаем последовательную отправку webhook'ов
             webhook_results = await self.sequential_webhook_service.send_webhooks_sequentially(
                 user_id=user_id,
                 user_data=user_data,
                 spreadsheet_info=spreadsheet_info,
-                progress_callback=progress_callback
+                progress_callback=progress,
+                run_id=self._new_run_id(user_id)
             )
             
             # Подводим итоги
             successful = sum(1 for success in webhook_results.values() if success)
             total = len(webhook_results)
             
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=f"🏁 Процесс завершен!\n\n"
-                     f"📊 Таблица: {sheet_title}\n"
-                     f"🔗 Ссылка: {spreadsheet_url}\n"
-                     f"📡 Обработано систем: {successful}/{total}\n\n"
-                     f"✅ Анализ целевой аудитории готов!"
+            await progress.finish(
+                f"🏁 Процесс завершен!\n\n"
+                f"📊 Таблица: {sheet_title}\n"
+                f"🔗 Ссылка: {spreadsheet_url}\n"
+                f"📡 Обработано систем: {successful}/{total}\n\n"
+                f"✅ Анализ целевой аудитории готов!",
+                hint="Хотите провести еще один анализ? Напишите /start"
             )
-            
-            # Предложение начать новый анализ
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text="Хотите провести еще один анализ? Напишите /start"
-            )
-            
-            # Очищаем сессию пользователя
-            if user_id in self.user_sessions:
-                del self.user_sessions[user_id]
+            self.google_service.record_analysis(user_id, user_data, spreadsheet_url, f"{successful}/{total}")
                 
         except Exception as e:
             logger.error(f'Ошибка запуска последовательных webhook\'ов для пользователя {user_id}: {e}')
@@ -543,8 +822,13 @@ class TargetAudienceBot:
                 text=f"❌ Ошибка при обработке систем: {str(e)}\n\n"
                      f"Таблица создана, но некоторые системы могли не получить данные."
             )
+        finally:
+            # Сессия закреплена на время анализа - завершаем ее при любом исходе
+            if session is not None:
+                self._end_session(user_id, session)
 
-    async def _start_sequential_webhooks_without_table(self, user_id: int, session: Dict[str, Any]):
+    async def _start_sequential_webhooks_without_table(self, user_id: int, session: UserSession,
+                                                       table_status: str = "Не создана"):
         """Запускает последовательную отправку webhook'ов БЕЗ информации о таблице"""
         try:
             # Проверяем что application инициализировано
@@ -552,11 +836,7 @@ class TargetAudienceBot:
                 logger.error(f'Application не инициализировано для пользователя {user_id}')
                 return
                 
-            user_data = {
-                'profession': session['profession'],
-                'segmentation': session['segmentation'],
-                'ideal_client': session['ideal_client']
-            }
+            user_data = session.user_data
             
             # Создаем фиктивную информацию о таблице
             fake_spreadsheet_info = {
@@ -566,49 +846,35 @@ class TargetAudienceBot:
                 'created_at': datetime.now().isoformat()
             }
             
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=f"🚀 Начинаю последовательную отправку в 9 систем...\n"
-                     f"📝 Данные: профессия, сегментация, портрет клиента\n"
-                     f"⚠️ Таблица недоступна, но данные отправляются"
+            progress = create_progress_sink(
+                self.application.bot, user_id,
+                header=f"🚀 Начинаю последовательную отправку в 9 систем...\n"
+                       f"📝 Данные: профессия, сегментация, портрет клиента\n"
+                       f"⚠️ Таблица недоступна, но данные отправляются"
             )
-            
-            # Функция для уведомлений о прогрессе
-            async def progress_callback(message: str):
-                await self.application.bot.send_message(
-                    chat_id=user_id,
-                    text=message
-                )
+            await progress.start()
             
             # Запускаем последовательную отправку webhook'ов
             webhook_results = await self.sequential_webhook_service.send_webhooks_sequentially(
                 user_id=user_id,
                 user_data=user_data,
                 spreadsheet_info=fake_spreadsheet_info,
-                progress_callback=progress_callback
+                progress_callback=progress,
+                run_id=self._new_run_id(user_id)
             )
             
             # Подводим итоги
             successful = sum(1 for success in webhook_results.values() if success)
             total = len(webhook_results)
             
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=f"🏁 Отправка в системы завершена!\n\n"
-                     f"❌ Таблица: Не создана\n"
-                     f"📡 Обработано систем: {successful}/{total}\n\n"
-                     f"✅ Данные отправлены во все доступные системы!"
-            )
-            
-            # Предложение начать новый анализ
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text="Хотите провести еще один анализ? Напишите /start"
+            await progress.finish(
+                f"🏁 Отправка в системы завершена!\n\n"
+                f"❌ Таблица: {table_status}\n"
+                f"📡 Обработано систем: {successful}/{total}\n\n"
+                f"✅ Данные отправлены во все доступные системы!",
+                hint="Хотите провести еще один анализ? Напишите /start"
             )
-            
-            # Очищаем сессию пользователя
-            if user_id in self.user_sessions:
-                del self.user_sessions[user_id]
+            self.google_service.record_analysis(user_id, user_data, '', f"{successful}/{total}")
                 
         except Exception as e:
             logger.error(f'Ошибка отправки webhook\'ов без таблицы для пользователя {user_id}: {e}')
@@ -618,20 +884,125 @@ class TargetAudienceBot:
                      f"Попробуйте создать анализ заново."
             )
 
+    async def _run_pipeline_without_table(self, user_id: int, session: UserSession, table_status: str):
+        """
+        Фоновый анализ без таблицы N8N (N8N недоступен, вернул ошибку или не ответил вовремя)
+        
+        С включенным пулом таблиц (SHEETS_POOL_SIZE > 0) таблицу создает сам бот;
+        иначе или если это не удалось - анализ идет без таблицы.
+        """
+        try:
+            spreadsheet_info = await self._create_fallback_table(user_id, session)
+            if spreadsheet_info is not None:
+                await self._start_sequential_webhooks(user_id, spreadsheet_info, session)
+                return
+            # Итог (со статусом таблицы) - в том же сообщении прогресса, без отдельной отправки
+            await self._start_sequential_webhooks_without_table(user_id, session, table_status)
+        finally:
+            self._end_session(user_id, session)
+    
+    def _fallback_notice(self) -> str:
+        """Строка для пользователя о том, как анализ продолжится без N8N"""
+        if self.google_service.pool is not None:
+            return "🚀 Создаю таблицу сам и продолжаю отправку в 9 систем..."
+        return "🚀 Продолжаю отправку данных в 9 систем без таблицы..."
+    
+    async def _create_fallback_table(self, user_id: int, session: UserSession):
+        """
+        Таблица анализа без N8N: пустая таблица из пула переименовывается
+        и заполняется одним batchUpdate (пул пуст - обычное создание)
+        
+        Возвращает spreadsheet_info в формате ответа N8N или None.
+        """
+        if self.google_service.pool is None:
+            return None
+        try:
+            spreadsheet_id, sheet_title = await self.google_service.create_spreadsheet_async(
+                session.user_data, user_id
+            )
+        except Exception as e:
+            logger.error(f'Ошибка создания таблицы без N8N для пользователя {user_id}: {e}')
+            return None
+        if not spreadsheet_id:
+            return None
+        logger.info(f'📊 Таблица без N8N для пользователя {user_id}: {spreadsheet_id}')
+        return {
+            'spreadsheet_id': spreadsheet_id,
+            'spreadsheet_url': self.google_service.get_spreadsheet_url(spreadsheet_id),
+            'sheet_title': sheet_title,
+            'created_at': datetime.now().isoformat()
+        }
+
+    async def _resume_pipeline(self, run: Dict[str, Any]):
+        """Продолжает анализ, прерванный перезапуском, с последнего обработанного webhook'а"""
+        user_id = run['user_id']
+        try:
+            logger.info(f"🔄 Продолжаю анализ {run['run_id']} пользователя {user_id} "
+                        f"(обработано: {sorted(run['completed'])})")
+            
+            progress = create_progress_sink(
+                self.application.bot, user_id,
+                header="🔄 Бот был перезапущен. Продолжаю отправку вашего анализа "
+                       "с последней обработанной системы..."
+            )
+            await progress.start()
+            
+            spreadsheet_info = run['spreadsheet_info']
+            webhook_results = await self.sequential_webhook_service.send_webhooks_sequentially(
+                user_id=user_id,
+                user_data=run['user_data'],
+                spreadsheet_info=spreadsheet_info,
+                progress_callback=progress,
+                run_id=run['run_id'],
+                completed=run['completed']
+            )
+            
+            successful = sum(1 for success in webhook_results.values() if success)
+            total = len(webhook_results)
+            
+            await progress.finish(
+                f"🏁 Процесс завершен!\n\n"
+                f"📊 Таблица: {spreadsheet_info.get('sheet_title', 'Таблица не создана')}\n"
+                f"📡 Обработано систем: {successful}/{total}\n\n"
+                f"✅ Анализ целевой аудитории готов!"
+            )
+            # Анализ без таблицы хранит заглушку not_available - в общую таблицу пишем пустую ссылку
+            has_table = spreadsheet_info.get('spreadsheet_id', 'not_available') != 'not_available'
+            self.google_service.record_analysis(
+                user_id, run['user_data'], spreadsheet_info.get('spreadsheet_url', '') if has_table else '',
+                f"{successful}/{total}"
+            )
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'Ошибка продолжения анализа {run["run_id"]} для пользователя {user_id}: {e}')
+
+    def _on_n8n_deadline(self, user_id: int, request_id: str):
+        """Срабатывание дедлайна N8N: обработка таймаута идет фоновой задачей"""
+        self.n8n_deadlines.pop(request_id, None)
+        self._spawn_background(self._n8n_timeout_handler(user_id, request_id))
+
     async def _n8n_timeout_handler(self, user_id: int, request_id: str):
         """Обработчик таймаута для N8N - если таблица не создается за 5 минут"""
         try:
-            # Ждем 5 минут (300 секунд)
-            await asyncio.sleep(300)
-            
             # Проверяем, есть ли еще пользователь в сессии с этим request_id
-            if user_id in self.user_sessions:
-                session = self.user_sessions[user_id]
-                if session.get('n8n_request_id') == request_id:
+            session = self.user_sessions.peek(user_id)
+            if session is not None:
+                if session.n8n_request_id == request_id:
+                    # Таблица могла прийти на другую реплику - тогда таймаут не действует
+                    if not await self.n8n_service.claim_request(request_id, outcome='expired'):
+                        logger.info(f'N8N запрос {request_id} уже обработан, таймаут пропущен')
+                        self._unbind_n8n_request(request_id, stale=True)
+                        return
+                    
                     logger.warning(f'⏰ Таймаут N8N для пользователя {user_id}, request_id: {request_id}')
                     logger.warning(f'🔍 Статус N8N запроса: {self.n8n_service.pending_requests.get(request_id, "НЕ НАЙДЕН")}')
                     logger.warning(f'📊 Всего активных N8N запросов: {len(self.n8n_service.pending_requests)}')
                     
+                    # Снимаем привязку: поздний ответ N8N не запустит вторую цепочку
+                    self._unbind_n8n_request(request_id)
+                    
                     # Проверяем что application инициализировано
                     if not self.application:
                         logger.error(f'Application не инициализировано в таймауте для пользователя {user_id}')
@@ -640,11 +1011,15 @@ class TargetAudienceBot:
                     await self.application.bot.send_message(
                         chat_id=user_id,
                         text=f"⏰ Таймаут N8N (5 минут истекло)\n"
-                             f"🚀 Продолжаю без таблицы - отправляю в 9 систем..."
+                             f"{self._fallback_notice()}"
                     )
                     
                     # Запускаем webhook'и без таблицы
-                    await self._start_sequential_webhooks_without_table(user_id, session)
+                    await self._enqueue_pipeline(
+                        user_id,
+                        lambda: self._run_pipeline_without_table(user_id, session, "Не создана (таймаут N8N)"),
+                        name=request_id, session=session
+                    )
                     
         except Exception as e:
             logger.error(f'Ошибка в таймауте N8N для пользователя {user_id}: {e}')
@@ -652,10 +1027,24 @@ class TargetAudienceBot:
     async def handle_webhook_response(self, response_data: Dict[str, Any]):
         """Обрабатывает ответы от webhook'ов (ready статус)"""
         try:
-            return self.sequential_webhook_service.handle_webhook_response(response_data)
+            service = self.sequential_webhook_service
+            run_key = service.get_response_run_key(response_data)
+            if self.state_backend.shared and run_key is not None and not service.has_run(run_key):
+                # Анализ выполняет другая реплика: передаем ответ через общее состояние
+                await self.state_backend.publish(CHANNEL_WEBHOOK_RESPONSE, response_data)
+                logger.info(f"📡 Ответ {response_data.get('webhook_id')} для пользователя {run_key} передан другим репликам")
+                return True
+            return service.handle_webhook_response(response_data)
         except Exception as e:
             logger.error(f'Ошибка обработки ответа webhook: {e}')
             return False
+    
+    async def _on_shared_webhook_response(self, response_data: Dict[str, Any]):
+        """Ответ системы, принятый другой репликой: разрешаем шаг, если анализ выполняется здесь"""
+        service = self.sequential_webhook_service
+        run_key = service.get_response_run_key(response_data)
+        if run_key is not None and service.has_run(run_key):
+            service.handle_webhook_response(response_data)
 
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
@@ -718,7 +1107,16 @@ def main():
         connect_timeout=config.CONNECT_TIMEOUT
     )
     
-    application = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN).request(request).build()
+    application = (
+        ApplicationBuilder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .request(request)
+        .rate_limiter(bot.rate_limiter)    # Глобальный и по-чатовые лимиты Telegram
+        .concurrent_updates(config.CONCURRENT_UPDATES)  # Обработчики не ждут друг друга
+        .post_init(bot.post_init)          # Запуск HTTP пула и webhook сервера
+        .post_shutdown(bot.post_shutdown)  # Остановка webhook сервера и HTTP пула
+        .build()
+    )
     
     # Устанавливаем application в бота для доступа к bot API
     bot.application = application
@@ -727,6 +1125,7 @@ def main():
     application.add_handler(CommandHandler("start", bot.start))
     application.add_handler(CommandHandler("cleanup", bot.admin_cleanup))  # Админская команда
     application.add_handler(CommandHandler("debug_n8n", bot.admin_debug_n8n))  # Диагностика N8N
+    application.add_handler(CommandHandler("sessions", bot.admin_sessions))  # Сессии и память
     application.add_handler(CallbackQueryHandler(bot.button_callback))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
     application.add_error_handler(bot.error_handler)
@@ -734,6 +1133,18 @@ def main():
     # Запуск бота
     print("🤖 Бот запущен! Нажмите Ctrl+C для остановки.")
     
+    if config.TELEGRAM_MODE == MODE_WEBHOOK:
+        if not config.TELEGRAM_WEBHOOK_URL:
+            print("❌ Ошибка: для TELEGRAM_MODE=webhook нужен TELEGRAM_WEBHOOK_URL!")
+            return
+        if not config.TELEGRAM_WEBHOOK_SECRET:
+            # Без секрета любой, кто знает адрес, может прислать обновление от имени администратора
+            print("❌ Ошибка: для TELEGRAM_MODE=webhook нужен TELEGRAM_WEBHOOK_SECRET!")
+            return
+        # Обновления приходят на порт webhook сервера, постоянного соединения с Telegram нет
+        asyncio.run(run_webhook_mode(application, bot))
+        return
+    
     # Настройки polling с улучшенной обработкой ошибок
     application.run_polling(
         allowed_updates=Update.ALL_TYPES,
@@ -0,0 +1,151 @@
+"""Автоматические выключатели (circuit breaker) для систем-получателей webhook'ов"""
+import logging
+import time
+from typing import Any, Dict, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'        # Система работает, запросы идут как обычно
+OPEN = 'open'            # Система недоступна, запросы отклоняются сразу
+HALF_OPEN = 'half_open'  # Пробные запросы: проверяем, восстановилась ли система
+
+
+class CircuitBreaker:
+    """
+    Выключатель одной системы
+
+    - closed: failure_threshold неудач подряд переводят в open
+    - open: запросы отклоняются без отправки; через open_seconds - half_open
+    - half_open: пропускается не больше half_open_probes пробных запросов;
+      успех закрывает выключатель, неудача снова открывает его на удвоенное
+      время (не больше open_max_seconds)
+    """
+
+    __slots__ = ('name', 'failure_threshold', 'open_seconds', 'open_max_seconds', 'half_open_probes',
+                 'state', 'failures', 'opened_at', 'open_for', 'probes_in_flight',
+                 'rejected', 'opened_total')
+
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float,
+                 open_max_seconds: float, half_open_probes: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.open_max_seconds = open_max_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_for = open_seconds
+        self.probes_in_flight = 0
+        self.rejected = 0
+        self.opened_total = 0
+
+    def is_open(self) -> bool:
+        """True, если запрос сейчас будет отклонен (не занимает пробный слот)"""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at < self.open_for
+        if self.state == HALF_OPEN:
+            return self.probes_in_flight >= self.half_open_probes
+        return False
+
+    def allow_request(self) -> bool:
+        """Разрешает запрос; в half_open занимает пробный слот"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_for:
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+            logger.info(f"🔌 {self.name}: выключатель полуоткрыт, отправляю пробный запрос")
+
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.probes_in_flight < self.half_open_probes:
+            self.probes_in_flight += 1
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"✅ {self.name}: система восстановилась, выключатель закрыт")
+        self.state = CLOSED
+        self.failures = 0
+        self.open_for = self.open_seconds
+        self.probes_in_flight = 0
+
+    def record_failure(self):
+        if self.state == HALF_OPEN:
+            # Пробный запрос не прошел - открываем снова на больший срок
+            self._open(min(self.open_for * 2, self.open_max_seconds))
+            return
+        self.failures += 1
+        if self.state == CLOSED and self.failures >= self.failure_threshold:
+            self._open(self.open_seconds)
+
+    def record_abandoned(self):
+        """Запрос прерван без результата (отмена) - освобождаем пробный слот"""
+        if self.state == HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+    def retry_after(self) -> float:
+        """Через сколько секунд выключатель пропустит пробный запрос"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_for - (time.monotonic() - self.opened_at))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'retry_after_seconds': round(self.retry_after(), 1),
+            'rejected_total': self.rejected,
+            'opened_total': self.opened_total
+        }
+
+    def _open(self, open_for: float):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.open_for = open_for
+        self.probes_in_flight = 0
+        self.opened_total += 1
+        logger.warning(f"⛔ {self.name}: выключатель открыт на {open_for:.0f} сек "
+                       f"(неудач подряд: {self.failures})")
+
+
+class CircuitBreakerRegistry:
+    """Выключатели по системам; создаются при первом обращении"""
+
+    def __init__(self, failure_threshold: Optional[int] = None, open_seconds: Optional[float] = None,
+                 open_max_seconds: Optional[float] = None, half_open_probes: Optional[int] = None):
+        self.failure_threshold = failure_threshold or config.CIRCUIT_FAILURE_THRESHOLD
+        self.open_seconds = open_seconds or config.CIRCUIT_OPEN_SECONDS
+        self.open_max_seconds = open_max_seconds or config.CIRCUIT_OPEN_MAX_SECONDS
+        self.half_open_probes = half_open_probes or config.CIRCUIT_HALF_OPEN_PROBES
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, target: str) -> CircuitBreaker:
+        breaker = self._breakers.get(target)
+        if breaker is None:
+            breaker = CircuitBreaker(target, self.failure_threshold, self.open_seconds,
+                                     self.open_max_seconds, self.half_open_probes)
+            self._breakers[target] = breaker
+        return breaker
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {target: breaker.get_stats() for target, breaker in self._breakers.items()}
+
+    def get_open_targets(self) -> Dict[str, str]:
+        """Системы, выключатель которых не закрыт: {система: состояние}"""
+        return {target: breaker.state for target, breaker in self._breakers.items() if breaker.state != CLOSED}
+
+
+_shared_registry: Optional[CircuitBreakerRegistry] = None
+
+
+def get_circuit_breakers() -> CircuitBreakerRegistry:
+    """Возвращает общий для процесса набор выключателей"""
+    global _shared_registry
+    if _shared_registry is None:
+        _shared_registry = CircuitBreakerRegistry()
+    return _shared_registry
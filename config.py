@@ -7,9 +7,19 @@ load_dotenv()
 # Telegram настройки
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
+# Каталог для локального состояния бота (outbox и т.п.)
+STATE_DIR = os.getenv('STATE_DIR', 'data')
+
 # Webhook сервер настройки
 WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8085))
 
+# Получение обновлений Telegram: polling или webhook (на порту WEBHOOK_PORT)
+TELEGRAM_MODE = os.getenv('TELEGRAM_MODE', 'polling').lower()
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')  # Публичный https адрес сервера
+TELEGRAM_WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH', '/webhook/telegram')
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')  # Заголовок X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv('TELEGRAM_WEBHOOK_MAX_CONNECTIONS', 40))
+
 # Настройки пула соединений для Telegram API
 CONNECTION_POOL_SIZE = int(os.getenv('CONNECTION_POOL_SIZE', 20))
 POOL_TIMEOUT = float(os.getenv('POOL_TIMEOUT', 30.0))
@@ -17,9 +27,44 @@ READ_TIMEOUT = float(os.getenv('READ_TIMEOUT', 30.0))
 WRITE_TIMEOUT = float(os.getenv('WRITE_TIMEOUT', 30.0))
 CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', 10.0))
 
+# Общий HTTP клиент для исходящих webhook'ов
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 10))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 60.0))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', 300))
+# Индивидуальные лимиты соединений: "host1=20,host2:8443=5"
+HTTP_POOL_HOST_LIMITS = {
+    host.strip(): int(limit)
+    for host, _, limit in (
+        item.partition('=') for item in os.getenv('HTTP_POOL_HOST_LIMITS', '').split(',') if '=' in item
+    )
+}
+
 # Google API настройки
 GOOGLE_CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
 GOOGLE_DRIVE_FOLDER_ID = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
+GOOGLE_SHEETS_BASE_URL = os.getenv('GOOGLE_SHEETS_BASE_URL', 'https://sheets.googleapis.com')
+GOOGLE_SHEETS_MAX_CONCURRENCY = int(os.getenv('GOOGLE_SHEETS_MAX_CONCURRENCY', 10))  # Запросов к Sheets одновременно
+GOOGLE_SHEETS_TIMEOUT = float(os.getenv('GOOGLE_SHEETS_TIMEOUT', 30.0))
+GOOGLE_TOKEN_REFRESH_MARGIN = float(os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN', 300))  # Обновление токена до истечения, сек
+
+SHEETS_MODE = os.getenv('SHEETS_MODE', 'file').lower()  # file | user_tabs
+SHEETS_USER_INDEX_PATH = os.getenv('SHEETS_USER_INDEX_PATH', os.path.join(STATE_DIR, 'user_spreadsheets.json'))
+
+# Пул заранее созданных пустых таблиц (0 - выключен)
+SHEETS_POOL_SIZE = int(os.getenv('SHEETS_POOL_SIZE', 0))                 # Минимум готовых таблиц
+SHEETS_POOL_MAX_SIZE = int(os.getenv('SHEETS_POOL_MAX_SIZE', 20))        # Предел при высоком спросе
+SHEETS_POOL_CREATES_PER_MINUTE = int(os.getenv('SHEETS_POOL_CREATES_PER_MINUTE', 30))  # Квота на пополнение
+SHEETS_POOL_PATH = os.getenv('SHEETS_POOL_PATH', os.path.join(STATE_DIR, 'sheets_pool.json'))
+
+# Общая таблица результатов: строка на каждый анализ, запись пакетами (пустой id - выключено)
+SHEETS_MASTER_SPREADSHEET_ID = os.getenv('SHEETS_MASTER_SPREADSHEET_ID')
+SHEETS_MASTER_RANGE = os.getenv('SHEETS_MASTER_RANGE', 'A1')                          # Таблица для values.append
+SHEETS_MASTER_FLUSH_INTERVAL = float(os.getenv('SHEETS_MASTER_FLUSH_INTERVAL', 5))    # Пакет раз в N сек
+SHEETS_MASTER_BATCH_SIZE = int(os.getenv('SHEETS_MASTER_BATCH_SIZE', 500))            # ...или по набору строк
+SHEETS_MASTER_MAX_BUFFER = int(os.getenv('SHEETS_MASTER_MAX_BUFFER', 10000))          # Сверх - в файл
+SHEETS_MASTER_RETRY_BASE_DELAY = float(os.getenv('SHEETS_MASTER_RETRY_BASE_DELAY', 1))
+SHEETS_MASTER_RETRY_MAX_DELAY = float(os.getenv('SHEETS_MASTER_RETRY_MAX_DELAY', 60))
+SHEETS_MASTER_SPILL_PATH = os.getenv('SHEETS_MASTER_SPILL_PATH', os.path.join(STATE_DIR, 'master_rows.jsonl'))
 
 # Webhook настройки
 WEBHOOKS = {
@@ -34,10 +79,94 @@ WEBHOOKS = {
     'webhook_9': os.getenv('WEBHOOK_URL_9'),
 }
 
+# Зависимости между webhook'ами:
+#   chain (по умолчанию) - строго по очереди webhook_1 -> webhook_2 -> ...
+#   parallel - все независимы
+#   "webhook_2:webhook_1;webhook_4:webhook_2,webhook_3" - явный граф
+#   (webhook'и без зависимостей запускаются сразу)
+WEBHOOK_DEPENDENCIES = os.getenv('WEBHOOK_DEPENDENCIES', 'chain')
+
+# Лимит одновременных запросов к каждой системе (общий для всех пользователей)
+WEBHOOK_TARGET_CONCURRENCY = int(os.getenv('WEBHOOK_TARGET_CONCURRENCY', 20))
+# Индивидуальные лимиты: "webhook_1=5,webhook_2=10"
+WEBHOOK_TARGET_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition('=') for item in os.getenv('WEBHOOK_TARGET_LIMITS', '').split(',') if '=' in item
+    )
+}
+
+# Outbox анализов: продолжение незавершенных отправок после перезапуска
+OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+OUTBOX_DB_PATH = os.getenv('OUTBOX_DB_PATH', os.path.join(STATE_DIR, 'outbox.sqlite3'))
+OUTBOX_FLUSH_INTERVAL = float(os.getenv('OUTBOX_FLUSH_INTERVAL', 0.2))  # Секунды между пакетами
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))  # Досрочная запись пакета
+
+# Общее состояние реплик (сессии, N8N запросы, ответы систем): memory, redis или sqlite
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+STATE_KEY_PREFIX = os.getenv('STATE_KEY_PREFIX', 'tabot:')  # Префикс ключей и каналов Redis
+STATE_SQLITE_PATH = os.getenv('STATE_SQLITE_PATH', os.path.join(STATE_DIR, 'state.sqlite3'))
+STATE_POLL_INTERVAL = float(os.getenv('STATE_POLL_INTERVAL', 0.2))  # Опрос событий SQLite, сек
+
+# Адаптивные таймауты webhook'ов: p99 наблюдаемой задержки плюс запас
+ADAPTIVE_TIMEOUTS_ENABLED = os.getenv('ADAPTIVE_TIMEOUTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LATENCY_STATE_PATH = os.getenv('LATENCY_STATE_PATH', os.path.join(STATE_DIR, 'latency.json'))
+WEBHOOK_ACK_TIMEOUT_MIN = float(os.getenv('WEBHOOK_ACK_TIMEOUT_MIN', 5))      # Ответ на POST
+WEBHOOK_ACK_TIMEOUT_MAX = float(os.getenv('WEBHOOK_ACK_TIMEOUT_MAX', 30))
+WEBHOOK_READY_TIMEOUT_MIN = float(os.getenv('WEBHOOK_READY_TIMEOUT_MIN', 20))  # Callback 'ready'
+WEBHOOK_READY_TIMEOUT_MAX = float(os.getenv('WEBHOOK_READY_TIMEOUT_MAX', 180))
+TIMEOUT_MARGIN_RATIO = float(os.getenv('TIMEOUT_MARGIN_RATIO', 0.5))    # Запас: p99 * (1 + ratio)
+TIMEOUT_MARGIN_SECONDS = float(os.getenv('TIMEOUT_MARGIN_SECONDS', 2))  # ... плюс секунды
+TIMEOUT_MIN_SAMPLES = int(os.getenv('TIMEOUT_MIN_SAMPLES', 20))  # До этого - максимальный таймаут
+
+# Выключатели (circuit breaker) систем: недоступная система отклоняется сразу
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 3))  # Неудач подряд до открытия
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', 30))         # Пауза до пробного запроса
+CIRCUIT_OPEN_MAX_SECONDS = float(os.getenv('CIRCUIT_OPEN_MAX_SECONDS', 300))  # Предел удвоения паузы
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', 1))    # Пробных запросов одновременно
+
+# Повторы POST-запросов к системам при временных ошибках (5xx, 429, обрыв соединения)
+WEBHOOK_RETRY_ATTEMPTS = int(os.getenv('WEBHOOK_RETRY_ATTEMPTS', 3))            # Всего попыток
+WEBHOOK_RETRY_BASE_DELAY = float(os.getenv('WEBHOOK_RETRY_BASE_DELAY', 0.5))    # Базовая пауза backoff
+WEBHOOK_RETRY_MAX_DELAY = float(os.getenv('WEBHOOK_RETRY_MAX_DELAY', 8))
+WEBHOOK_RETRY_BUDGET_RATIO = float(os.getenv('WEBHOOK_RETRY_BUDGET_RATIO', 0.2))  # Повторов на запрос
+WEBHOOK_RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('WEBHOOK_RETRY_BUDGET_MIN_PER_SECOND', 0.5))
+# Hedging: дубликат запроса, если система не ответила за обычный p95
+WEBHOOK_HEDGING_ENABLED = os.getenv('WEBHOOK_HEDGING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_HEDGE_PERCENTILE = float(os.getenv('WEBHOOK_HEDGE_PERCENTILE', 0.95))
+
+# Прогресс анализа: 'edit' - одно обновляемое сообщение, 'messages' - сообщение на каждое событие
+PROGRESS_MODE = os.getenv('PROGRESS_MODE', 'edit')
+PROGRESS_FLUSH_INTERVAL = float(os.getenv('PROGRESS_FLUSH_INTERVAL', 3))  # Не чаще одного обновления за N сек
+
+# Лимиты исходящих запросов к Telegram (https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))          # Запросов в секунду на бота
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))              # В секунду в личный чат
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', 3))              # Кратковременный всплеск в чат
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_GROUP_RATE_PER_MINUTE', 20))  # В минуту в группу
+TELEGRAM_QUEUE_MAX = int(os.getenv('TELEGRAM_QUEUE_MAX', 1000))             # Запросов в очереди приоритета
+TELEGRAM_MAX_RETRY_AFTER = int(os.getenv('TELEGRAM_MAX_RETRY_AFTER', 3))    # Повторов после RetryAfter
+
+# Фоновые анализы и обработка обновлений Telegram
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', 20))        # Анализов одновременно
+PIPELINE_QUEUE_MAX = int(os.getenv('PIPELINE_QUEUE_MAX', 1000))  # Анализов в очереди
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))    # Обновлений Telegram одновременно
+
+# Сессии пользователей
+SESSION_IDLE_TTL_SECONDS = float(os.getenv('SESSION_IDLE_TTL_SECONDS', 3600))  # Неактивная сессия вытесняется
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', 100000))               # Сессий в памяти, сверх - LRU
+
 # N8N настройки
 N8N_SHEETS_WEBHOOK_URL = os.getenv('N8N_SHEETS_WEBHOOK_URL')  # Старая переменная (deprecated)
 N8N_OUTGOING_WEBHOOK_URL = os.getenv('N8N_OUTGOING_WEBHOOK_URL')  # Новая для отправки данных
 
+# Хранилище ожидающих N8N запросов
+N8N_REQUEST_TTL_SECONDS = float(os.getenv('N8N_REQUEST_TTL_SECONDS', 3600))  # Ожидающий запрос
+N8N_COMPLETED_TTL_SECONDS = float(os.getenv('N8N_COMPLETED_TTL_SECONDS', 600))  # Завершенный запрос
+N8N_PENDING_MAX_SIZE = int(os.getenv('N8N_PENDING_MAX_SIZE', 10000))
+N8N_PENDING_MEMORY_BUDGET_MB = int(os.getenv('N8N_PENDING_MEMORY_BUDGET_MB', 32))
+
 # Сообщения бота
 WELCOME_MESSAGE = """
 👋 Привет! Я помогу вам провести анализ целевой аудитории.
@@ -0,0 +1,167 @@
+"""Центральный планировщик дедлайнов (таймауты N8N и ожидания webhook'ов)"""
+import asyncio
+import heapq
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """Зарегистрированный дедлайн; cancel() снимает его, когда работа завершена"""
+
+    __slots__ = ('when', 'callback', 'args', 'name', 'cancelled', 'fired', '_scheduler')
+
+    def __init__(self, scheduler: 'DeadlineScheduler', when: float,
+                 callback: Callable, args: tuple, name: Optional[str]):
+        self._scheduler = scheduler
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.name = name
+        self.cancelled = False
+        self.fired = False
+
+    def cancel(self) -> bool:
+        """Отменяет дедлайн, если он еще не сработал"""
+        if self.cancelled or self.fired:
+            return False
+        self.cancelled = True
+        self._scheduler._on_cancel()
+        return True
+
+    def __lt__(self, other: 'Deadline') -> bool:
+        return self.when < other.when
+
+
+class DeadlineScheduler:
+    """
+    Один heap дедлайнов и один таймер event loop'а на весь процесс
+
+    Вместо тысяч задач, спящих по 180-300 секунд, все таймауты регистрируются
+    здесь. Таймер loop'а всегда взведен только на ближайший дедлайн;
+    отмененные дедлайны удаляются из heap'а лениво.
+
+    Колбэки вызываются синхронно в event loop; долгую работу колбэк должен
+    запускать отдельной задачей.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_when: Optional[float] = None
+
+        self._pending = 0
+        self._cancelled_in_heap = 0
+        self._fired = 0
+        self._cancelled = 0
+        self._lateness_total = 0.0
+        self._lateness_max = 0.0
+
+    def schedule(self, delay: float, callback: Callable, *args: Any, name: Optional[str] = None) -> Deadline:
+        """Регистрирует дедлайн через delay секунд"""
+        loop = self._bind_loop()
+        deadline = Deadline(self, loop.time() + delay, callback, args, name)
+        heapq.heappush(self._heap, deadline)
+        self._pending += 1
+        self._arm()
+        return deadline
+
+    def get_pending_count(self) -> int:
+        """Количество активных (не сработавших и не отмененных) дедлайнов"""
+        return self._pending
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики планировщика: ожидающие дедлайны и опоздание срабатывания"""
+        return {
+            'pending': self._pending,
+            'fired': self._fired,
+            'cancelled': self._cancelled,
+            'lateness_avg_ms': round(self._lateness_total / self._fired * 1000, 3) if self._fired else 0.0,
+            'lateness_max_ms': round(self._lateness_max * 1000, 3)
+        }
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None and not self._loop.is_closed() and self._pending:
+                raise RuntimeError('DeadlineScheduler уже используется другим event loop')
+            # Прежний loop закрыт - его дедлайны уже не сработают
+            self._heap.clear()
+            self._pending = 0
+            self._cancelled_in_heap = 0
+            self._timer = None
+            self._timer_when = None
+            self._loop = loop
+        return loop
+
+    def _on_cancel(self):
+        self._pending -= 1
+        self._cancelled += 1
+        self._cancelled_in_heap += 1
+
+        # Отмененных слишком много - перестраиваем heap
+        if self._cancelled_in_heap > 64 and self._cancelled_in_heap > len(self._heap) // 2:
+            self._heap = [d for d in self._heap if not d.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_in_heap = 0
+
+    def _arm(self):
+        """Взводит таймер loop'а на ближайший дедлайн"""
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+            self._cancelled_in_heap -= 1
+
+        if not self._heap:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+                self._timer_when = None
+            return
+
+        when = self._heap[0].when
+        if self._timer is not None and self._timer_when <= when:
+            return
+
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_at(when, self._run)
+        self._timer_when = when
+
+    def _run(self):
+        """Срабатывание таймера: выполняет все наступившие дедлайны"""
+        self._timer = None
+        self._timer_when = None
+        now = self._loop.time()
+
+        while self._heap and self._heap[0].when <= now:
+            deadline = heapq.heappop(self._heap)
+            if deadline.cancelled:
+                self._cancelled_in_heap -= 1
+                continue
+
+            deadline.fired = True
+            self._pending -= 1
+            self._fired += 1
+            lateness = now - deadline.when
+            self._lateness_total += lateness
+            self._lateness_max = max(self._lateness_max, lateness)
+
+            try:
+                deadline.callback(*deadline.args)
+            except Exception as e:
+                logger.error(f"❌ Ошибка в обработчике дедлайна {deadline.name}: {e}")
+
+        self._arm()
+
+
+_shared_scheduler: Optional[DeadlineScheduler] = None
+
+
+def get_deadline_scheduler() -> DeadlineScheduler:
+    """Возвращает общий для процесса планировщик дедлайнов"""
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        _shared_scheduler = DeadlineScheduler()
+    return _shared_scheduler
@@ -1,25 +1,71 @@
 """Минимальный Google Sheets сервис только с базовыми операциями"""
+import asyncio
 import os
+import random
+import threading
 from datetime import datetime
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import config
+from google_sheets_async import AsyncSheetsClient, SheetsApiError
+import sheets_layout
+from sheets_write_coalescer import SheetsWriteCoalescer
+from spreadsheet_pool import SpreadsheetPool
+from user_spreadsheets import UserSpreadsheetIndex
+
+# Маска ответа create: данные листов обратно не нужны
+CREATE_RESPONSE_FIELDS = 'spreadsheetId,sheets.properties.sheetId'
+
+# Режимы SHEETS_MODE
+SHEETS_MODE_FILE = 'file'            # Новая таблица на каждый анализ
+SHEETS_MODE_USER_TABS = 'user_tabs'  # Одна таблица на пользователя, анализ - новая вкладка
+
+MAX_TAB_TITLE = 100  # Ограничение Sheets на длину названия листа
 
 class GoogleMinimalService:
-    def __init__(self):
+    """
+    Основной API асинхронный (*_async): запросы идут через AsyncSheetsClient
+    и не блокируют event loop бота. Синхронные методы сохранены как обертки:
+    они выполняют те же корутины в собственном event loop сервиса (отдельный
+    поток со своим клиентом, пулом соединений и кэшем токена).
+    """
+
+    def __init__(self, credentials=None, base_url=None, pool_size=None, mode=None):
         # Минимальные scopes только для Sheets
         self.scopes = [
             'https://www.googleapis.com/auth/spreadsheets'
         ]
+        self.base_url = base_url
+        # Сбрасывается, если API не принял данные листов в create: дальше сразу create + batchUpdate
+        self.create_with_data = True
+        
+        self.mode = mode or config.SHEETS_MODE
+        self.user_index = UserSpreadsheetIndex() if self.mode == SHEETS_MODE_USER_TABS else None
+        
+        self._sync_loop = None
+        self._sync_thread = None
+        self._sync_client = None
+        self._sync_lock = threading.Lock()
         
         try:
-            self.credentials = self._get_credentials()
-            self.sheets_service = build('sheets', 'v4', credentials=self.credentials)
+            self.credentials = credentials or self._get_credentials()
+            self.sheets_client = AsyncSheetsClient(self.credentials, base_url=base_url)
             print('✅ Минимальный Sheets сервис создан')
         except Exception as e:
             print(f'❌ Ошибка создания сервиса: {e}')
-            self.sheets_service = None
+            self.credentials = None
+            self.sheets_client = None
+        
+        # Пул пустых таблиц работает в event loop бота (start/close)
+        pool_size = config.SHEETS_POOL_SIZE if pool_size is None else pool_size
+        self.pool = None
+        if self.sheets_client is not None and pool_size > 0:
+            self.pool = SpreadsheetPool(self.sheets_client, target_size=pool_size,
+                                        create_fields=CREATE_RESPONSE_FIELDS)
+        
+        # Общая таблица результатов: строки всех пользователей пишутся пакетами
+        self.master_writer = None
+        if self.sheets_client is not None and config.SHEETS_MASTER_SPREADSHEET_ID:
+            self.master_writer = SheetsWriteCoalescer(self.sheets_client, config.SHEETS_MASTER_SPREADSHEET_ID)
 
     def _get_credentials(self):
         """Получение учетных данных для Google API"""
@@ -34,53 +80,96 @@ class GoogleMinimalService:
         print(f'📧 Сервисный аккаунт: {credentials.service_account_email}')
         return credentials
 
-    def create_spreadsheet(self, user_data):
-        """Создание Google таблицы минимальным способом"""
-        if not self.sheets_service:
+    async def start(self):
+        """Запускает пополнение пула таблиц и запись в общую таблицу (вызывается при старте бота)"""
+        if self.pool is not None:
+            await self.pool.start()
+        if self.master_writer is not None:
+            await self.master_writer.start()
+
+    async def close(self):
+        """Закрывает соединения клиентов (вызывается при остановке бота)"""
+        if self.pool is not None:
+            await self.pool.close()
+        if self.master_writer is not None:
+            await self.master_writer.close()
+        if self.sheets_client is not None:
+            await self.sheets_client.close()
+        with self._sync_lock:
+            loop, thread, client = self._sync_loop, self._sync_thread, self._sync_client
+            self._sync_loop = self._sync_thread = self._sync_client = None
+        if loop is not None:
+            # Ждем, не блокируя event loop бота: клиент закрывается в своем loop,
+            # после остановки loop закрывается в своем же потоке
+            try:
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.close(), loop))
+            finally:
+                loop.call_soon_threadsafe(loop.stop)
+                await asyncio.to_thread(thread.join)
+
+    @staticmethod
+    def _run_sync_loop(loop):
+        """Поток event loop синхронных оберток"""
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def _run_sync(self, method, *args):
+        """Выполняет асинхронный метод в event loop сервиса и ждет результат"""
+        with self._sync_lock:
+            if self._sync_loop is None:
+                self._sync_loop = asyncio.new_event_loop()
+                self._sync_thread = threading.Thread(target=self._run_sync_loop, args=(self._sync_loop,),
+                                                     name='google-sheets-sync', daemon=True)
+                self._sync_thread.start()
+                self._sync_client = AsyncSheetsClient(self.credentials, base_url=self.base_url)
+        return asyncio.run_coroutine_threadsafe(method(self._sync_client, *args), self._sync_loop).result()
+
+    def create_spreadsheet(self, user_data, user_id=None):
+        """Создание Google таблицы минимальным способом (синхронная обертка)"""
+        if not self.sheets_client:
             print('❌ Sheets сервис не инициализирован')
             return None, None
-            
+        return self._run_sync(self._create_spreadsheet, user_data, user_id)
+
+    async def create_spreadsheet_async(self, user_data, user_id=None):
+        """
+        Создание Google таблицы минимальным способом
+
+        В режиме user_tabs (с user_id) анализ добавляется вкладкой в таблицу
+        пользователя; возвращается (id таблицы, название вкладки).
+        """
+        if not self.sheets_client:
+            print('❌ Sheets сервис не инициализирован')
+            return None, None
+        return await self._create_spreadsheet(self.sheets_client, user_data, user_id)
+
+    async def _create_spreadsheet(self, client, user_data, user_id=None):
         try:
-            # Формирование названия таблицы
             current_date = datetime.now().strftime("%d.%m.%Y")
-            sheet_title = f"[{current_date}] – {user_data['profession']}"
-            
-            print(f'📊 Создание минимальной таблицы: {sheet_title}')
-            
-            # Простейшее создание таблицы
-            spreadsheet_body = {
-                'properties': {
-                    'title': sheet_title
-                }
-            }
-            
-            print('🔄 Отправка запроса в Sheets API...')
-            
-            spreadsheet = self.sheets_service.spreadsheets().create(
-                body=spreadsheet_body
-            ).execute()
-            
-            spreadsheet_id = spreadsheet['spreadsheetId']
-            print(f'✅ Таблица создана! ID: {spreadsheet_id}')
-            
-            # Заполнение данными одним запросом
-            print('📝 Добавление данных...')
-            self._add_data_simple(spreadsheet_id, user_data, current_date)
+            if self.user_index is not None and user_id is not None:
+                return await self._add_user_tab(client, user_id, user_data, current_date)
             
+            # Формирование названия таблицы
+            sheet_title = f"[{current_date}] – {user_data['profession']}"
+            print(f'📊 Создание таблицы: {sheet_title}')
+            spreadsheet_id = await self._new_spreadsheet(client, sheet_title, user_data, current_date)
             return spreadsheet_id, sheet_title
             
-        except HttpError as error:
+        except SheetsApiError as error:
             print(f'❌ HTTP ошибка: {error}')
-            print(f'Status: {error.resp.status}')
+            print(f'Status: {error.status}')
             
-            if error.resp.status == 403:
+            if error.status == 403:
                 if 'permission' in str(error).lower():
                     print('💡 Нет прав - проверьте IAM роли сервисного аккаунта')
                 elif 'quota' in str(error).lower():
                     print('💡 Проблема с квотой - возможно нужен биллинг')
                 else:
                     print('💡 Общая проблема доступа')
-            elif error.resp.status == 401:
+            elif error.status == 401:
                 print('💡 Проблема аутентификации - проверьте credentials')
             
             return None, None
@@ -88,41 +177,142 @@ class GoogleMinimalService:
             print(f'❌ Общая ошибка: {e}')
             return None, None
 
+    async def _new_spreadsheet(self, client, spreadsheet_title, user_data, current_date,
+                               sheet_title=sheets_layout.SHEET_TITLE):
+        """Новая таблица с листом анализа: из пула, одним create или create + batchUpdate"""
+        print('🔄 Отправка запроса в Sheets API...')
+        
+        # Готовая пустая таблица из пула: переименование и заполнение одним batchUpdate
+        spreadsheet_id = await self._fill_from_pool(client, spreadsheet_title, user_data, current_date, sheet_title)
+        if spreadsheet_id:
+            return spreadsheet_id
+        
+        spreadsheet = None
+        if self.create_with_data:
+            # Данные, оформление и свойства листа передаются в самом create
+            body = sheets_layout.spreadsheet_body(spreadsheet_title, user_data, current_date, sheet_title)
+            try:
+                spreadsheet = await client.create_spreadsheet(body, fields=CREATE_RESPONSE_FIELDS)
+                print(f"✅ Таблица создана с данными! ID: {spreadsheet['spreadsheetId']}")
+            except SheetsApiError as error:
+                if error.status != 400:
+                    raise
+                print(f'⚠️ Create с данными отклонен ({error.message}), заполнение через batchUpdate')
+                self.create_with_data = False
+        
+        if spreadsheet is None:
+            # Пустая таблица и одно заполнение
+            spreadsheet = await client.create_spreadsheet(
+                {'properties': {'title': spreadsheet_title}}, fields=CREATE_RESPONSE_FIELDS
+            )
+            print(f"✅ Таблица создана! ID: {spreadsheet['spreadsheetId']}")
+            try:
+                await self.fill_spreadsheet(client, spreadsheet['spreadsheetId'], self._first_sheet_id(spreadsheet),
+                                            user_data, current_date, sheet_title=sheet_title)
+                print('✅ Данные добавлены')
+            except Exception as e:
+                print(f'⚠️ Ошибка добавления данных: {e}')
+        
+        return spreadsheet['spreadsheetId']
+
+    async def _add_user_tab(self, client, user_id, user_data, current_date):
+        """Анализ новой вкладкой в таблице пользователя (одним batchUpdate)"""
+        spreadsheet_id = self.user_index.get(user_id)
+        if spreadsheet_id:
+            tab_title = self._tab_title(user_id, user_data, current_date)
+            print(f'📊 Новая вкладка в таблице пользователя: {tab_title}')
+            sheet_id = random.randint(1, 2 ** 31 - 1)
+            try:
+                await client.batch_update(
+                    spreadsheet_id, sheets_layout.add_tab_requests(sheet_id, tab_title, user_data, current_date)
+                )
+                self.user_index.tab_added(user_id)
+                print(f'✅ Вкладка добавлена! ID: {spreadsheet_id}')
+                return spreadsheet_id, tab_title
+            except SheetsApiError as error:
+                if error.status not in (403, 404):
+                    raise
+                # Таблицу удалили или закрыли доступ - заводим новую
+                print(f'⚠️ Таблица пользователя {spreadsheet_id} недоступна ({error.message}), создаем новую')
+                self.user_index.remove(user_id)
+        
+        tab_title = self._tab_title(user_id, user_data, current_date)
+        spreadsheet_title = f'Анализы ЦА – пользователь {user_id}'
+        print(f'📊 Создание таблицы пользователя: {spreadsheet_title}')
+        spreadsheet_id = await self._new_spreadsheet(client, spreadsheet_title, user_data, current_date, tab_title)
+        self.user_index.set(user_id, spreadsheet_id)
+        return spreadsheet_id, tab_title
+
+    def _tab_title(self, user_id, user_data, current_date):
+        # Номер делает название уникальным: Sheets не допускает одинаковых названий листов
+        number = self.user_index.tab_count(user_id) + 1
+        return f"{number}. [{current_date}] – {user_data['profession']}"[:MAX_TAB_TITLE]
+
+    async def _fill_from_pool(self, client, spreadsheet_title, user_data, current_date,
+                              sheet_title=sheets_layout.SHEET_TITLE):
+        """Берет таблицу из пула и заполняет ее; None - пул пуст или таблица недоступна"""
+        # Пул привязан к event loop бота, синхронная обертка его не использует
+        if self.pool is None or client is not self.sheets_client:
+            return None
+        entry = self.pool.claim()
+        if entry is None:
+            return None
+        try:
+            await self.fill_spreadsheet(client, entry['spreadsheet_id'], entry['sheet_id'], user_data,
+                                        current_date, spreadsheet_title=spreadsheet_title, sheet_title=sheet_title)
+        except Exception as e:
+            print(f"⚠️ Таблица из пула {entry['spreadsheet_id']} недоступна ({e}), создаем новую")
+            return None
+        print(f"✅ Таблица из пула заполнена! ID: {entry['spreadsheet_id']}")
+        return entry['spreadsheet_id']
+
+    async def fill_spreadsheet(self, client, spreadsheet_id, sheet_id, user_data, current_date,
+                               spreadsheet_title=None, sheet_title=sheets_layout.SHEET_TITLE):
+        """Заполнение существующей таблицы одним batchUpdate (данные, оформление, свойства)"""
+        requests = sheets_layout.fill_requests(sheet_id, user_data, current_date, spreadsheet_title, sheet_title)
+        await client.batch_update(spreadsheet_id, requests)
+
+    @staticmethod
+    def _first_sheet_id(spreadsheet):
+        sheets = spreadsheet.get('sheets') or [{}]
+        return sheets[0].get('properties', {}).get('sheetId', 0)
+
     def _add_data_simple(self, spreadsheet_id, user_data, current_date):
+        """Простое добавление данных в таблицу (синхронная обертка)"""
+        self._run_sync(self._add_data, spreadsheet_id, user_data, current_date)
+
+    async def _add_data(self, client, spreadsheet_id, user_data, current_date):
         """Простое добавление данных в таблицу"""
         try:
-            values = [
-                ['🎯 АНАЛИЗ ЦЕЛЕВОЙ АУДИТОРИИ'],
-                [''],
-                ['Профессия эксперта:', user_data['profession']],
-                ['Сегментация:', user_data['segmentation']],
-                ['Идеальный клиент:', user_data['ideal_client']],
-                ['Дата анализа:', current_date]
-            ]
-            
-            body = {
-                'values': values
-            }
-            
-            self.sheets_service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range='A1',
-                valueInputOption='RAW',
-                body=body
-            ).execute()
+            values = sheets_layout.analysis_rows(user_data, current_date)
+            await client.update_values(spreadsheet_id, 'A1', values, value_input_option='RAW')
             
             print('✅ Данные добавлены')
             
         except Exception as e:
             print(f'⚠️ Ошибка добавления данных: {e}')
 
+    def record_analysis(self, user_id, user_data, spreadsheet_url='', systems=''):
+        """Строка анализа в общую таблицу результатов (запись пакетами в фоне)"""
+        if self.master_writer is None:
+            return
+        self.master_writer.add([
+            datetime.now().strftime('%d.%m.%Y %H:%M:%S'),
+            str(user_id),
+            user_data.get('profession', ''),
+            user_data.get('segmentation', ''),
+            user_data.get('ideal_client', ''),
+            spreadsheet_url,
+            systems
+        ])
+
     def get_spreadsheet_url(self, spreadsheet_id):
         """Получение URL таблицы"""
         return f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit"
 
     def test_minimal(self):
         """Минимальный тест"""
-        if not self.sheets_service:
+        if not self.sheets_client:
             return False
             
         try:
@@ -134,7 +324,7 @@ class GoogleMinimalService:
             }
             
             print('🔄 Минимальный тест создания таблицы...')
-            result = self.sheets_service.spreadsheets().create(body=test_body).execute()
+            result = self._run_sync(AsyncSheetsClient.create_spreadsheet, test_body)
             test_id = result['spreadsheetId']
             
             print(f'🎉 МИНИМАЛЬНЫЙ ТЕСТ УСПЕШЕН!')
@@ -155,7 +345,7 @@ def main():
     
     service = GoogleMinimalService()
     
-    if not service.sheets_service:
+    if not service.sheets_client:
         print('❌ Не удалось создать сервис')
         return
     
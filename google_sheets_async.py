@@ -0,0 +1,216 @@
+"""Асинхронный клиент Google Sheets API v4 (HTTP/2, кэш токена, ограничение параллельности)"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+import httpx
+from google.auth.transport.requests import Request
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsApiError(Exception):
+    """Ошибка Sheets API: HTTP статус и текст ответа"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class AsyncSheetsClient:
+    """
+    Клиент Sheets API, не блокирующий event loop
+
+    - один httpx.AsyncClient с HTTP/2: запросы мультиплексируются в
+      долгоживущем соединении, рукопожатие TLS выполняется один раз
+    - access token OAuth кэшируется; фоновая задача обновляет его за
+      refresh_margin секунд до истечения, поэтому запросы не ждут обновления.
+      google-auth обновляет токен синхронно - это делается в потоке
+    - одновременно выполняется не больше max_concurrency запросов
+    - при 401 токен обновляется и запрос повторяется один раз
+
+    credentials - учетные данные google-auth (нужны token, expiry и refresh()).
+    Клиент привязан к event loop, в котором выполнен первый запрос.
+    """
+
+    def __init__(self, credentials, base_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 refresh_margin: Optional[float] = None,
+                 timeout: Optional[float] = None):
+        self.credentials = credentials
+        self.base_url = (base_url or config.GOOGLE_SHEETS_BASE_URL).rstrip('/')
+        self.max_concurrency = max_concurrency or config.GOOGLE_SHEETS_MAX_CONCURRENCY
+        self.refresh_margin = config.GOOGLE_TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.timeout = timeout or config.GOOGLE_SHEETS_TIMEOUT
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+        self.requests = 0
+        self.errors = 0
+        self.token_refreshes = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.http_versions: Dict[str, int] = {}
+
+    async def start(self):
+        """Создает пул соединений и получает первый токен"""
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency
+            )
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._refresh_lock = asyncio.Lock()
+        if not self._token_valid(self.refresh_margin):
+            await self._refresh_token()
+        self._refresher = asyncio.create_task(self._refresh_loop())
+        logger.info(f"📊 Sheets клиент запущен ({self.base_url}, параллельно до {self.max_concurrency})")
+
+    async def close(self):
+        """Останавливает обновление токена и закрывает соединения"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---- Методы Sheets API ----
+
+    async def create_spreadsheet(self, body: Dict[str, Any], fields: Optional[str] = None) -> Dict[str, Any]:
+        """spreadsheets.create (fields - маска ответа, чтобы не получать данные листов обратно)"""
+        params = {'fields': fields} if fields else None
+        return await self.request('POST', '/v4/spreadsheets', json=body, params=params)
+
+    async def update_values(self, spreadsheet_id: str, range_name: str, values: List[List[Any]],
+                            value_input_option: str = 'RAW') -> Dict[str, Any]:
+        """spreadsheets.values.update"""
+        return await self.request(
+            'PUT', f'/v4/spreadsheets/{spreadsheet_id}/values/{quote(range_name, safe="")}',
+            params={'valueInputOption': value_input_option},
+            json={'values': values}
+        )
+
+    async def append_values(self, spreadsheet_id: str, range_name: str, values: List[List[Any]],
+                            value_input_option: str = 'RAW') -> Dict[str, Any]:
+        """spreadsheets.values.append: строки добавляются после таблицы в range_name"""
+        return await self.request(
+            'POST', f'/v4/spreadsheets/{spreadsheet_id}/values/{quote(range_name, safe="")}:append',
+            params={'valueInputOption': value_input_option, 'insertDataOption': 'INSERT_ROWS'},
+            json={'values': values}
+        )
+
+    async def batch_update(self, spreadsheet_id: str, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """spreadsheets.batchUpdate"""
+        return await self.request('POST', f'/v4/spreadsheets/{spreadsheet_id}:batchUpdate',
+                                  json={'requests': requests})
+
+    async def request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        """Запрос к API с токеном; возвращает JSON ответа или бросает SheetsApiError"""
+        if self._client is None:
+            await self.start()
+
+        async with self._semaphore:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                response = await self._send(method, path, **kwargs)
+                if response.status_code == 401:
+                    # Токен отозван раньше срока - обновляем и повторяем один раз
+                    used_token = response.request.headers['Authorization'].split(' ', 1)[1]
+                    await self._refresh_token(stale_token=used_token)
+                    response = await self._send(method, path, **kwargs)
+            finally:
+                self.in_flight -= 1
+
+        if response.status_code >= 400:
+            self.errors += 1
+            raise SheetsApiError(response.status_code, self._error_message(response))
+        return response.json() if response.content else {}
+
+    async def _send(self, method: str, path: str, **kwargs) -> httpx.Response:
+        if not self._token_valid(0):
+            await self._refresh_token()
+        headers = {'Authorization': f'Bearer {self.credentials.token}'}
+        self.requests += 1
+        response = await self._client.request(method, f'{self.base_url}{path}', headers=headers, **kwargs)
+        self.http_versions[response.http_version] = self.http_versions.get(response.http_version, 0) + 1
+        return response
+
+    @staticmethod
+    def _error_message(response: httpx.Response) -> str:
+        try:
+            return response.json()['error']['message']
+        except Exception:
+            return response.text[:200]
+
+    # ---- Токен ----
+
+    def _seconds_left(self) -> Optional[float]:
+        """Секунд до истечения токена (None - срок неизвестен)"""
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return None
+        # google-auth хранит expiry как наивное время UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds()
+
+    def _token_valid(self, margin: float) -> bool:
+        if not self.credentials.token:
+            return False
+        left = self._seconds_left()
+        return left is None or left > margin
+
+    async def _refresh_token(self, stale_token: Optional[str] = None):
+        """
+        Обновляет токен; параллельные вызовы ждут одно обновление
+
+        stale_token - токен, отклоненный сервером: обновление нужно, даже если
+        по сроку он еще действует, но только если его не заменили до нас
+        """
+        async with self._refresh_lock:
+            if stale_token is not None:
+                if self.credentials.token != stale_token:
+                    return
+            elif self._token_valid(self.refresh_margin):
+                return  # Уже обновлен другим вызовом
+            await asyncio.to_thread(self.credentials.refresh, Request())
+            self.token_refreshes += 1
+            logger.debug(f"🔑 Токен Google обновлен, действует {self._seconds_left()} сек")
+
+    async def _refresh_loop(self):
+        """Фоновое обновление токена за refresh_margin секунд до истечения"""
+        while True:
+            left = self._seconds_left()
+            if left is None:
+                return  # Бессрочный токен
+            # Короткоживущий токен (срок меньше запаса) обновляется на середине срока
+            await asyncio.sleep(max(left - self.refresh_margin, left / 2, 0.1))
+            try:
+                await self._refresh_token()
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось обновить токен Google: {e}")
+                await asyncio.sleep(min(10.0, max(1.0, self.refresh_margin / 2)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'token_refreshes': self.token_refreshes,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'max_concurrency': self.max_concurrency,
+            'http_versions': dict(self.http_versions)
+        }
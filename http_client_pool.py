@@ -0,0 +1,161 @@
+"""Общий HTTP клиент с пулами соединений для исходящих webhook'ов"""
+import asyncio
+import aiohttp
+import ssl
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from yarl import URL
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class PooledHTTPClient:
+    """
+    Долгоживущий HTTP клиент: отдельный пул соединений на каждый целевой хост
+
+    - keep-alive: соединения переиспользуются между шагами и пользователями,
+      поэтому TCP и TLS рукопожатие выполняется один раз на соединение
+    - кэш DNS внутри коннектора
+    - общий SSL контекст для всех хостов
+    - лимит соединений на хост (общий и индивидуальный из конфигурации)
+    """
+
+    def __init__(self, limit_per_host: Optional[int] = None,
+                 host_limits: Optional[Dict[str, int]] = None,
+                 keepalive_timeout: Optional[float] = None,
+                 dns_cache_ttl: Optional[int] = None,
+                 user_agent: str = 'TelegramBot-TargetAudience/1.0'):
+        self.limit_per_host = limit_per_host or config.HTTP_POOL_LIMIT_PER_HOST
+        self.host_limits = dict(config.HTTP_POOL_HOST_LIMITS if host_limits is None else host_limits)
+        self.keepalive_timeout = keepalive_timeout or config.HTTP_KEEPALIVE_TIMEOUT
+        self.dns_cache_ttl = dns_cache_ttl or config.HTTP_DNS_CACHE_TTL
+        self.user_agent = user_agent
+
+        # SSL контекст с отключенной верификацией (как и раньше в сервисах)
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    async def start(self):
+        """Привязывает клиент к текущему event loop (вызывается при старте Application)"""
+        self._loop = asyncio.get_running_loop()
+        logger.info(f"🌐 HTTP пул запущен (лимит на хост: {self.limit_per_host}, "
+                    f"keep-alive: {self.keepalive_timeout}s, DNS TTL: {self.dns_cache_ttl}s)")
+
+    async def close(self):
+        """Закрывает все пулы соединений (вызывается при остановке Application)"""
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+        self._loop = None
+        if sessions:
+            logger.info(f"🌐 HTTP пул закрыт ({len(sessions)} хостов)")
+
+    @asynccontextmanager
+    async def post(self, url: str, **kwargs):
+        """POST запрос через пул соединений хоста"""
+        async with self.request('POST', url, **kwargs) as response:
+            yield response
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """Запрос через пул соединений хоста"""
+        host_key = self._host_key(url)
+        stats = self._stats.setdefault(host_key, {'requests': 0, 'connections_created': 0, 'connections_reused': 0})
+        stats['requests'] += 1
+
+        session, transient = self._get_session(host_key)
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                yield response
+        finally:
+            if transient:
+                await session.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Статистика по хостам: запросы, созданные и переиспользованные соединения"""
+        return {host: dict(stats) for host, stats in self._stats.items()}
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parsed = URL(url)
+        return f"{parsed.scheme}://{parsed.host}:{parsed.port}"
+
+    def _get_session(self, host_key: str):
+        loop = asyncio.get_running_loop()
+        if self._loop is None or self._loop.is_closed():
+            # Первый запрос или прежний loop уже закрыт - привязываемся к текущему
+            self._sessions.clear()
+            self._loop = loop
+
+        if loop is not self._loop:
+            # Вызов из чужого event loop: пул привязан к основному loop,
+            # поэтому используем одноразовую сессию
+            logger.debug(f"HTTP запрос к {host_key} вне основного event loop - без пула")
+            return self._create_session(host_key), True
+
+        session = self._sessions.get(host_key)
+        if session is None or session.closed:
+            session = self._create_session(host_key)
+            self._sessions[host_key] = session
+        return session, False
+
+    def _create_session(self, host_key: str) -> aiohttp.ClientSession:
+        host = URL(host_key).host
+        limit = self.host_limits.get(host_key.split('://', 1)[1], self.host_limits.get(host, self.limit_per_host))
+
+        connector = aiohttp.TCPConnector(
+            ssl=self.ssl_context,
+            limit=limit,
+            limit_per_host=limit,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+            enable_cleanup_closed=True
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': self.user_agent},
+            trace_configs=[self._trace_config(host_key)]
+        )
+
+    def _trace_config(self, host_key: str) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_connection_create_end(session, context, params):
+            self._stats[host_key]['connections_created'] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self._stats[host_key]['connections_reused'] += 1
+
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+
+_shared_client: Optional[PooledHTTPClient] = None
+
+
+def get_http_client() -> PooledHTTPClient:
+    """Возвращает общий для процесса HTTP клиент"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = PooledHTTPClient()
+    return _shared_client
+
+
+async def start_http_client():
+    """Хук запуска Application: инициализирует общий HTTP клиент"""
+    await get_http_client().start()
+
+
+async def close_http_client():
+    """Хук остановки Application: закрывает общий HTTP клиент"""
+    if _shared_client is not None:
+        await _shared_client.close()
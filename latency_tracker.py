@@ -0,0 +1,198 @@
+"""Учет задержек систем и адаптивные таймауты по наблюдаемому p99"""
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class QuantileSketch:
+    """
+    Потоковая оценка квантилей: логарифмические корзины с затуханием
+
+    Значение попадает в корзину ceil(log_gamma(x)), поэтому относительная
+    ошибка квантиля не больше (gamma - 1) / 2. Каждые decay_every наблюдений
+    все счетчики умножаются на decay, и старые замеры постепенно теряют вес.
+    """
+
+    __slots__ = ('gamma', 'decay', 'decay_every', 'buckets', 'count', '_since_decay', '_log_gamma')
+
+    def __init__(self, gamma: float = 1.04, decay: float = 0.5, decay_every: int = 200):
+        self.gamma = gamma
+        self.decay = decay
+        self.decay_every = decay_every
+        self.buckets: Dict[int, float] = {}
+        self.count = 0.0
+        self._since_decay = 0
+        self._log_gamma = math.log(gamma)
+
+    def add(self, value: float):
+        index = math.ceil(math.log(max(value, 1e-3)) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0.0) + 1.0
+        self.count += 1.0
+
+        self._since_decay += 1
+        if self._since_decay >= self.decay_every:
+            self._since_decay = 0
+            self.buckets = {i: c * self.decay for i, c in self.buckets.items() if c * self.decay >= 0.01}
+            self.count = sum(self.buckets.values())
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.buckets:
+            return None
+        rank = q * self.count
+        seen = 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Середина корзины (gamma^(i-1), gamma^i]
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return self.gamma ** max(self.buckets)
+
+    def to_dict(self) -> dict:
+        return {'buckets': {str(i): c for i, c in self.buckets.items()}, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'QuantileSketch':
+        sketch = cls()
+        sketch.buckets = {int(i): float(c) for i, c in data.get('buckets', {}).items()}
+        sketch.count = float(data.get('count', sum(sketch.buckets.values())))
+        return sketch
+
+
+class LatencyTracker:
+    """
+    Задержки по каждой системе и виду ожидания:
+    - 'ack': ответ на POST
+    - 'ready': callback 'ready' после отправки
+
+    Таймаут = p99 * (1 + margin_ratio) + margin_seconds в пределах [min, max]
+    для своего вида. Пока замеров меньше min_samples, используется max
+    (прежний фиксированный таймаут). Состояние сохраняется в JSON и
+    загружается при старте.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or config.LATENCY_STATE_PATH
+        self.enabled = config.ADAPTIVE_TIMEOUTS_ENABLED
+        self.bounds = {
+            'ack': (config.WEBHOOK_ACK_TIMEOUT_MIN, config.WEBHOOK_ACK_TIMEOUT_MAX),
+            'ready': (config.WEBHOOK_READY_TIMEOUT_MIN, config.WEBHOOK_READY_TIMEOUT_MAX)
+        }
+        self.margin_ratio = config.TIMEOUT_MARGIN_RATIO
+        self.margin_seconds = config.TIMEOUT_MARGIN_SECONDS
+        self.min_samples = config.TIMEOUT_MIN_SAMPLES
+        self.save_interval = 60.0
+
+        self._sketches: Dict[str, QuantileSketch] = {}
+        self._last_save = time.monotonic()
+        self._dirty = False
+        self.load()
+
+    def observe(self, target: str, kind: str, seconds: float):
+        """Учитывает замер задержки"""
+        self._sketch(target, kind).add(seconds)
+        self._dirty = True
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def observe_timeout(self, target: str, kind: str, timeout_seconds: float):
+        """
+        Учитывает таймаут как замер, равный самому таймауту
+
+        Настоящая задержка не меньше таймаута. Без такого замера медленная,
+        но рабочая система обрезалась бы одним и тем же коротким таймаутом.
+        """
+        self.observe(target, kind, timeout_seconds)
+
+    def quantile(self, target: str, kind: str, q: float) -> Optional[float]:
+        sketch = self._sketches.get(self._key(target, kind))
+        if sketch is None or sketch.count < self.min_samples:
+            return None
+        return sketch.quantile(q)
+
+    def timeout(self, target: str, kind: str) -> float:
+        """Таймаут для системы: p99 плюс запас в настроенных пределах"""
+        low, high = self.bounds[kind]
+        if not self.enabled:
+            return high
+        p99 = self.quantile(target, kind, 0.99)
+        if p99 is None:
+            return high
+        return min(high, max(low, p99 * (1 + self.margin_ratio) + self.margin_seconds))
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {}
+        for key, sketch in self._sketches.items():
+            target, kind = key.split('|', 1)
+            stats[key] = {
+                'samples': round(sketch.count, 1),
+                'p50': sketch.quantile(0.5),
+                'p99': sketch.quantile(0.99),
+                'timeout': self.timeout(target, kind)
+            }
+        return stats
+
+    def load(self):
+        """Загружает сохраненное состояние (если есть)"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._sketches = {key: QuantileSketch.from_dict(value) for key, value in data.items()}
+            logger.info(f"⏱️ Загружена статистика задержек: {len(self._sketches)} рядов")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить статистику задержек {self.path}: {e}")
+
+    def save(self):
+        """Сохраняет состояние атомарной заменой файла"""
+        self._last_save = time.monotonic()
+        if not self._dirty or not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({key: sketch.to_dict() for key, sketch in self._sketches.items()}, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить статистику задержек: {e}")
+
+    @staticmethod
+    def _key(target: str, kind: str) -> str:
+        return f"{target}|{kind}"
+
+    def _sketch(self, target: str, kind: str) -> QuantileSketch:
+        key = self._key(target, kind)
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = QuantileSketch()
+        return sketch
+
+
+_shared_tracker: Optional[LatencyTracker] = None
+
+
+def get_latency_tracker() -> LatencyTracker:
+    """Возвращает общий для процесса учет задержек"""
+    global _shared_tracker
+    if _shared_tracker is None:
+        _shared_tracker = LatencyTracker()
+    return _shared_tracker
+
+
+def format_duration(seconds: float) -> str:
+    """Короткая запись таймаута для сообщений пользователю"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} сек"
+    minutes, rest = divmod(seconds, 60)
+    return f"{minutes} мин {rest} сек" if rest else f"{minutes} мин"
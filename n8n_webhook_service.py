@@ -1,9 +1,12 @@
 """N8N Webhook сервис для двусторонней связи с созданием Google Sheets"""
-import requests
 import json
 from datetime import datetime, timedelta
 import asyncio
+import aiohttp
 import logging
+from http_client_pool import get_http_client
+from pending_request_store import PendingRequestStore
+from state_backend import get_state_backend
 
 logger = logging.getLogger(__name__)
 
@@ -12,8 +15,16 @@ class N8NWebhookService:
         # URL для отправки данных в N8N
         self.n8n_outgoing_webhook = None
         
-        # Хранилище ожидающих ответов от N8N
-        self.pending_requests = {}
+        # Хранилище ожидающих ответов от N8N (TTL, лимит размера и памяти)
+        self.pending_requests = PendingRequestStore()
+        
+        # Общее состояние реплик: статус запроса меняется атомарно (compare-and-set),
+        # поэтому ответ N8N, пришедший на любую реплику, обрабатывается один раз
+        self.state_backend = get_state_backend()
+        
+        # Неблокирующий транспорт через общий пул соединений
+        self.http_client = get_http_client()
+        self.timeout = aiohttp.ClientTimeout(total=30)
         
     def set_outgoing_webhook(self, url):
         """Установка URL для исходящего webhook в N8N"""
@@ -25,7 +36,8 @@ class N8NWebhookService:
         if not self.n8n_outgoing_webhook:
             logger.error('N8N outgoing webhook не настроен')
             return False
-            
+        
+        request_id = None
         try:
             # Формирование уникального ID запроса
             request_id = f"{user_id}_{int(datetime.now().timestamp())}"
@@ -52,37 +64,90 @@ class N8NWebhookService:
             logger.info(f'Отправка данных в N8N для пользователя {user_id}, request_id: {request_id}')
             
             # Сохраняем запрос как ожидающий
-            self.pending_requests[request_id] = {
+            self.pending_requests.put(request_id, {
                 'user_id': user_id,
                 'timestamp': datetime.now(),
                 'status': 'pending'
-            }
+            })
+            await self.state_backend.set(self._state_key(request_id), {
+                'user_id': user_id,
+                'status': 'pending'
+            }, ttl=self.pending_requests.ttl_seconds)
             
-            # Отправляем POST запрос в N8N
-            response = requests.post(
+            # Отправляем POST запрос в N8N (не блокируя event loop)
+            async with self.http_client.post(
                 self.n8n_outgoing_webhook,
                 json=n8n_payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=30
-            )
+                timeout=self.timeout,
+                headers={'Content-Type': 'application/json'}
+            ) as response:
+                if response.status == 200:
+                    logger.info(f'Данные успешно отправлены в N8N, request_id: {request_id}')
+                    return request_id
+                
+                response_text = await response.text()
+                logger.error(f'Ошибка отправки в N8N: {response.status} - {response_text}')
             
-            if response.status_code == 200:
-                logger.info(f'Данные успешно отправлены в N8N, request_id: {request_id}')
-                return request_id
-            else:
-                logger.error(f'Ошибка отправки в N8N: {response.status_code} - {response.text}')
-                # Удаляем из ожидающих при ошибке
-                if request_id in self.pending_requests:
-                    del self.pending_requests[request_id]
-                return False
+            # Удаляем из ожидающих при ошибке
+            await self._forget_request(request_id)
+            return False
                 
-        except requests.exceptions.RequestException as e:
-            logger.error(f'Ошибка соединения с N8N: {e}')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f'Ошибка соединения с N8N: {e!r}')
+            await self._forget_request(request_id)
             return False
         except Exception as e:
             logger.error(f'Общая ошибка отправки в N8N: {e}')
+            await self._forget_request(request_id)
             return False
     
+    async def _forget_request(self, request_id):
+        """Удаляет неотправленный запрос из ожидающих"""
+        if request_id is None:
+            return
+        self.pending_requests.pop(request_id, None)
+        try:
+            await self.state_backend.delete(self._state_key(request_id))
+        except Exception as e:
+            logger.warning(f'⚠️ Не удалось удалить запрос {request_id} из общего состояния: {e}')
+    
+    @staticmethod
+    def _state_key(request_id):
+        return f"n8n:{request_id}"
+    
+    async def adopt_request(self, request_id):
+        """
+        Подхватывает запрос, отправленный другой репликой
+        
+        Returns:
+            user_id запроса или None, если запрос неизвестен
+        """
+        entry = self.pending_requests.get(request_id)
+        if entry is not None:
+            return entry['user_id']
+        record = await self.state_backend.get(self._state_key(request_id))
+        if record is None or record.get('status') != 'pending':
+            return None
+        self.pending_requests.put(request_id, {
+            'user_id': record['user_id'],
+            'timestamp': datetime.now(),
+            'status': 'pending'
+        })
+        return record['user_id']
+    
+    async def claim_request(self, request_id, outcome='completed'):
+        """
+        Атомарно завершает ожидающий запрос (ответ N8N или таймаут)
+        
+        Из нескольких реплик и повторных ответов запрос завершает только
+        первый; остальные получают False.
+        """
+        record = await self.state_backend.transition(
+            self._state_key(request_id), 'status', 'pending', {'status': outcome},
+            ttl=self.pending_requests.completed_ttl_seconds
+        )
+        return record is not None
+    
     def _prepare_spreadsheet_data(self, user_data, current_date):
         """Подготовка данных для таблицы"""
         return [
@@ -148,7 +213,7 @@ class N8NWebhookService:
                     spreadsheet_info['sheet_title'] = 'Таблица не создана'
             
             # Обновляем статус запроса
-            self.pending_requests[request_id].update({
+            self.pending_requests.update(request_id, {
                 'status': 'completed',
                 'spreadsheet_info': spreadsheet_info,
                 'completed_at': datetime.now()
@@ -188,6 +253,9 @@ class N8NWebhookService:
     
     def cleanup_old_requests(self, hours=24):
         """Очистка старых запросов"""
+        # Истекшие по TTL записи хранилище удаляет само
+        self.pending_requests.evict_expired()
+        
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
         to_remove = []
@@ -201,11 +269,11 @@ class N8NWebhookService:
     
     def get_pending_requests_count(self):
         """Получение количества ожидающих запросов"""
-        return len([r for r in self.pending_requests.values() if r['status'] == 'pending'])
+        return self.pending_requests.get_count('pending')
     
     def get_completed_requests_count(self):
         """Получение количества завершенных запросов"""
-        return len([r for r in self.pending_requests.values() if r['status'] == 'completed'])
+        return self.pending_requests.get_count('completed')
 
 
 def test_n8n_webhook_service():
@@ -0,0 +1,94 @@
+"""Шаблон тела webhook-запроса: общая часть кодируется один раз на анализ"""
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает стандартный json
+    orjson = None
+
+
+def encode_json(value: Any) -> bytes:
+    """JSON в байты: orjson, если установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _safe_json_value(value: Any) -> Any:
+    """Приводит значение к JSON-совместимому виду"""
+    if hasattr(value, 'isoformat'):  # datetime объект
+        return value.isoformat()
+    if not isinstance(value, (str, int, float, bool, type(None))):
+        return str(value)
+    return value
+
+
+class PayloadTemplate:
+    """
+    Тело запроса анализа для всех систем одного анализа
+
+    Общая часть (данные пользователя, таблица, дата анализа) кодируется
+    в JSON один раз. Поля, которые различаются у систем, - webhook_name,
+    idempotency_key и timestamp - вставляются на уровне байтов вместо
+    уникальных меток, поэтому render() не строит словарь и не кодирует
+    его заново.
+    """
+
+    # Поля, подставляемые для каждой системы, в порядке появления в теле
+    FIELDS = ('timestamp', 'webhook_name', 'idempotency_key')
+
+    __slots__ = ('_parts',)
+
+    def __init__(self, user_data: Dict[str, Any], spreadsheet_info: Dict[str, Any], user_id: int):
+        marker = uuid.uuid4().hex
+        markers = {field: f"@@{marker}:{field}@@" for field in self.FIELDS}
+
+        body = {
+            "event_type": "target_audience_analysis",
+            "timestamp": markers['timestamp'],
+            "user_id": str(user_id),
+            "webhook_name": markers['webhook_name'],
+            "telegram_user_id": user_id,  # Дублируем для возврата
+            "user_data": {
+                "profession": user_data.get('profession', ''),
+                "segmentation": user_data.get('segmentation', ''),
+                "ideal_client_portrait": user_data.get('ideal_client', '')
+            },
+            "spreadsheet_info": {
+                "spreadsheet_id": _safe_json_value(spreadsheet_info.get('spreadsheet_id', '')),
+                "spreadsheet_url": _safe_json_value(spreadsheet_info.get('spreadsheet_url', '')),
+                "sheet_title": _safe_json_value(spreadsheet_info.get('sheet_title', '')),
+                "created_at": _safe_json_value(spreadsheet_info.get('created_at', ''))
+            },
+            "analysis_data": {
+                "analysis_date": datetime.now().strftime("%d.%m.%Y"),
+                "characteristics": "Заполнить на основе описания",
+                "pain_points": "Заполнить на основе описания",
+                "needs_and_desires": "Заполнить на основе описания",
+                "communication_channels": "Заполнить на основе исследования",
+                "recommendations": "Заполнить после анализа"
+            },
+            "idempotency_key": markers['idempotency_key']
+        }
+
+        # Режем закодированное тело по меткам: [байты, поле, байты, поле, ..., байты]
+        encoded = encode_json(body)
+        parts: List[Any] = []
+        for field in self.FIELDS:
+            placeholder = encode_json(markers[field])
+            head, _, encoded = encoded.partition(placeholder)
+            parts.extend((head, field))
+        parts.append(encoded)
+        self._parts = tuple(parts)
+
+    def render(self, webhook_name: str, idempotency_key: str) -> bytes:
+        """Тело запроса для одной системы"""
+        values = {
+            'timestamp': encode_json(datetime.now().isoformat()),
+            'webhook_name': encode_json(webhook_name),
+            'idempotency_key': encode_json(idempotency_key)
+        }
+        return b''.join(values[part] if isinstance(part, str) else part for part in self._parts)
@@ -0,0 +1,213 @@
+"""Ограниченное хранилище N8N запросов с вытеснением по сроку жизни"""
+import heapq
+import logging
+import sys
+import time
+from typing import Dict, Any, Optional, Callable
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def _estimate_size(value: Any) -> int:
+    """Приблизительный размер значения в байтах (dict/list/str/datetime)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += _estimate_size(key) + _estimate_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += _estimate_size(item)
+    return size
+
+
+class PendingRequestStore:
+    """
+    Хранилище запросов к N8N с ограничением по времени, количеству и памяти
+
+    - записи истекают через TTL; вытеснение идет в порядке истечения (heap)
+      и выполняется автоматически при каждой записи и чтении счетчиков
+    - при превышении max_size или бюджета памяти вытесняются записи,
+      которые истекли бы первыми
+    - счетчики статусов ведутся инкрементально, get_count() за O(1)
+
+    Поддерживает dict-подобный доступ для чтения (in, [], get, items, keys, len),
+    но изменять записи нужно через put/update/pop, иначе счетчики разойдутся.
+    """
+
+    def __init__(self, ttl_seconds: Optional[float] = None,
+                 completed_ttl_seconds: Optional[float] = None,
+                 max_size: Optional[int] = None,
+                 memory_budget_bytes: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds or config.N8N_REQUEST_TTL_SECONDS
+        self.completed_ttl_seconds = completed_ttl_seconds or config.N8N_COMPLETED_TTL_SECONDS
+        self.max_size = max_size or config.N8N_PENDING_MAX_SIZE
+        self.memory_budget_bytes = memory_budget_bytes or config.N8N_PENDING_MEMORY_BUDGET_MB * 1024 * 1024
+        self._clock = clock
+
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._expires_at: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self._heap = []  # (expires_at, seq, request_id); устаревшие элементы пропускаются
+        self._seq = 0
+
+        self._status_counts: Dict[str, int] = {}
+        self._memory_bytes = 0
+        self._evicted_expired = 0
+        self._evicted_capacity = 0
+
+    # --- изменение ---
+
+    def put(self, request_id: str, entry: Dict[str, Any], ttl_seconds: Optional[float] = None):
+        """Добавляет или заменяет запись"""
+        if request_id in self._entries:
+            self._remove(request_id)
+
+        self._entries[request_id] = entry
+        self._count_status(entry.get('status'), 1)
+        self._account(request_id)
+        self._schedule(request_id, ttl_seconds or self.ttl_seconds)
+
+        self._evict_expired()
+        self._enforce_limits()
+
+    def update(self, request_id: str, fields: Dict[str, Any]) -> bool:
+        """Обновляет поля записи; завершенные запросы получают короткий TTL"""
+        entry = self._entries.get(request_id)
+        if entry is None:
+            return False
+
+        old_status = entry.get('status')
+        entry.update(fields)
+        new_status = entry.get('status')
+        if new_status != old_status:
+            self._count_status(old_status, -1)
+            self._count_status(new_status, 1)
+            if new_status == 'completed':
+                self._schedule(request_id, self.completed_ttl_seconds)
+
+        self._account(request_id)
+        self._enforce_limits()
+        return True
+
+    def pop(self, request_id: str, default=None):
+        """Удаляет запись и возвращает ее"""
+        if request_id not in self._entries:
+            return default
+        return self._remove(request_id)
+
+    def __setitem__(self, request_id: str, entry: Dict[str, Any]):
+        self.put(request_id, entry)
+
+    def __delitem__(self, request_id: str):
+        if request_id not in self._entries:
+            raise KeyError(request_id)
+        self._remove(request_id)
+
+    # --- чтение ---
+
+    def __contains__(self, request_id) -> bool:
+        return request_id in self._entries
+
+    def __getitem__(self, request_id: str) -> Dict[str, Any]:
+        return self._entries[request_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, request_id: str, default=None):
+        return self._entries.get(request_id, default)
+
+    def items(self):
+        return self._entries.items()
+
+    def keys(self):
+        return self._entries.keys()
+
+    def values(self):
+        return self._entries.values()
+
+    def get_count(self, status: str) -> int:
+        """Количество записей с заданным статусом за O(1)"""
+        self._evict_expired()
+        return self._status_counts.get(status, 0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Метрики хранилища"""
+        self._evict_expired()
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'memory_bytes': self._memory_bytes,
+            'memory_budget_bytes': self.memory_budget_bytes,
+            'by_status': dict(self._status_counts),
+            'evicted_expired': self._evicted_expired,
+            'evicted_capacity': self._evicted_capacity
+        }
+
+    # --- обслуживание ---
+
+    def evict_expired(self) -> int:
+        """Удаляет истекшие записи, возвращает их количество"""
+        return self._evict_expired()
+
+    def _evict_expired(self) -> int:
+        now = self._clock()
+        evicted = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, _, request_id = heapq.heappop(self._heap)
+            if self._expires_at.get(request_id) != expires_at:
+                continue  # Срок записи продлен или запись уже удалена
+            self._remove(request_id)
+            evicted += 1
+
+        if evicted:
+            self._evicted_expired += evicted
+            logger.info(f'🧹 Удалено истекших N8N запросов: {evicted}')
+        return evicted
+
+    def _enforce_limits(self):
+        evicted = 0
+        while self._heap and (len(self._entries) > self.max_size
+                              or self._memory_bytes > self.memory_budget_bytes):
+            expires_at, _, request_id = heapq.heappop(self._heap)
+            if self._expires_at.get(request_id) != expires_at:
+                continue
+            self._remove(request_id)
+            evicted += 1
+
+        if evicted:
+            self._evicted_capacity += evicted
+            logger.warning(f'⚠️ Хранилище N8N запросов переполнено, вытеснено: {evicted}')
+
+    def _schedule(self, request_id: str, ttl_seconds: float):
+        expires_at = self._clock() + ttl_seconds
+        self._expires_at[request_id] = expires_at
+        self._seq += 1
+        heapq.heappush(self._heap, (expires_at, self._seq, request_id))
+
+        # Устаревшие элементы heap'а не должны копиться бесконечно
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(self._expires_at[rid], seq, rid) for expires, seq, rid in self._heap
+                          if self._expires_at.get(rid) == expires]
+            heapq.heapify(self._heap)
+
+    def _account(self, request_id: str):
+        size = _estimate_size(self._entries[request_id])
+        self._memory_bytes += size - self._sizes.get(request_id, 0)
+        self._sizes[request_id] = size
+
+    def _count_status(self, status: Optional[str], delta: int):
+        count = self._status_counts.get(status, 0) + delta
+        if count:
+            self._status_counts[status] = count
+        else:
+            self._status_counts.pop(status, None)
+
+    def _remove(self, request_id: str) -> Dict[str, Any]:
+        entry = self._entries.pop(request_id)
+        self._expires_at.pop(request_id, None)
+        self._memory_bytes -= self._sizes.pop(request_id, 0)
+        self._count_status(entry.get('status'), -1)
+        return entry
@@ -0,0 +1,126 @@
+"""Фоновое выполнение анализов: ограниченное число воркеров, по одному анализу на пользователя"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+import config
+
+logger = logging.getLogger(__name__)
+
+JobFactory = Callable[[], Awaitable[Any]]
+
+
+class PipelineJobRunner:
+    """
+    Очередь анализов с пулом воркеров
+
+    - обработчик Telegram только ставит анализ в очередь и сразу возвращается
+    - анализы одного пользователя выполняются строго по очереди
+    - одновременно выполняется не больше workers анализов; пользователи
+      обслуживаются по кругу: после анализа пользователь с еще одним
+      анализом встает в конец очереди
+    - в очереди не больше queue_max анализов, лишние отклоняются
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_max: Optional[int] = None):
+        self.workers = workers or config.PIPELINE_WORKERS
+        self.queue_max = queue_max or config.PIPELINE_QUEUE_MAX
+
+        # user_key -> ожидающие анализы; ключ есть, пока у пользователя
+        # есть ожидающий или выполняющийся анализ
+        self._jobs: Dict[Any, Deque[Tuple[str, JobFactory]]] = {}
+        self._ready: Optional[asyncio.Queue] = None  # Пользователи, чей анализ можно запускать
+        self._worker_tasks: List[asyncio.Task] = []
+
+        self.queued = 0
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_queued = 0
+
+    async def start(self):
+        """Запускает воркеры в текущем event loop"""
+        self._ensure_started()
+        logger.info(f"🧵 Очередь анализов запущена: {self.workers} воркеров")
+
+    async def stop(self):
+        """Останавливает воркеры; выполняющиеся анализы отменяются (их шаги остаются в outbox)"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._ready = None
+        self._jobs.clear()
+        self.queued = 0
+        self.busy = 0
+
+    def submit(self, user_key: Any, job: JobFactory, name: str = '') -> bool:
+        """
+        Ставит анализ в очередь пользователя
+
+        job - функция без аргументов, возвращающая корутину (корутина
+        создается только при запуске). False - очередь переполнена.
+        """
+        self._ensure_started()
+        if self.queued >= self.queue_max:
+            self.rejected += 1
+            logger.warning(f"⚠️ Очередь анализов переполнена ({self.queued}), анализ {name} пользователя {user_key} отклонен")
+            return False
+
+        jobs = self._jobs.get(user_key)
+        if jobs is None:
+            jobs = self._jobs[user_key] = deque()
+            self._ready.put_nowait(user_key)
+        jobs.append((name, job))
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        return True
+
+    def get_user_queue_length(self, user_key: Any) -> int:
+        """Сколько анализов пользователя ждут запуска"""
+        jobs = self._jobs.get(user_key)
+        return len(jobs) if jobs else 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'workers': len(self._worker_tasks),
+            'busy': self.busy,
+            'queued': self.queued,
+            'users': len(self._jobs),
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'max_queued': self.max_queued
+        }
+
+    def _ensure_started(self):
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+        if not self._worker_tasks:
+            loop = asyncio.get_running_loop()
+            self._worker_tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def _worker(self, number: int):
+        while True:
+            user_key = await self._ready.get()
+            jobs = self._jobs[user_key]
+            name, job = jobs.popleft()
+            self.queued -= 1
+            self.busy += 1
+            try:
+                await job()
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ Анализ {name} пользователя {user_key} завершился ошибкой: {e}")
+            finally:
+                self.busy -= 1
+                if self._ready is not None:
+                    if jobs:
+                        # Следующий анализ пользователя - в конец общей очереди
+                        self._ready.put_nowait(user_key)
+                    else:
+                        self._jobs.pop(user_key, None)
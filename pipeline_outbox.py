@@ -0,0 +1,205 @@
+"""Локальный журнал (outbox) шагов анализа, переживающий перезапуск бота"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    user_data TEXT NOT NULL,
+    spreadsheet_info TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id TEXT NOT NULL,
+    webhook_name TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (run_id, webhook_name)
+) WITHOUT ROWID;
+"""
+
+
+class PipelineOutbox:
+    """
+    SQLite (WAL) журнал незавершенных анализов
+
+    - запуск анализа пишет одну строку runs, каждый шаг - одну короткую строку steps,
+      завершение удаляет и то и другое: база содержит только незавершенные анализы
+    - записи копятся в памяти и сбрасываются фоновой задачей одной транзакцией
+      раз в flush_interval или при накоплении batch_size операций
+    - WAL + synchronous=NORMAL: коммит не делает fsync, синхронизация идет
+      при checkpoint, то есть не чаще одного fsync на пакет. Такой режим
+      сохраняет данные при падении процесса (OOM, restart.sh)
+    - пакет, который не удалось записать (SQLITE_BUSY, нет места на диске),
+      возвращается в начало очереди и записывается повторно с backoff
+    """
+
+    RETRY_MAX_DELAY = 30.0  # Максимальная пауза между повторами записи, сек
+
+    def __init__(self, path: Optional[str] = None,
+                 flush_interval: Optional[float] = None,
+                 batch_size: Optional[int] = None):
+        self.path = path or config.OUTBOX_DB_PATH
+        self.flush_interval = flush_interval or config.OUTBOX_FLUSH_INTERVAL
+        self.batch_size = batch_size or config.OUTBOX_BATCH_SIZE
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: List[Tuple[str, tuple]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+        self.batches_written = 0
+        self.operations_written = 0
+        self.write_failures = 0
+
+    # --- жизненный цикл ---
+
+    async def start(self):
+        """Открывает базу и запускает фоновую запись пакетов"""
+        await asyncio.to_thread(self._open)
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        logger.info(f"💾 Outbox анализов открыт: {self.path}")
+
+    async def close(self):
+        """Сбрасывает оставшиеся записи и закрывает базу"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"❌ Outbox: {len(self._pending)} операций не записано при остановке: {e}")
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    # --- запись (горячий путь: только добавление в пакет) ---
+
+    def start_run(self, run_id: str, user_id: int, user_data: Dict[str, Any], spreadsheet_info: Dict[str, Any]):
+        """Фиксирует запуск анализа"""
+        self._enqueue(
+            "INSERT OR IGNORE INTO runs (run_id, user_id, user_data, spreadsheet_info, created_at) VALUES (?, ?, ?, ?, ?)",
+            (run_id, user_id, json.dumps(user_data, ensure_ascii=False),
+             json.dumps(spreadsheet_info, ensure_ascii=False, default=str), time.time())
+        )
+
+    def record_step(self, run_id: str, webhook_name: str, success: bool):
+        """Фиксирует результат шага"""
+        self._enqueue(
+            "INSERT OR REPLACE INTO steps (run_id, webhook_name, success, finished_at) VALUES (?, ?, ?, ?)",
+            (run_id, webhook_name, int(success), time.time())
+        )
+
+    def finish_run(self, run_id: str):
+        """Удаляет завершенный анализ из журнала"""
+        self._enqueue("DELETE FROM steps WHERE run_id = ?", (run_id,))
+        self._enqueue("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    async def flush(self):
+        """Записывает накопленный пакет одной транзакцией (при ошибке пакет остается в очереди)"""
+        if not self._pending or self._conn is None:
+            return
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except BaseException:
+                # Транзакция откатена: пакет - впереди операций, добавленных во время записи
+                self._pending = batch + self._pending
+                raise
+
+    # --- чтение при старте ---
+
+    async def load_unfinished_runs(self) -> List[Dict[str, Any]]:
+        """Возвращает незавершенные анализы с набором успешно обработанных webhook'ов"""
+        return await asyncio.to_thread(self._load_unfinished_runs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'pending_operations': len(self._pending),
+            'batches_written': self.batches_written,
+            'operations_written': self.operations_written,
+            'write_failures': self.write_failures
+        }
+
+    # --- внутреннее ---
+
+    def _enqueue(self, sql: str, params: tuple):
+        self._pending.append((sql, params))
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        failures = 0
+        while True:
+            if failures:
+                await asyncio.sleep(min(self.RETRY_MAX_DELAY, self.flush_interval * 2 ** min(failures, 10)))
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.write_failures += 1
+                logger.error(f"❌ Ошибка записи outbox ({len(self._pending)} операций ждут повтора): {e}")
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _write_batch(self, batch: List[Tuple[str, tuple]]):
+        self._conn.execute("BEGIN")
+        try:
+            for sql, params in batch:
+                self._conn.execute(sql, params)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self.batches_written += 1
+        self.operations_written += len(batch)
+
+    def _load_unfinished_runs(self) -> List[Dict[str, Any]]:
+        runs = []
+        rows = self._conn.execute(
+            "SELECT run_id, user_id, user_data, spreadsheet_info FROM runs ORDER BY created_at"
+        ).fetchall()
+        for run_id, user_id, user_data, spreadsheet_info in rows:
+            completed = {
+                name for (name,) in self._conn.execute(
+                    "SELECT webhook_name FROM steps WHERE run_id = ? AND success = 1", (run_id,)
+                )
+            }
+            runs.append({
+                'run_id': run_id,
+                'user_id': user_id,
+                'user_data': json.loads(user_data),
+                'spreadsheet_info': json.loads(spreadsheet_info),
+                'completed': completed
+            })
+        return runs
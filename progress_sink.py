@@ -0,0 +1,164 @@
+"""Вывод прогресса анализа пользователю: одно обновляемое сообщение вместо потока сообщений"""
+import asyncio
+import logging
+from typing import List, Optional
+from telegram.error import BadRequest, RetryAfter
+from telegram_rate_limiter import PRIORITY_NOTIFICATION, PRIORITY_PROGRESS
+import config
+
+logger = logging.getLogger(__name__)
+
+# Режимы PROGRESS_MODE
+MODE_EDIT = 'edit'          # Одно сообщение статуса, обновляемое на месте
+MODE_MESSAGES = 'messages'  # Каждое событие - новое сообщение (прежнее поведение)
+
+# Лимит Telegram на длину сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+class MessageProgressSink:
+    """Прежнее поведение: каждое событие прогресса - отдельное сообщение"""
+
+    def __init__(self, bot, chat_id: int, header: str, reply_markup=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.header = header
+        self.reply_markup = reply_markup
+        self.api_calls = 0
+
+    async def start(self):
+        await self._send(self.header, PRIORITY_NOTIFICATION, self.reply_markup)
+
+    async def __call__(self, text: str):
+        await self._send(text, PRIORITY_PROGRESS)
+
+    async def finish(self, summary: str, hint: Optional[str] = None):
+        await self._send(summary, PRIORITY_NOTIFICATION)
+        if hint:
+            await self._send(hint, PRIORITY_NOTIFICATION)
+
+    async def _send(self, text: str, priority: int, reply_markup=None):
+        self.api_calls += 1
+        await self.bot.send_message(chat_id=self.chat_id, text=text, reply_markup=reply_markup,
+                                    rate_limit_args={'priority': priority})
+
+
+class EditingProgressSink:
+    """
+    Одно сообщение статуса, которое редактируется по мере выполнения
+
+    - события копятся и применяются одним редактированием не чаще раза
+      в flush_interval секунд
+    - редактирование пропускается, если текст не изменился
+    - итог отправляется новым сообщением (чтобы пользователь получил
+      уведомление) вместе с подсказкой о новом анализе
+    """
+
+    def __init__(self, bot, chat_id: int, header: str, reply_markup=None,
+                 flush_interval: Optional[float] = None, max_lines: int = 20):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.header = header
+        self.reply_markup = reply_markup
+        self.flush_interval = config.PROGRESS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.max_lines = max_lines
+
+        self.lines: List[str] = []
+        self.message_id: Optional[int] = None
+        self._sent_text: Optional[str] = None
+        self._flushed_lines = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        self.api_calls = 0
+        self.skipped_edits = 0
+
+    async def start(self):
+        """Отправляет сообщение статуса"""
+        await self._flush()
+
+    async def __call__(self, text: str):
+        """progress_callback: добавляет событие и планирует обновление"""
+        self.lines.append(text)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush(self.flush_interval))
+
+    async def finish(self, summary: str, hint: Optional[str] = None):
+        """Применяет последние события и отправляет итог"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._flush()
+
+        text = f"{summary}\n\n{hint}" if hint else summary
+        self.api_calls += 1
+        await self.bot.send_message(chat_id=self.chat_id, text=text,
+                                    rate_limit_args={'priority': PRIORITY_NOTIFICATION})
+
+    def render(self) -> str:
+        lines = self.lines[-self.max_lines:]
+        if len(self.lines) > self.max_lines:
+            lines = ['…'] + lines
+        text = '\n\n'.join([self.header] + lines) if lines else self.header
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH - 1] + '…'
+        return text
+
+    async def _delayed_flush(self, delay: float):
+        while True:
+            await asyncio.sleep(delay)
+            retry_after = await self._flush()
+            if retry_after is not None:
+                delay = retry_after
+            elif self._flushed_lines < len(self.lines):
+                # События, пришедшие во время отправки, - следующим обновлением
+                delay = self.flush_interval
+            else:
+                return
+
+    async def _flush(self) -> Optional[float]:
+        """Отправляет или редактирует сообщение; при лимите Telegram возвращает паузу"""
+        async with self._lock:
+            text = self.render()
+            self._flushed_lines = len(self.lines)
+            if text == self._sent_text:
+                self.skipped_edits += 1
+                return None
+            try:
+                self.api_calls += 1
+                if self.message_id is None:
+                    message = await self.bot.send_message(
+                        chat_id=self.chat_id, text=text, reply_markup=self.reply_markup,
+                        rate_limit_args={'priority': PRIORITY_NOTIFICATION}
+                    )
+                    self.message_id = message.message_id
+                else:
+                    await self.bot.edit_message_text(
+                        chat_id=self.chat_id, message_id=self.message_id,
+                        text=text, reply_markup=self.reply_markup,
+                        rate_limit_args={'priority': PRIORITY_PROGRESS}
+                    )
+                self._sent_text = text
+            except RetryAfter as e:
+                # Не блокируем анализ: повторим обновление после паузы
+                logger.warning(f"⏳ Лимит Telegram при обновлении прогресса {self.chat_id}, повтор через {e.retry_after} сек")
+                self._flushed_lines = 0
+                return float(e.retry_after)
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    self._sent_text = text
+                else:
+                    # Сообщение удалено или недоступно - следующее обновление отправит новое
+                    logger.warning(f"⚠️ Не удалось обновить прогресс {self.chat_id}: {e}")
+                    self.message_id = None
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка обновления прогресса {self.chat_id}: {e}")
+            return None
+
+
+def create_progress_sink(bot, chat_id: int, header: str, reply_markup=None, mode: Optional[str] = None):
+    """Создает вывод прогресса в режиме PROGRESS_MODE"""
+    mode = (mode or config.PROGRESS_MODE).lower()
+    if mode == MODE_MESSAGES:
+        return MessageProgressSink(bot, chat_id, header, reply_markup)
+    return EditingProgressSink(bot, chat_id, header, reply_markup)
@@ -0,0 +1,183 @@
+"""Повторы webhook-запросов: классификация ошибок, backoff с jitter, бюджет и hedging"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple
+import aiohttp
+import config
+
+logger = logging.getLogger(__name__)
+
+# Временные ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+RETRYABLE_EXCEPTIONS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+# Результат одной попытки: (HTTP статус, текст ответа, Retry-After в секундах или None)
+AttemptResult = Tuple[int, str, Optional[float]]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Заголовок Retry-After в секундах (формат даты не поддерживается)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class RetryBudget:
+    """
+    Общий бюджет повторов
+
+    Каждый первичный запрос добавляет ratio токена, каждый повтор тратит один.
+    Дополнительно бюджет пополняется на min_per_second в секунду, чтобы при
+    малой нагрузке повторы оставались возможны. При массовом сбое повторы
+    ограничены долей ratio от трафика и не умножают нагрузку на систему.
+    """
+
+    def __init__(self, ratio: Optional[float] = None, min_per_second: Optional[float] = None,
+                 capacity: float = 50.0):
+        self.ratio = config.WEBHOOK_RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.min_per_second = config.WEBHOOK_RETRY_BUDGET_MIN_PER_SECOND if min_per_second is None else min_per_second
+        self.capacity = capacity
+        self.balance = capacity
+        self._updated = time.monotonic()
+        self.exhausted = 0
+
+    def record_request(self):
+        self._refill()
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.balance >= 1.0:
+            self.balance -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.capacity, self.balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+
+class RetryPolicy:
+    """
+    Правила повторов POST-запросов к системам
+
+    - повторяются только временные ошибки (RETRYABLE_STATUSES, RETRYABLE_EXCEPTIONS)
+    - пауза - экспоненциальный backoff с полным jitter, но не меньше Retry-After
+    - каждый повтор тратит токен общего бюджета
+    """
+
+    def __init__(self, max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None, budget: Optional[RetryBudget] = None):
+        self.max_attempts = max_attempts or config.WEBHOOK_RETRY_ATTEMPTS
+        self.base_delay = config.WEBHOOK_RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = config.WEBHOOK_RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.budget = budget or RetryBudget()
+
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @staticmethod
+    def is_retryable_status(status: int) -> bool:
+        return status in RETRYABLE_STATUSES
+
+    @staticmethod
+    def is_retryable_exception(error: BaseException) -> bool:
+        return isinstance(error, RETRYABLE_EXCEPTIONS)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Пауза перед повтором номер attempt (с 1)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    async def call(self, attempt: Callable[[], Awaitable[AttemptResult]], name: str,
+                   hedge_delay: Optional[float] = None) -> AttemptResult:
+        """
+        Выполняет attempt с повторами
+
+        Возвращает результат последней попытки; исключение последней
+        попытки пробрасывается.
+        """
+        self.budget.record_request()
+        number = 1
+        while True:
+            try:
+                result = await self._hedged(attempt, name, hedge_delay)
+            except Exception as e:
+                if not self.is_retryable_exception(e) or not self._may_retry(number, name):
+                    raise
+                delay = self.backoff(number)
+                logger.warning(f"🔁 {name}: {type(e).__name__}, повтор {number}/{self.max_attempts - 1} "
+                               f"через {delay:.2f} сек")
+            else:
+                status, _, retry_after = result
+                if not self.is_retryable_status(status) or not self._may_retry(number, name):
+                    return result
+                delay = self.backoff(number, retry_after)
+                logger.warning(f"🔁 {name}: статус {status}, повтор {number}/{self.max_attempts - 1} "
+                               f"через {delay:.2f} сек")
+
+            self.retries += 1
+            number += 1
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> dict:
+        return {
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'budget_balance': round(self.budget.balance, 2),
+            'budget_exhausted': self.budget.exhausted
+        }
+
+    def _may_retry(self, number: int, name: str) -> bool:
+        if number >= self.max_attempts:
+            return False
+        if not self.budget.try_spend():
+            logger.warning(f"⚠️ {name}: бюджет повторов исчерпан, повтор не выполняется")
+            return False
+        return True
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[AttemptResult]], name: str,
+                      hedge_delay: Optional[float]) -> AttemptResult:
+        """
+        Попытка с hedging: если ответа нет дольше hedge_delay, отправляется
+        дубликат, и берется первый успешный ответ. Второй запрос отменяется.
+        """
+        if hedge_delay is None:
+            return await attempt()
+
+        primary = asyncio.ensure_future(attempt())
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            self.hedges += 1
+            logger.info(f"🪞 {name}: нет ответа за {hedge_delay:.2f} сек, отправляю дубликат")
+            hedge = asyncio.ensure_future(attempt())
+            pending = {primary, hedge}
+            last: Any = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    last = task
+                    if task.exception() is None and not self.is_retryable_status(task.result()[0]):
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+            return last.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
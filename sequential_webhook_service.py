@@ -1,38 +1,161 @@
 """Сервис для последовательной отправки webhook'ов с ожиданием ответов"""
 import asyncio
 import aiohttp
-import ssl
 import logging
+import time
+import uuid
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from http_client_pool import get_http_client
+from deadline_scheduler import get_deadline_scheduler
+from webhook_graph import build_dependency_graph, descendants
+from target_scheduler import get_target_scheduler
+from latency_tracker import get_latency_tracker, format_duration
+from circuit_breaker import get_circuit_breakers
+from retry_policy import RetryPolicy, parse_retry_after
+from payload_builder import PayloadTemplate
 import config
 
 logger = logging.getLogger(__name__)
 
+
+class WebhookCompletionRegistry:
+    """
+    Реестр ожидающих ответов 'ready' с ключом (run, webhook_id)
+    
+    Вместо периодического опроса каждый шаг регистрирует Future, который
+    разрешается напрямую из handle_webhook_response. Пока ответа нет,
+    ожидание не стоит event loop'у ничего.
+    """
+    
+    def __init__(self):
+        self._waiters: Dict[Tuple[Any, str], asyncio.Future] = {}
+    
+    def register(self, run_key: Any, webhook_id: str) -> asyncio.Future:
+        """Регистрирует ожидание ответа и возвращает Future для него"""
+        key = (run_key, webhook_id)
+        previous = self._waiters.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[key] = waiter
+        return waiter
+    
+    def resolve(self, run_key: Any, webhook_id: str, response: Dict[str, Any]) -> bool:
+        """
+        Передает ответ ожидающему шагу
+        
+        Returns:
+            True если ожидание найдено и будет разрешено, False иначе
+        """
+        waiter = self._waiters.get((run_key, webhook_id))
+        if waiter is None or waiter.done():
+            return False
+        
+        # Ответ может прийти из другого потока - разрешаем Future в его loop
+        waiter.get_loop().call_soon_threadsafe(self._set_result, waiter, response)
+        return True
+    
+    def expire(self, run_key: Any, webhook_id: str):
+        """Завершает ожидание по таймауту (результат None)"""
+        waiter = self._waiters.get((run_key, webhook_id))
+        if waiter is not None:
+            self._set_result(waiter, None)
+    
+    def discard(self, run_key: Any, webhook_id: str, waiter: asyncio.Future):
+        """
+        Снимает ожидание (после ответа, таймаута или ошибки)
+        
+        Снимается только переданное ожидание: если ключ уже занят новым
+        (например, повторной попыткой), поздний discard его не трогает.
+        """
+        key = (run_key, webhook_id)
+        if self._waiters.get(key) is waiter:
+            del self._waiters[key]
+        if not waiter.done():
+            waiter.cancel()
+    
+    def get_waiters_count(self) -> int:
+        """Возвращает количество активных ожиданий"""
+        return len(self._waiters)
+    
+    def get_waiters_by_webhook(self) -> Dict[str, int]:
+        """Возвращает количество активных ожиданий по каждому webhook'у"""
+        counts: Dict[str, int] = {}
+        for _, webhook_id in self._waiters:
+            counts[webhook_id] = counts.get(webhook_id, 0) + 1
+        return counts
+    
+    @staticmethod
+    def _set_result(waiter: asyncio.Future, response: Dict[str, Any]):
+        if not waiter.done():
+            waiter.set_result(response)
+
+
 class SequentialWebhookService:
     def __init__(self):
         self.webhooks = {k: v for k, v in config.WEBHOOKS.items() if v}  # Только заполненные URL
-        self.timeout = aiohttp.ClientTimeout(total=30)  # 30 секунд таймаут для ожидания ответа
+        # Таймауты POST и ожидания 'ready' считаются по наблюдаемым задержкам каждой системы
+        self.latency_tracker = get_latency_tracker()
+        
+        # Выключатели систем: при недоступности системы шаг завершается сразу
+        self.circuit_breakers = get_circuit_breakers()
+        
+        # Повторы POST при временных ошибках и (опционально) hedging
+        self.retry_policy = RetryPolicy()
         
-        # SSL контекст с отключенной верификацией
-        self.ssl_context = ssl.create_default_context()
-        self.ssl_context.check_hostname = False
-        self.ssl_context.verify_mode = ssl.CERT_NONE
+        # Общий пул соединений (keep-alive, DNS кэш, SSL без верификации)
+        self.http_client = get_http_client()
         
         # Хранилище ожидающих ответов от webhook'ов
         self.pending_webhooks = {}  # {user_id: {webhook_responses: {}, total_count: int, completed_count: int}}
         
+        # Ожидающие шаги, разрешаемые напрямую входящими ответами
+        self.completion_registry = WebhookCompletionRegistry()
+        
+        # Таймауты ожидания регистрируются в общем планировщике дедлайнов
+        self.deadline_scheduler = get_deadline_scheduler()
+        
+        # Общий лимит одновременных запросов к каждой системе
+        self.target_scheduler = get_target_scheduler()
+        
+        # Журнал шагов для продолжения после перезапуска (подключает бот)
+        self.outbox = None
+        
+        # Пауза после успешного шага перед запуском зависящих систем
+        self.step_pause_seconds = 0.5
+        
+        # Граф зависимостей: по умолчанию строгая цепочка в порядке конфигурации
+        self.dependencies = self._load_dependencies()
+    
+    def _load_dependencies(self) -> Dict[str, List[str]]:
+        """Загружает граф зависимостей из конфигурации; при ошибке - цепочка"""
+        names = list(self.webhooks.keys())
+        try:
+            return build_dependency_graph(names, config.WEBHOOK_DEPENDENCIES)
+        except ValueError as e:
+            logger.error(f"❌ Некорректный WEBHOOK_DEPENDENCIES ({e}), используется последовательная цепочка")
+            return build_dependency_graph(names)
+
     async def send_webhooks_sequentially(self, user_id: int, user_data: Dict[str, Any], 
                                        spreadsheet_info: Dict[str, Any], 
-                                       progress_callback) -> Dict[str, bool]:
+                                       progress_callback, run_id: Optional[str] = None,
+                                       completed: Optional[set] = None) -> Dict[str, bool]:
         """
-        Отправляет webhook'и последовательно с ожиданием ответа от каждого
+        Отправляет webhook'и с ожиданием ответа от каждого
+        
+        Порядок задается графом зависимостей (WEBHOOK_DEPENDENCIES): webhook
+        запускается, когда все его зависимости ответили 'ready'. По умолчанию
+        граф - строгая цепочка, то есть прежняя последовательная отправка.
         
         Args:
             user_id: ID пользователя
             user_data: Данные пользователя
             spreadsheet_info: Информация о таблице от N8N
             progress_callback: Функция для уведомления пользователя о прогрессе
+            run_id: ID анализа для записи шагов в outbox (если outbox подключен)
+            completed: webhook'и, уже обработанные до перезапуска - они пропускаются
             
         Returns:
             Dict с результатами отправки
@@ -49,161 +172,244 @@ class SequentialWebhookService:
             'spreadsheet_info': spreadsheet_info
         }
         
-        results = {}
         webhook_list = list(self.webhooks.items())
+        positions = {name: i for i, (name, _) in enumerate(webhook_list, 1)}
+        total = len(webhook_list)
+        
+        # Шаги, успешно выполненные до перезапуска, считаются готовыми
+        results = {name: True for name, _ in webhook_list if name in (completed or ())}
         
-        await progress_callback(f"🚀 Начинаю отправку в {len(webhook_list)} систем...")
+        outbox = self.outbox if run_id else None
+        # Ключ идемпотентности шага: повторы, дубликаты и продолжение после
+        # перезапуска отправляют один и тот же ключ
+        idempotency_prefix = run_id or uuid.uuid4().hex
+        # Общая часть тела запроса кодируется один раз на анализ
+        payload_template = PayloadTemplate(user_data, spreadsheet_info, user_id)
+        if outbox is not None:
+            outbox.start_run(run_id, user_id, user_data, spreadsheet_info)
         
-        for i, (webhook_name, webhook_url) in enumerate(webhook_list, 1):
-            await progress_callback(f"📤 Отправляю в систему {i}/{len(webhook_list)} ({webhook_name})...\n⏰ Жду ответа до 3 минут")
+        if results:
+            await progress_callback(f"🔄 Продолжаю отправку: уже обработано {len(results)}/{total} систем")
+        else:
+            await progress_callback(f"🚀 Начинаю отправку в {total} систем...")
+        
+        async def run_step(webhook_name: str, webhook_url: str) -> bool:
+            i = positions[webhook_name]
+            breaker = self.circuit_breakers.get(webhook_name)
+            if breaker.is_open():
+                logger.warning(f"⛔ {webhook_name} недоступна (выключатель открыт), шаг пропущен без отправки")
+                await progress_callback(f"⛔ Система {i}/{total} ({webhook_name}) сейчас недоступна")
+                return False
+            
+            ready_timeout = self.latency_tracker.timeout(webhook_name, 'ready')
+            await progress_callback(
+                f"📤 Отправляю в систему {i}/{total} ({webhook_name})...\n"
+                f"⏰ Жду ответа до {format_duration(ready_timeout)}"
+            )
             
             # Подготавливаем данные с информацией о таблице
-            payload = self._prepare_payload_with_spreadsheet(user_data, spreadsheet_info, webhook_name, user_id)
+            idempotency_key = f"{idempotency_prefix}:{webhook_name}"
+            payload = payload_template.render(webhook_name, idempotency_key)
+            
+            async def report_queue_position(position: int):
+                await progress_callback(f"⏳ Система {i}/{total} сейчас занята, вы {position}-й в очереди")
             
-            # Отправляем webhook
-            success = await self._send_webhook_and_wait(webhook_name, webhook_url, payload, user_id)
-            results[webhook_name] = success
+            # Отправляем webhook, заняв слот системы на время ожидания ответа
+            async with self.target_scheduler.slot(webhook_name, user_id, on_queued=report_queue_position):
+                success = await self._send_webhook_and_wait(webhook_name, webhook_url, payload, user_id,
+                                                            ready_timeout=ready_timeout,
+                                                            idempotency_key=idempotency_key)
             
             if success:
-                await progress_callback(f"✅ Система {i}/{len(webhook_list)} обработана успешно")
+                await progress_callback(f"✅ Система {i}/{total} обработана успешно")
+                # Небольшая пауза перед запуском зависящих систем
+                await asyncio.sleep(self.step_pause_seconds)
             else:
-                await progress_callback(f"❌ Система {i}/{len(webhook_list)} не ответила за 3 минуты")
-                await progress_callback(f"🛑 ОСТАНОВКА: Прекращаю отправку в остальные системы")
-                
-                # Помечаем все оставшиеся webhook'и как неуспешные
-                for remaining_webhook, _ in webhook_list[i:]:
-                    results[remaining_webhook] = False
-                
-                break  # Прекращаем цикл при неудаче
+                await progress_callback(f"❌ Система {i}/{total} не ответила за {format_duration(ready_timeout)}")
+            return success
+        
+        # Webhook'и без невыполненных зависимостей идут параллельно;
+        # при неудаче останавливается только зависящая от нее ветка
+        running: Dict[asyncio.Task, str] = {}
+        
+        def start_ready_steps():
+            for webhook_name, webhook_url in webhook_list:
+                if webhook_name in results or webhook_name in running.values():
+                    continue
+                if all(results.get(dep) for dep in self.dependencies.get(webhook_name, [])):
+                    task = asyncio.create_task(run_step(webhook_name, webhook_url))
+                    running[task] = webhook_name
+        
+        try:
+            start_ready_steps()
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    webhook_name = running.pop(task)
+                    try:
+                        success = task.result()
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка шага {webhook_name}: {e}")
+                        success = False
+                    results[webhook_name] = success
+                    if outbox is not None:
+                        outbox.record_step(run_id, webhook_name, success)
+                    
+                    if not success:
+                        # Помечаем все зависящие webhook'и как неуспешные
+                        dependent = descendants(self.dependencies, webhook_name)
+                        skipped = [name for name, _ in webhook_list if name in dependent and name not in results]
+                        if skipped:
+                            await progress_callback(f"🛑 ОСТАНОВКА: Прекращаю отправку в зависящие системы ({', '.join(skipped)})")
+                        for remaining_webhook in skipped:
+                            results[remaining_webhook] = False
                 
-            # Небольшая пауза между отправками
-            await asyncio.sleep(0.5)
+                start_ready_steps()
+        finally:
+            for task in running:
+                task.cancel()
+        
+        if outbox is not None:
+            outbox.finish_run(run_id)
+        
+        results = {name: results[name] for name, _ in webhook_list if name in results}
         
         # Очищаем состояние пользователя
         if user_id in self.pending_webhooks:
             del self.pending_webhooks[user_id]
             
         successful = sum(1 for success in results.values() if success)
-        logger.info(f"Последовательная отправка завершена: {successful}/{len(results)} вебхуков")
+        logger.info(f"Отправка по графу зависимостей завершена: {successful}/{len(results)} вебхуков")
         
         return results
     
-    def _prepare_payload_with_spreadsheet(self, user_data: Dict[str, Any], 
-                                        spreadsheet_info: Dict[str, Any],
-                                        webhook_name: str, user_id: int) -> Dict[str, Any]:
-        """Подготавливает данные для отправки с информацией о таблице"""
-        
-        # Функция для безопасного преобразования значений в JSON-сериализуемые
-        def safe_json_value(value):
-            if hasattr(value, 'isoformat'):  # datetime объект
-                return value.isoformat()
-            elif not isinstance(value, (str, int, float, bool, type(None))):
-                return str(value)
-            return value
-        
-        # Безопасно получаем и преобразуем все значения
-        spreadsheet_id = safe_json_value(spreadsheet_info.get('spreadsheet_id', ''))
-        spreadsheet_url = safe_json_value(spreadsheet_info.get('spreadsheet_url', ''))
-        sheet_title = safe_json_value(spreadsheet_info.get('sheet_title', ''))
-        created_at = safe_json_value(spreadsheet_info.get('created_at', ''))
-        
-        return {
-            "event_type": "target_audience_analysis",
-            "timestamp": datetime.now().isoformat(),
-            "user_id": str(user_id),
-            "webhook_name": webhook_name,
-            "telegram_user_id": user_id,  # Дублируем для возврата
-            "user_data": {
-                "profession": user_data.get('profession', ''),
-                "segmentation": user_data.get('segmentation', ''),
-                "ideal_client_portrait": user_data.get('ideal_client', '')
-            },
-            "spreadsheet_info": {
-                "spreadsheet_id": spreadsheet_id,
-                "spreadsheet_url": spreadsheet_url,
-                "sheet_title": sheet_title,
-                "created_at": created_at
-            },
-            "analysis_data": {
-                "analysis_date": datetime.now().strftime("%d.%m.%Y"),
-                "characteristics": "Заполнить на основе описания",
-                "pain_points": "Заполнить на основе описания", 
-                "needs_and_desires": "Заполнить на основе описания",
-                "communication_channels": "Заполнить на основе исследования",
-                "recommendations": "Заполнить после анализа"
-            }
-        }
-    
     async def _send_webhook_and_wait(self, webhook_name: str, webhook_url: str, 
-                                   payload: Dict[str, Any], user_id: int) -> bool:
+                                   payload: bytes, user_id: int,
+                                   ready_timeout: Optional[float] = None,
+                                   idempotency_key: Optional[str] = None) -> bool:
         """
         Отправляет webhook и ждет ответа 'ready'
         
+        Таймауты берутся из latency_tracker; задержки POST и 'ready'
+        записываются обратно, чтобы следующие таймауты следовали за системой.
+        POST повторяется по retry_policy; все попытки несут один Idempotency-Key.
+        
         Returns:
             True если получен ответ 'ready', False иначе
         """
-        try:
-            
-            connector = aiohttp.TCPConnector(ssl=self.ssl_context)
-            async with aiohttp.ClientSession(timeout=self.timeout, connector=connector) as session:
-                async with session.post(
+        breaker = self.circuit_breakers.get(webhook_name)
+        if not breaker.allow_request():
+            logger.warning(f"⛔ {webhook_name}: выключатель открыт, запрос не отправлен")
+            return False
+        
+        # Регистрируем ожидание до отправки: система может ответить раньше,
+        # чем мы получим HTTP-ответ на POST
+        waiter = self.completion_registry.register(user_id, webhook_name)
+        tracker = self.latency_tracker
+        ack_timeout = tracker.timeout(webhook_name, 'ack')
+        if ready_timeout is None:
+            ready_timeout = tracker.timeout(webhook_name, 'ready')
+        hedge_delay = None
+        if config.WEBHOOK_HEDGING_ENABLED:
+            hedge_delay = tracker.quantile(webhook_name, 'ack', config.WEBHOOK_HEDGE_PERCENTILE)
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'TelegramBot-SequentialWebhook/1.0'
+        }
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        
+        async def attempt():
+            attempt_started = time.monotonic()
+            try:
+                async with self.http_client.post(
                     webhook_url,
-                    json=payload,
-                    headers={
-                        'Content-Type': 'application/json',
-                        'User-Agent': 'TelegramBot-SequentialWebhook/1.0'
-                    }
+                    data=payload,
+                    timeout=aiohttp.ClientTimeout(total=ack_timeout),
+                    headers=headers
                 ) as response:
-                    if response.status in [200, 201, 202]:
-                        logger.info(f"✅ Webhook {webhook_name} отправлен (статус: {response.status})")
-                        
-                        # Ждем ответа от webhook'а в течение таймаута
-                        return await self._wait_for_webhook_response(webhook_name, user_id)
-                    else:
-                        response_text = await response.text()
-                        logger.error(f"❌ Ошибка отправки {webhook_name}: {response.status} - {response_text}")
-                        return False
+                    tracker.observe(webhook_name, 'ack', time.monotonic() - attempt_started)
+                    response_text = '' if response.status in (200, 201, 202) else await response.text()
+                    return response.status, response_text, parse_retry_after(response.headers.get('Retry-After'))
+            except asyncio.TimeoutError:
+                tracker.observe_timeout(webhook_name, 'ack', ack_timeout)
+                raise
+        
+        system_responded = None  # None - запрос прерван, исход для выключателя неизвестен
+        try:
+            status, response_text, _ = await self.retry_policy.call(attempt, webhook_name, hedge_delay)
+            # Задержка 'ready' считается от подтверждения POST - с того же
+            # момента, с которого отсчитывается таймаут ожидания
+            acked = time.monotonic()
+            if status in (200, 201, 202):
+                logger.info(f"✅ Webhook {webhook_name} отправлен (статус: {status})")
+            else:
+                logger.error(f"❌ Ошибка отправки {webhook_name}: {status} - {response_text}")
+                system_responded = False
+                return False
+            
+            # Ждем ответа от webhook'а в течение таймаута
+            ready = await self._wait_for_webhook_response(webhook_name, user_id, waiter, ready_timeout)
+            # Любой callback (даже неожиданный) означает, что система жива
+            system_responded = waiter.result() is not None
+            if system_responded:
+                tracker.observe(webhook_name, 'ready', time.monotonic() - acked)
+            else:
+                tracker.observe_timeout(webhook_name, 'ready', ready_timeout)
+            return ready
                         
         except asyncio.TimeoutError:
-            logger.error(f"❌ Таймаут при отправке {webhook_name}")
+            logger.error(f"❌ Таймаут при отправке {webhook_name} ({ack_timeout:.1f} сек)")
+            system_responded = False
             return False
         except aiohttp.ClientError as e:
             logger.error(f"❌ Ошибка клиента {webhook_name}: {e}")
+            system_responded = False
             return False
         except Exception as e:
             logger.error(f"❌ Неожиданная ошибка {webhook_name}: {e}")
+            system_responded = False
             return False
+        finally:
+            self.completion_registry.discard(user_id, webhook_name, waiter)
+            if system_responded is True:
+                breaker.record_success()
+            elif system_responded is False:
+                breaker.record_failure()
+            else:
+                breaker.record_abandoned()
     
-    async def _wait_for_webhook_response(self, webhook_name: str, user_id: int, 
-                                       timeout_seconds: int = 180) -> bool:
+    async def _wait_for_webhook_response(self, webhook_name: str, user_id: int, waiter: asyncio.Future, 
+                                       timeout_seconds: float = 180) -> bool:
         """
-        Ждет ответа от webhook'а в течение 3 минут (180 секунд)
+        Ждет ответа от webhook'а в течение timeout_seconds (по умолчанию 3 минуты)
+        
+        Ожидание не опрашивает состояние: Future разрешается напрямую
+        из handle_webhook_response, а таймаут - общим планировщиком дедлайнов.
         
         Returns:
             True если получен ответ 'ready', False при таймауте
         """
-        start_time = asyncio.get_event_loop().time()
-        
-        while True:
-            # Проверяем получен ли ответ
-            if (user_id in self.pending_webhooks and 
-                webhook_name in self.pending_webhooks[user_id]['webhook_responses']):
-                response = self.pending_webhooks[user_id]['webhook_responses'][webhook_name]
-                if response.get('status') == 'ready':
-                    logger.info(f"✅ Получен ответ 'ready' от {webhook_name}")
-                    return True
-                else:
-                    logger.warning(f"⚠️ Получен неожиданный ответ от {webhook_name}: {response}")
-                    return False
-            
-            # Проверяем таймаут
-            elapsed = asyncio.get_event_loop().time() - start_time
-            if elapsed > timeout_seconds:
-                logger.error(f"❌ Таймаут ожидания ответа от {webhook_name}")
-                return False
-            
-            # Небольшая пауза перед следующей проверкой
-            await asyncio.sleep(0.1)
+        deadline = self.deadline_scheduler.schedule(
+            timeout_seconds, self.completion_registry.expire, user_id, webhook_name,
+            name=f"webhook:{user_id}:{webhook_name}"
+        )
+        try:
+            response = await waiter
+        finally:
+            # Ответ пришел раньше - дедлайн больше не нужен
+            deadline.cancel()
+        
+        if response is None:
+            logger.error(f"❌ Таймаут ожидания ответа от {webhook_name} ({timeout_seconds:.0f} сек)")
+            return False
+        
+        if response.get('status') == 'ready':
+            logger.info(f"✅ Получен ответ 'ready' от {webhook_name}")
+            return True
+        
+        logger.warning(f"⚠️ Получен неожиданный ответ от {webhook_name}: {response}")
+        return False
     
     def handle_webhook_response(self, response_data: Dict[str, Any]) -> bool:
         """
@@ -231,8 +437,9 @@ class SequentialWebhookService:
                 logger.warning(f"Получен ответ для неизвестного пользователя {user_id}")
                 return False
             
-            # Сохраняем ответ
+            # Сохраняем ответ и будим ожидающий шаг
             self.pending_webhooks[user_id]['webhook_responses'][webhook_id] = response_data
+            self.completion_registry.resolve(user_id, webhook_id, response_data)
             
             logger.info(f"📨 Получен ответ от {webhook_id} для пользователя {user_id}: {status}")
             return True
@@ -241,6 +448,24 @@ class SequentialWebhookService:
             logger.error(f"Ошибка обработки ответа webhook: {e}")
             return False
     
+    def has_run(self, user_id: int) -> bool:
+        """Выполняется ли на этой реплике анализ пользователя"""
+        return user_id in self.pending_webhooks
+    
+    @staticmethod
+    def get_response_run_key(response_data: Dict[str, Any]) -> Optional[int]:
+        """ID пользователя из полного ответа системы, None если ответ неполный"""
+        if not response_data.get('webhook_id') or not response_data.get('status'):
+            return None
+        try:
+            return int(response_data.get('user_id', 0)) or None
+        except (TypeError, ValueError):
+            return None
+    
+    def get_waiters_count(self) -> int:
+        """Возвращает количество шагов, ожидающих ответа 'ready'"""
+        return self.completion_registry.get_waiters_count()
+    
     def get_configured_webhooks_count(self) -> int:
         """Возвращает количество настроенных вебхуков"""
         return len(self.webhooks)
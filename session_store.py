@@ -0,0 +1,336 @@
+"""Хранилище диалоговых сессий пользователей с вытеснением неактивных"""
+import asyncio
+import logging
+import random
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class UserSession:
+    """
+    Сессия диалога одного пользователя
+
+    Фиксированный набор полей в __slots__: без __dict__ на каждую сессию.
+    Ответы хранятся один раз; user_data собирается из них по запросу.
+    """
+
+    __slots__ = ('state', 'profession', 'segmentation', 'ideal_client', 'n8n_request_id', 'last_active')
+
+    def __init__(self, state: Optional[int] = None, profession: Optional[str] = None,
+                 segmentation: Optional[str] = None, ideal_client: Optional[str] = None,
+                 n8n_request_id: Optional[str] = None):
+        self.state = state
+        self.profession = profession
+        self.segmentation = segmentation
+        self.ideal_client = ideal_client
+        self.n8n_request_id = n8n_request_id
+        self.last_active = time.monotonic()
+
+    @property
+    def user_data(self) -> Dict[str, str]:
+        """Ответы пользователя в формате, который ожидают сервисы отправки"""
+        return {
+            'profession': self.profession or '',
+            'segmentation': self.segmentation or '',
+            'ideal_client': self.ideal_client or ''
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Поля сессии для общего хранилища (без отметки активности - она локальная)"""
+        return {
+            'state': self.state,
+            'profession': self.profession,
+            'segmentation': self.segmentation,
+            'ideal_client': self.ideal_client,
+            'n8n_request_id': self.n8n_request_id
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'UserSession':
+        return cls(data.get('state'), data.get('profession'), data.get('segmentation'),
+                   data.get('ideal_client'), data.get('n8n_request_id'))
+
+    def estimate_size(self) -> int:
+        """Примерный объем памяти сессии в байтах (объект и строки ответов)"""
+        size = sys.getsizeof(self)
+        for value in (self.profession, self.segmentation, self.ideal_client, self.n8n_request_id):
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+
+class SessionStore:
+    """
+    Сессии пользователей в порядке последней активности (LRU)
+
+    - get() и set() переносят сессию в конец порядка
+    - сессии без активности дольше idle_ttl вытесняются с начала порядка
+      при каждой записи: затраты пропорциональны числу вытесненных
+    - при превышении max_sessions вытесняется самая давно активная сессия
+    - on_evict(user_id, session, reason) вызывается при вытеснении, чтобы
+      владелец снял связанные с сессией ресурсы (например, индекс N8N)
+    - сессии, для которых is_pinned(session) истинно (анализ в очереди или
+      ожидание таблицы), не вытесняются: они считаются активными и
+      переносятся в конец порядка, пока владелец сам их не завершит
+
+    С общим хранилищем состояния (backend.shared) локальные сессии - кэш:
+    load() читает сессию из хранилища, set(), save() и pop() записывают
+    изменения туда фоновыми задачами. save() и удаление выполняются
+    compare-and-set относительно последней версии, которую эта реплика
+    прочитала или записала: сессию, которую другая реплика уже изменила или
+    завершила, устаревшая копия не перезапишет - она только удаляется из кэша.
+    """
+
+    KEY_PREFIX = 'session:'
+
+    def __init__(self, idle_ttl: Optional[float] = None, max_sessions: Optional[int] = None,
+                 on_evict: Optional[Callable[[int, UserSession, str], None]] = None,
+                 backend=None, is_pinned: Optional[Callable[[UserSession], bool]] = None):
+        self.idle_ttl = idle_ttl or config.SESSION_IDLE_TTL_SECONDS
+        self.max_sessions = max_sessions or config.SESSION_MAX_COUNT
+        self.on_evict = on_evict
+        self.is_pinned = is_pinned
+        self.backend = backend if backend is not None and backend.shared else None
+        self._sessions: 'OrderedDict[int, UserSession]' = OrderedDict()
+        self._synced: Dict[int, Dict[str, Any]] = {}  # Последняя версия в хранилище, известная реплике
+        self._replication_tasks = set()
+
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        self.stale_saves = 0
+
+    # --- доступ ---
+
+    def get(self, user_id: int) -> Optional[UserSession]:
+        """Сессия пользователя с отметкой активности (None, если нет)"""
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(user_id)
+        return session
+
+    def peek(self, user_id: int) -> Optional[UserSession]:
+        """Сессия без отметки активности"""
+        return self._sessions.get(user_id)
+
+    async def load(self, user_id: int) -> Optional[UserSession]:
+        """
+        Актуальная сессия пользователя с отметкой активности
+
+        Без общего хранилища - то же, что get(). С ним сессия читается из
+        хранилища: предыдущее сообщение пользователя могла обработать другая реплика.
+        """
+        if self.backend is None:
+            return self.get(user_id)
+        data = await self.backend.get(self._key(user_id))
+        if data is None:
+            self._forget_local(user_id)
+            return None
+        session = UserSession.from_dict(data)
+        self._store(user_id, session)
+        self._synced[user_id] = data
+        return session
+
+    def set(self, user_id: int, session: UserSession):
+        """Сохраняет новую сессию, заменяя любую прежнюю (и в общем хранилище)"""
+        self._store(user_id, session)
+        if self.backend is not None:
+            value = session.to_dict()
+            self._synced[user_id] = value
+            self._replicate(self.backend.set(self._key(user_id), value, ttl=self.idle_ttl))
+
+    def save(self, user_id: int, session: UserSession):
+        """
+        Записывает измененные поля сессии в общее хранилище (без него - ничего)
+
+        Запись - compare-and-set от последней известной реплике версии. Если
+        другая реплика успела изменить или завершить сессию, локальная копия
+        устарела: она удаляется из кэша, а в хранилище ничего не пишется.
+        """
+        if self.backend is None:
+            return
+        expected = self._synced.get(user_id)
+        if expected is None:
+            # Версия неизвестна (копия вытеснена или завершена) - писать нельзя
+            self._drop_stale(user_id, session)
+            return
+        value = session.to_dict()
+        self._synced[user_id] = value
+        self._replicate(self._save_remote(user_id, session, expected, value))
+
+    async def _save_remote(self, user_id: int, session: UserSession,
+                           expected: Dict[str, Any], value: Dict[str, Any]):
+        if not await self.backend.compare_and_set(self._key(user_id), expected, value, ttl=self.idle_ttl):
+            self._drop_stale(user_id, session)
+
+    def forget(self, user_id: int, session: Optional[UserSession] = None):
+        """
+        Удаляет из кэша копию сессии, которая могла устареть, ничего не записывая
+
+        Без общего хранилища локальная копия - единственная, она не удаляется.
+        """
+        if self.backend is None:
+            return
+        if session is None or self._sessions.get(user_id) is session:
+            self._forget_local(user_id)
+
+    def _drop_stale(self, user_id: int, session: UserSession):
+        self.stale_saves += 1
+        logger.info(f"🔄 Сессия пользователя {user_id} изменена другой репликой, локальная копия сброшена")
+        if self._sessions.get(user_id) is session:
+            self._forget_local(user_id)
+
+    def _forget_local(self, user_id: int):
+        self._sessions.pop(user_id, None)
+        self._synced.pop(user_id, None)
+
+    def _store(self, user_id: int, session: UserSession):
+        session.last_active = time.monotonic()
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        self.evict_idle()
+        candidates = len(self._sessions)
+        while len(self._sessions) > self.max_sessions and candidates > 0:
+            candidates -= 1
+            evicted_id, evicted = next(iter(self._sessions.items()))
+            if self._pinned(evicted_id, evicted):
+                continue
+            del self._sessions[evicted_id]
+            self._synced.pop(evicted_id, None)
+            self.evicted_lru += 1
+            self._notify_evicted(evicted_id, evicted, 'lru')
+        if len(self._sessions) > self.max_sessions:
+            logger.warning(f"⚠️ Сессий больше лимита ({len(self._sessions)} > {self.max_sessions}): "
+                           f"остальные заняты выполняющимися анализами")
+
+    def pop(self, user_id: int, default: Any = None) -> Optional[UserSession]:
+        session = self._sessions.pop(user_id, None)
+        if session is None:
+            return default
+        expected = self._synced.pop(user_id, None)
+        if self.backend is not None:
+            self._replicate(self.backend.compare_and_set(self._key(user_id), expected or session.to_dict(), None))
+        return session
+
+    def discard(self, user_id: int, session: UserSession) -> Optional[UserSession]:
+        """
+        Удаляет сессию, только если она все еще текущая (None - уже заменена)
+
+        Так фоновый анализ не сотрет новую сессию, начатую через /start.
+        С общим хранилищем локальная копия могла быть перечитана или вытеснена,
+        поэтому сравниваются поля, а в хранилище удаляется compare-and-set.
+        """
+        current = self._sessions.get(user_id)
+        if current is session:
+            return self.pop(user_id)
+        if self.backend is None:
+            return None
+        if current is None:
+            self._replicate(self.backend.compare_and_set(self._key(user_id), session.to_dict(), None))
+            return session
+        if current.to_dict() == session.to_dict():
+            return self.pop(user_id)
+        return None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def items(self) -> Iterator[Tuple[int, UserSession]]:
+        return iter(list(self._sessions.items()))
+
+    def clear(self):
+        self._sessions.clear()
+        self._synced.clear()
+
+    # --- вытеснение ---
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Вытесняет сессии, неактивные дольше idle_ttl"""
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_active < self.idle_ttl:
+                break
+            if self._pinned(user_id, session, now):
+                continue
+            del self._sessions[user_id]
+            self._synced.pop(user_id, None)
+            evicted += 1
+            self._notify_evicted(user_id, session, 'idle')
+        self.evicted_idle += evicted
+        return evicted
+
+    def _pinned(self, user_id: int, session: UserSession, now: Optional[float] = None) -> bool:
+        """Закрепленная сессия не вытесняется: отмечается активной и переносится в конец"""
+        if self.is_pinned is None or not self.is_pinned(session):
+            return False
+        session.last_active = time.monotonic() if now is None else now
+        self._sessions.move_to_end(user_id)
+        return True
+
+    # --- общее хранилище ---
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.KEY_PREFIX}{user_id}"
+
+    def _replicate(self, operation):
+        """Запись в общее хранилище фоновой задачей (порядок записей сохраняется)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            operation.close()  # Вне event loop (скрипты, тесты) - только локально
+            return
+        task = loop.create_task(self._run_replication(operation))
+        self._replication_tasks.add(task)
+        task.add_done_callback(self._replication_tasks.discard)
+
+    @staticmethod
+    async def _run_replication(operation):
+        try:
+            await operation
+        except Exception as e:
+            logger.error(f"❌ Не удалось записать сессию в общее хранилище: {e}")
+
+    def _notify_evicted(self, user_id: int, session: UserSession, reason: str):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(user_id, session, reason)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка обработки вытеснения сессии {user_id}: {e}")
+
+    # --- учет памяти ---
+
+    def get_stats(self, sample_size: int = 1000) -> Dict[str, Any]:
+        """
+        Число сессий, вытеснения и оценка памяти
+
+        Память считается по выборке из sample_size сессий, умноженной на их
+        число, плюс собственный объем словаря.
+        """
+        count = len(self._sessions)
+        if count <= sample_size:
+            sample, scale = list(self._sessions.items()), 1.0
+        else:
+            sample, scale = random.sample(list(self._sessions.items()), sample_size), count / sample_size
+        # Ключ (ID пользователя) - тоже отдельный объект int
+        sampled = sum(sys.getsizeof(user_id) + session.estimate_size() for user_id, session in sample)
+
+        return {
+            'sessions': count,
+            'max_sessions': self.max_sessions,
+            'idle_ttl_seconds': self.idle_ttl,
+            'evicted_idle': self.evicted_idle,
+            'evicted_lru': self.evicted_lru,
+            'stale_saves': self.stale_saves,
+            'memory_bytes': int(sampled * scale) + sys.getsizeof(self._sessions)
+        }
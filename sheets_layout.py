@@ -0,0 +1,113 @@
+"""Оформление таблицы анализа: тело spreadsheets.create и запросы batchUpdate"""
+from typing import Any, Dict, List, Optional
+
+SHEET_TITLE = 'Анализ ЦА'
+COLUMN_WIDTHS = (220, 520)  # Пикселей: подписи и значения
+
+TITLE_FORMAT = {
+    'textFormat': {'bold': True, 'fontSize': 14},
+    'backgroundColor': {'red': 0.85, 'green': 0.92, 'blue': 1.0}
+}
+LABEL_FORMAT = {'textFormat': {'bold': True}, 'verticalAlignment': 'TOP'}
+VALUE_FORMAT = {'wrapStrategy': 'WRAP', 'verticalAlignment': 'TOP'}
+
+# Поля ячеек, которые задаются при заполнении существующего листа
+CELL_FIELDS = 'userEnteredValue,userEnteredFormat'
+
+
+def analysis_rows(user_data: Dict[str, Any], current_date: str) -> List[List[str]]:
+    """Строки листа анализа (те же, что раньше записывались values.update в A1)"""
+    return [
+        ['🎯 АНАЛИЗ ЦЕЛЕВОЙ АУДИТОРИИ'],
+        [''],
+        ['Профессия эксперта:', user_data['profession']],
+        ['Сегментация:', user_data['segmentation']],
+        ['Идеальный клиент:', user_data['ideal_client']],
+        ['Дата анализа:', current_date]
+    ]
+
+
+def _cell(value: str, cell_format: Dict[str, Any]) -> Dict[str, Any]:
+    return {'userEnteredValue': {'stringValue': value}, 'userEnteredFormat': cell_format}
+
+
+def row_data(rows: List[List[str]]) -> List[Dict[str, Any]]:
+    """RowData: первая строка - заголовок, в остальных подпись и значение"""
+    result = []
+    for index, row in enumerate(rows):
+        if index == 0:
+            cells = [_cell(row[0], TITLE_FORMAT)]
+        else:
+            cells = [_cell(value, LABEL_FORMAT if column == 0 else VALUE_FORMAT)
+                     for column, value in enumerate(row)]
+        result.append({'values': cells})
+    return result
+
+
+def sheet_properties(sheet_id: int = 0, title: str = SHEET_TITLE) -> Dict[str, Any]:
+    return {
+        'sheetId': sheet_id,
+        'title': title,
+        'gridProperties': {'frozenRowCount': 1}
+    }
+
+
+def spreadsheet_body(spreadsheet_title: str, user_data: Dict[str, Any], current_date: str,
+                     sheet_title: str = SHEET_TITLE) -> Dict[str, Any]:
+    """Тело spreadsheets.create: свойства, лист, данные и оформление в одном запросе"""
+    return {
+        'properties': {'title': spreadsheet_title, 'locale': 'ru_RU'},
+        'sheets': [{
+            'properties': sheet_properties(title=sheet_title),
+            'data': [{
+                'startRow': 0,
+                'startColumn': 0,
+                'rowData': row_data(analysis_rows(user_data, current_date)),
+                'columnMetadata': [{'pixelSize': width} for width in COLUMN_WIDTHS]
+            }]
+        }]
+    }
+
+
+def fill_requests(sheet_id: int, user_data: Dict[str, Any], current_date: str,
+                  spreadsheet_title: Optional[str] = None, sheet_title: str = SHEET_TITLE) -> List[Dict[str, Any]]:
+    """
+    Запросы batchUpdate, приводящие существующий лист к тому же виду, что и
+    spreadsheet_body: название (если задано), свойства листа, ячейки с
+    оформлением и ширина колонок
+    """
+    requests = []
+    if spreadsheet_title is not None:
+        requests.append({'updateSpreadsheetProperties': {
+            'properties': {'title': spreadsheet_title},
+            'fields': 'title'
+        }})
+    requests.append({'updateSheetProperties': {
+        'properties': sheet_properties(sheet_id, sheet_title),
+        'fields': 'title,gridProperties.frozenRowCount'
+    }})
+    return requests + content_requests(sheet_id, user_data, current_date)
+
+
+def add_tab_requests(sheet_id: int, tab_title: str, user_data: Dict[str, Any],
+                     current_date: str) -> List[Dict[str, Any]]:
+    """Запросы batchUpdate: новая вкладка анализа первой в таблице и ее содержимое"""
+    properties = sheet_properties(sheet_id, tab_title)
+    properties['index'] = 0
+    return [{'addSheet': {'properties': properties}}] + content_requests(sheet_id, user_data, current_date)
+
+
+def content_requests(sheet_id: int, user_data: Dict[str, Any], current_date: str) -> List[Dict[str, Any]]:
+    """Ячейки с оформлением и ширина колонок листа"""
+    requests = [{'updateCells': {
+        'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+        'rows': row_data(analysis_rows(user_data, current_date)),
+        'fields': CELL_FIELDS
+    }}]
+    for column, width in enumerate(COLUMN_WIDTHS):
+        requests.append({'updateDimensionProperties': {
+            'range': {'sheetId': sheet_id, 'dimension': 'COLUMNS', 'startIndex': column, 'endIndex': column + 1},
+            'properties': {'pixelSize': width},
+            'fields': 'pixelSize'
+        }})
+    return requests
@@ -0,0 +1,242 @@
+"""Объединение строк многих пользователей в пакетные записи в общую таблицу результатов"""
+import asyncio
+import atexit
+import json
+import logging
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import config
+from google_sheets_async import SheetsApiError
+from retry_policy import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsWriteCoalescer:
+    """
+    Буфер строк для общей таблицы: один values.append на пакет вместо
+    запроса на каждую строку
+
+    - пакет отправляется раз в flush_interval секунд или сразу по набору
+      batch_size строк
+    - временная ошибка записи повторяется с экспоненциальным backoff (без
+      ограничения числа попыток: строки не теряются, пока API недоступен),
+      новые строки в это время копятся в буфере
+    - постоянная ошибка (403, 404, 400: таблица не открыта сервисному
+      аккаунту, неверный id или диапазон) останавливает запись до
+      перезапуска: строки уходят в spill_path, запросы к API прекращаются
+    - строки сверх max_buffer и все неотправленные строки при остановке
+      (в том числе пакет, прерванный посреди записи) дописываются в
+      spill_path (JSONL); при следующем запуске они загружаются в буфер
+
+    Доставка "хотя бы один раз": пакет, прерванный посреди запроса, мог
+    быть записан API и после запуска будет записан повторно.
+    """
+
+    FINAL_FLUSH_TIMEOUT = 5.0  # Последняя попытка записи при остановке, сек
+    MAX_BACKOFF_ATTEMPT = 30   # Дальше пауза не растет (и 2 ** attempt не переполняется)
+
+    def __init__(self, client, spreadsheet_id: str, range_name: Optional[str] = None,
+                 flush_interval: Optional[float] = None, batch_size: Optional[int] = None,
+                 max_buffer: Optional[int] = None, spill_path: Optional[str] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.range_name = range_name or config.SHEETS_MASTER_RANGE
+        self.flush_interval = flush_interval or config.SHEETS_MASTER_FLUSH_INTERVAL
+        self.batch_size = batch_size or config.SHEETS_MASTER_BATCH_SIZE
+        self.max_buffer = max(self.batch_size, max_buffer or config.SHEETS_MASTER_MAX_BUFFER)
+        self.spill_path = config.SHEETS_MASTER_SPILL_PATH if spill_path is None else spill_path
+        self.retry_policy = retry_policy or RetryPolicy(
+            base_delay=config.SHEETS_MASTER_RETRY_BASE_DELAY,
+            max_delay=config.SHEETS_MASTER_RETRY_MAX_DELAY
+        )
+
+        self._buffer: Deque[List[Any]] = deque()
+        self._in_flight: List[List[Any]] = []  # Пакет, который пишется сейчас
+        self._flush_now: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._failing = False
+        self.fatal_error: Optional[str] = None  # Постоянная ошибка API: запись остановлена
+
+        self.rows_added = 0
+        self.rows_written = 0
+        self.append_requests = 0
+        self.failed_attempts = 0
+        self.max_batch = 0
+        self.spilled_rows = 0
+        self.recovered_rows = 0
+
+    async def start(self):
+        """Загружает строки, сохраненные при прошлой остановке, и запускает запись"""
+        recovered = self._load_spilled()
+        self._buffer.extendleft(reversed(recovered))
+        self.recovered_rows += len(recovered)
+        self._flush_now = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+        atexit.register(self._spill_all)  # Если процесс завершится без close()
+        if recovered:
+            logger.info(f"📥 Общая таблица: восстановлено {len(recovered)} неотправленных строк")
+            self._flush_now.set()
+
+    async def close(self):
+        """Останавливает запись: последняя попытка отправить буфер, остаток - в файл"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        atexit.unregister(self._spill_all)
+
+        if self._buffer and not self._failing and self.fatal_error is None:
+            try:
+                await asyncio.wait_for(self._flush_batch(), timeout=self.FINAL_FLUSH_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"⚠️ Общая таблица: последняя запись не удалась ({e})")
+                self._return_in_flight()
+        self._spill_all()
+
+    def add(self, row: List[Any]):
+        """Ставит строку в буфер (не ждет записи)"""
+        self._buffer.append(row)
+        self.rows_added += 1
+        if len(self._buffer) > self.max_buffer:
+            # API долго недоступен: старые строки уходят в файл, а не копятся в памяти
+            overflow = [self._buffer.popleft() for _ in range(len(self._buffer) - self.max_buffer)]
+            self._spill(overflow)
+        if len(self._buffer) >= self.batch_size and self._flush_now is not None:
+            self._flush_now.set()
+
+    async def _flush_loop(self):
+        attempt = 0
+        while True:
+            try:
+                if attempt:
+                    await asyncio.sleep(self.retry_policy.backoff(min(attempt, self.MAX_BACKOFF_ATTEMPT)))
+                else:
+                    try:
+                        await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                self._flush_now.clear()
+                if not self._buffer:
+                    continue
+                await self._flush_batch()
+            except asyncio.CancelledError:
+                raise
+            except SheetsApiError as e:
+                if not self.retry_policy.is_retryable_status(e.status):
+                    self._stop_on_error(e)
+                    return
+                attempt = self._record_failure(attempt, e)
+                continue
+            except Exception as e:
+                # Любая другая ошибка (сеть, таймаут, сбой в самом цикле) - повтор, задача не умирает
+                attempt = self._record_failure(attempt, e)
+                continue
+
+            attempt = 0
+            self._failing = False
+            if len(self._buffer) >= self.batch_size:
+                self._flush_now.set()  # Накопилось еще на пакет - пишем сразу
+
+    def _record_failure(self, attempt: int, error: Exception) -> int:
+        self._return_in_flight()
+        attempt += 1
+        self.failed_attempts += 1
+        self._failing = True
+        logger.warning(f"⚠️ Общая таблица: запись {len(self._buffer)} строк не удалась "
+                       f"(попытка {attempt}): {error}")
+        return attempt
+
+    def _stop_on_error(self, error: SheetsApiError):
+        """Постоянная ошибка API: повторы не помогут, строки сохраняются в файл"""
+        self.failed_attempts += 1
+        self._failing = True
+        self.fatal_error = str(error)
+        logger.error(f"❌ Общая таблица: запись остановлена до перезапуска ({error}); "
+                     f"проверьте SHEETS_MASTER_SPREADSHEET_ID, SHEETS_MASTER_RANGE и доступ сервисного аккаунта")
+        self._spill_all()
+
+    async def _flush_batch(self):
+        """Один values.append с первыми batch_size строками буфера"""
+        count = min(self.batch_size, len(self._buffer))
+        self._in_flight = [self._buffer.popleft() for _ in range(count)]
+        try:
+            await self.client.append_values(self.spreadsheet_id, self.range_name, self._in_flight)
+        except asyncio.CancelledError:
+            self._return_in_flight()
+            raise
+        self.append_requests += 1
+        self.rows_written += count
+        self.max_batch = max(self.max_batch, count)
+        self._in_flight = []
+        logger.debug(f"📤 Общая таблица: записано {count} строк одним запросом")
+
+    def _return_in_flight(self):
+        """Возвращает неотправленный пакет в начало буфера (порядок строк сохраняется)"""
+        self._buffer.extendleft(reversed(self._in_flight))
+        self._in_flight = []
+
+    def _spill_all(self):
+        self._return_in_flight()
+        rows = list(self._buffer)
+        self._buffer.clear()
+        self._spill(rows)
+
+    def _spill(self, rows: List[List[Any]]):
+        """Дописывает строки в файл JSONL"""
+        if not rows:
+            return
+        if not self.spill_path:
+            logger.error(f"❌ Общая таблица: {len(rows)} строк потеряно (файл для сохранения не задан)")
+            return
+        try:
+            directory = os.path.dirname(self.spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.spilled_rows += len(rows)
+            logger.info(f"💾 Общая таблица: {len(rows)} строк сохранено в {self.spill_path}")
+        except Exception as e:
+            logger.error(f"❌ Общая таблица: не удалось сохранить {len(rows)} строк: {e}")
+
+    def _load_spilled(self) -> List[List[Any]]:
+        """Читает и удаляет файл сохраненных строк"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return []
+        rows = []
+        broken = 0
+        try:
+            with open(self.spill_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        broken += 1  # Например, строка, оборванная аварийным завершением
+            os.remove(self.spill_path)
+        except OSError as e:
+            logger.warning(f"⚠️ Общая таблица: не удалось прочитать {self.spill_path}: {e}")
+        if broken:
+            logger.warning(f"⚠️ Общая таблица: пропущено {broken} поврежденных строк в {self.spill_path}")
+        return rows
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'buffered': len(self._buffer),
+            'in_flight': len(self._in_flight),
+            'rows_added': self.rows_added,
+            'rows_written': self.rows_written,
+            'append_requests': self.append_requests,
+            'rows_per_request': round(self.rows_written / self.append_requests, 1) if self.append_requests else None,
+            'max_batch': self.max_batch,
+            'failed_attempts': self.failed_attempts,
+            'failing': self._failing,
+            'fatal_error': self.fatal_error,
+            'spilled_rows': self.spilled_rows,
+            'recovered_rows': self.recovered_rows
+        }
@@ -0,0 +1,185 @@
+"""Пул заранее созданных пустых Google таблиц"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import config
+from google_sheets_async import SheetsApiError
+
+logger = logging.getLogger(__name__)
+
+BLANK_TITLE = '[резерв] Анализ ЦА'
+
+
+class SpreadsheetPool:
+    """
+    Держит наготове пустые таблицы, чтобы анализ не ждал spreadsheets.create
+
+    - claim() отдает готовую таблицу сразу (попадание) или None (промах -
+      таблица создается обычным путем)
+    - пополнение идет фоновой задачей: глубина - не меньше target_size и не
+      меньше числа таблиц, взятых за последнюю минуту (спрос), но не больше
+      max_size
+    - создание ограничено квотой creates_per_minute; при 429 и ошибках
+      сервера пополнение приостанавливается с удвоением паузы
+    - id готовых таблиц сохраняются в файл, после перезапуска они не теряются
+    """
+
+    DEMAND_WINDOW = 60.0  # Секунд, за которые считается спрос
+    IDLE_CHECK = 30.0     # Пересчет глубины без событий (спрос убывает со временем)
+
+    def __init__(self, client, target_size: Optional[int] = None, max_size: Optional[int] = None,
+                 creates_per_minute: Optional[int] = None, path: Optional[str] = None,
+                 create_fields: Optional[str] = None):
+        self.client = client
+        self.target_size = config.SHEETS_POOL_SIZE if target_size is None else target_size
+        self.max_size = max(self.target_size, config.SHEETS_POOL_MAX_SIZE if max_size is None else max_size)
+        self.creates_per_minute = creates_per_minute or config.SHEETS_POOL_CREATES_PER_MINUTE
+        self.path = config.SHEETS_POOL_PATH if path is None else path
+        self.create_fields = create_fields
+
+        self._ready: Deque[Dict[str, Any]] = deque()
+        self._claims: Deque[float] = deque()    # Моменты claim() за окно спроса
+        self._creates: Deque[float] = deque()   # Моменты создания за минуту (квота)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._backoff = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.create_errors = 0
+        self.quota_waits = 0
+
+    async def start(self):
+        """Загружает сохраненные таблицы и запускает пополнение"""
+        self._load()
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._refill_loop())
+        logger.info(f"📦 Пул таблиц запущен: готово {len(self._ready)}, цель {self.target_size}")
+
+    async def close(self):
+        # Флаг, а не только cancel: в Python 3.11 wait_for теряет отмену,
+        # пришедшую вместе с пробуждением (claim прямо перед остановкой)
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._save()
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Забирает готовую таблицу ({'spreadsheet_id', 'sheet_id', 'created_at'}) или None"""
+        now = time.monotonic()
+        self._claims.append(now)
+        entry = self._ready.popleft() if self._ready else None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._save()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return entry
+
+    def desired_depth(self) -> int:
+        """Сколько таблиц держать готовыми с учетом спроса за последнюю минуту"""
+        cutoff = time.monotonic() - self.DEMAND_WINDOW
+        while self._claims and self._claims[0] < cutoff:
+            self._claims.popleft()
+        return min(self.max_size, max(self.target_size, len(self._claims)))
+
+    def _quota_wait(self) -> float:
+        """Секунд до разрешения следующего создания по квоте"""
+        cutoff = time.monotonic() - 60.0
+        while self._creates and self._creates[0] < cutoff:
+            self._creates.popleft()
+        if len(self._creates) < self.creates_per_minute:
+            return 0.0
+        return self._creates[0] - cutoff
+
+    async def _refill_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.IDLE_CHECK)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while not self._closing and len(self._ready) < self.desired_depth():
+                wait = self._quota_wait()
+                if wait > 0:
+                    self.quota_waits += 1
+                    await asyncio.sleep(wait)
+                    continue
+                if not await self._create_one():
+                    await asyncio.sleep(self._backoff)
+
+    async def _create_one(self) -> bool:
+        self._creates.append(time.monotonic())
+        try:
+            spreadsheet = await self.client.create_spreadsheet(
+                {'properties': {'title': BLANK_TITLE}}, fields=self.create_fields
+            )
+        except Exception as e:
+            self.create_errors += 1
+            retryable = not isinstance(e, SheetsApiError) or e.status == 429 or e.status >= 500
+            # Ошибки доступа не исправятся повтором - пауза сразу максимальная
+            self._backoff = min(300.0, max(5.0, self._backoff * 2)) if retryable else 300.0
+            logger.warning(f"⚠️ Пул таблиц: не удалось создать таблицу ({e}), пауза {self._backoff:.0f} сек")
+            return False
+
+        self._backoff = 0.0
+        sheets = spreadsheet.get('sheets') or [{}]
+        self._ready.append({
+            'spreadsheet_id': spreadsheet['spreadsheetId'],
+            'sheet_id': sheets[0].get('properties', {}).get('sheetId', 0),
+            'created_at': time.time()
+        })
+        self.created += 1
+        self._save()
+        return True
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._ready = deque(json.load(f))
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить пул таблиц: {e}")
+
+    def _save(self):
+        """Сохраняет id готовых таблиц атомарной заменой файла"""
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self._ready), f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить пул таблиц: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        claims = self.hits + self.misses
+        return {
+            'depth': len(self._ready),
+            'desired_depth': self.desired_depth(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / claims, 3) if claims else None,
+            'created': self.created,
+            'create_errors': self.create_errors,
+            'quota_waits': self.quota_waits,
+            'backoff_seconds': self._backoff
+        }
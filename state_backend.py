@@ -0,0 +1,592 @@
+"""Общее состояние реплик бота: в памяти процесса, в Redis или в SQLite"""
+import asyncio
+from abc import ABC, abstractmethod
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+import config
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Режимы STATE_BACKEND
+BACKEND_MEMORY = 'memory'
+BACKEND_REDIS = 'redis'
+BACKEND_SQLITE = 'sqlite'
+
+
+class StateBackendError(Exception):
+    """Хранилище состояния недоступно или вернуло ошибку"""
+
+
+def _encode(value: Dict[str, Any]) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _decode(raw: Optional[Any]) -> Optional[Dict[str, Any]]:
+    if raw is None:
+        return None
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    return json.loads(raw)
+
+
+class StateBackend(ABC):
+    """
+    Хранилище общего состояния
+
+    - значения - JSON-словари, у каждого может быть TTL
+    - compare_and_set атомарно заменяет значение, только если текущее равно
+      ожидаемому: из нескольких реплик переход выполняет ровно одна
+    - publish доставляет сообщение обработчикам subscribe на всех репликах,
+      включая отправителя; обработчики выполняются отдельными задачами
+
+    shared=False - состояние видно только этому процессу (одна реплика).
+    Реализация обязана определить get, set, delete, compare_and_set и publish.
+    """
+
+    name = 'base'
+    shared = False
+
+    def __init__(self):
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._delivery_tasks = set()
+
+        self.published = 0
+        self.delivered = 0
+        self.cas_conflicts = 0
+
+    # --- жизненный цикл ---
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # --- значения ---
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def compare_and_set(self, key: str, expected: Optional[Dict[str, Any]],
+                              value: Optional[Dict[str, Any]], ttl: Optional[float] = None) -> bool:
+        """
+        Записывает value, если текущее значение равно expected
+
+        expected=None - ключа не должно быть; value=None - ключ удаляется.
+        False - значение уже изменила другая реплика.
+        """
+        raise NotImplementedError
+
+    async def transition(self, key: str, field: str, expected: Any, updates: Dict[str, Any],
+                         ttl: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Атомарный переход записи из состояния field == expected
+
+        Возвращает обновленную запись или None, если записи нет или ее
+        уже перевела в другое состояние другая реплика.
+        """
+        while True:
+            current = await self.get(key)
+            if current is None or current.get(field) != expected:
+                return None
+            updated = {**current, **updates}
+            if await self.compare_and_set(key, current, updated, ttl):
+                return updated
+            self.cas_conflicts += 1
+
+    # --- pub/sub ---
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, handler: MessageHandler):
+        """Подписывает обработчик на сообщения канала"""
+        first = channel not in self._handlers
+        self._handlers.setdefault(channel, []).append(handler)
+        if first:
+            self._on_subscribe(channel)
+
+    def _on_subscribe(self, channel: str):
+        pass
+
+    def _dispatch(self, channel: str, message: Dict[str, Any]):
+        loop = asyncio.get_running_loop()
+        for handler in self._handlers.get(channel, ()):
+            task = loop.create_task(self._deliver(handler, channel, message))
+            self._delivery_tasks.add(task)
+            task.add_done_callback(self._delivery_tasks.discard)
+
+    async def _deliver(self, handler: MessageHandler, channel: str, message: Dict[str, Any]):
+        try:
+            await handler(message)
+            self.delivered += 1
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки сообщения канала {channel}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.name,
+            'shared': self.shared,
+            'channels': sorted(self._handlers),
+            'published': self.published,
+            'delivered': self.delivered,
+            'cas_conflicts': self.cas_conflicts
+        }
+
+
+class InMemoryStateBackend(StateBackend):
+    """Состояние в памяти процесса: прежнее поведение одной реплики"""
+
+    name = BACKEND_MEMORY
+    shared = False
+
+    def __init__(self):
+        super().__init__()
+        # Значения хранятся закодированными: читающий получает копию, как от Redis
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._next_sweep = 1024
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return _decode(self._read(key))
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        self._write(key, value, ttl)
+
+    async def delete(self, key: str) -> bool:
+        return self._values.pop(key, None) is not None
+
+    async def compare_and_set(self, key: str, expected: Optional[Dict[str, Any]],
+                              value: Optional[Dict[str, Any]], ttl: Optional[float] = None) -> bool:
+        # Без await между чтением и записью - атомарно в пределах event loop
+        if _decode(self._read(key)) != expected:
+            return False
+        if value is None:
+            self._values.pop(key, None)
+        else:
+            self._write(key, value, ttl)
+        return True
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        self._dispatch(channel, _decode(_encode(message)))
+
+    def _read(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        raw, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return raw
+
+    def _write(self, key: str, value: Dict[str, Any], ttl: Optional[float]):
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._values[key] = (_encode(value), expires_at)
+        if len(self._values) >= self._next_sweep:
+            now = time.monotonic()
+            self._values = {k: entry for k, entry in self._values.items()
+                            if entry[1] is None or entry[1] > now}
+            self._next_sweep = max(1024, 2 * len(self._values))
+
+
+class _RespConnection:
+    """Одно соединение по протоколу Redis (RESP2)"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int, password: Optional[str], db: int,
+                   timeout: float) -> '_RespConnection':
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        connection = cls(reader, writer)
+        if password:
+            await connection.call('AUTH', password)
+        if db:
+            await connection.call('SELECT', db)
+        return connection
+
+    def send(self, *args: Any):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self.writer.write(b''.join(parts))
+
+    async def call(self, *args: Any) -> Any:
+        self.send(*args)
+        await self.writer.drain()
+        reply = await self.read_reply()
+        if isinstance(reply, StateBackendError):
+            raise reply
+        return reply
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('Соединение с Redis закрыто')
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b'+':
+            return body.decode('utf-8')
+        if prefix == b'-':
+            # Ошибка внутри массива (EXEC) не должна сбивать чтение потока
+            return StateBackendError(body.decode('utf-8'))
+        if prefix == b':':
+            return int(body)
+        if prefix == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if prefix == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+        raise StateBackendError(f'Неизвестный ответ Redis: {line!r}')
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Состояние в Redis (или совместимом сервере)
+
+    - команды идут по одному соединению по очереди
+    - compare_and_set - WATCH/GET/MULTI/EXEC: если ключ изменили между
+      чтением и записью, EXEC не выполняется
+    - подписки держит отдельное соединение; при обрыве оно
+      переподключается и подписывается заново
+    """
+
+    name = BACKEND_REDIS
+    shared = True
+
+    def __init__(self, url: Optional[str] = None, prefix: Optional[str] = None,
+                 connect_timeout: float = 5.0):
+        super().__init__()
+        parsed = urlparse(url or config.REDIS_URL)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.prefix = config.STATE_KEY_PREFIX if prefix is None else prefix
+        self.connect_timeout = connect_timeout
+
+        self._connection: Optional[_RespConnection] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._subscriber: Optional[_RespConnection] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._lock = asyncio.Lock()
+        await self._command('PING')
+        self._listener = asyncio.create_task(self._listen())
+        logger.info(f"🗄️ Общее состояние: Redis {self.host}:{self.port}/{self.db}")
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        for connection in (self._connection, self._subscriber):
+            if connection is not None:
+                connection.close()
+        self._connection = None
+        self._subscriber = None
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return _decode(await self._command('GET', self.prefix + key))
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        await self._command(*self._set_args(key, value, ttl))
+
+    async def delete(self, key: str) -> bool:
+        return await self._command('DEL', self.prefix + key) > 0
+
+    async def compare_and_set(self, key: str, expected: Optional[Dict[str, Any]],
+                              value: Optional[Dict[str, Any]], ttl: Optional[float] = None) -> bool:
+        full_key = self.prefix + key
+        write = ('DEL', full_key) if value is None else self._set_args(key, value, ttl)
+
+        async def transaction(connection: _RespConnection) -> bool:
+            await connection.call('WATCH', full_key)
+            if _decode(await connection.call('GET', full_key)) != expected:
+                await connection.call('UNWATCH')
+                return False
+            await connection.call('MULTI')
+            await connection.call(*write)
+            # None - ключ изменили после WATCH, транзакция отменена
+            return await connection.call('EXEC') is not None
+
+        return await self._with_connection(transaction)
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        await self._command('PUBLISH', self.prefix + channel, _encode(message))
+
+    # --- внутреннее ---
+
+    def _set_args(self, key: str, value: Dict[str, Any], ttl: Optional[float]) -> tuple:
+        args = ('SET', self.prefix + key, _encode(value))
+        if ttl:
+            args += ('PX', max(1, int(ttl * 1000)))
+        return args
+
+    async def _command(self, *args: Any) -> Any:
+        return await self._with_connection(lambda connection: connection.call(*args))
+
+    async def _with_connection(self, operation: Callable[[_RespConnection], Awaitable[Any]]) -> Any:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                if self._connection is None:
+                    self._connection = await self._open()
+                return await operation(self._connection)
+            except StateBackendError:
+                # Ошибка посреди WATCH/MULTI: новое соединение начнет с чистого состояния
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+                raise
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+                raise StateBackendError(f'Redis недоступен: {e!r}') from e
+
+    async def _open(self) -> _RespConnection:
+        return await _RespConnection.open(self.host, self.port, self.password, self.db, self.connect_timeout)
+
+    def _on_subscribe(self, channel: str):
+        if self._subscriber is not None:
+            self._subscriber.send('SUBSCRIBE', self.prefix + channel)
+
+    async def _listen(self):
+        while True:
+            try:
+                self._subscriber = await self._open()
+                if self._handlers:
+                    self._subscriber.send('SUBSCRIBE', *(self.prefix + channel for channel in self._handlers))
+                while True:
+                    reply = await self._subscriber.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                        channel = reply[1].decode('utf-8')[len(self.prefix):]
+                        self._dispatch(channel, _decode(reply[2]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Подписка Redis прервана ({e!r}), переподключение через 1 сек")
+                if self._subscriber is not None:
+                    self._subscriber.close()
+                    self._subscriber = None
+                await asyncio.sleep(1)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    Состояние в общем файле SQLite (реплики на одном хосте или томе)
+
+    - compare_and_set выполняется в транзакции BEGIN IMMEDIATE: пока одна
+      реплика читает и пишет, другие ждут (busy_timeout)
+    - сообщения pub/sub - строки таблицы events; каждая реплика раз
+      в poll_interval читает новые строки своих каналов
+    - истекшие значения и события старше event_retention удаляются фоновой задачей
+    """
+
+    name = BACKEND_SQLITE
+    shared = True
+
+    def __init__(self, path: Optional[str] = None, poll_interval: Optional[float] = None,
+                 event_retention: float = 60.0):
+        super().__init__()
+        self.path = path or config.STATE_SQLITE_PATH
+        self.poll_interval = poll_interval or config.STATE_POLL_INTERVAL
+        self.event_retention = event_retention
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._last_event_id = 0
+
+    async def start(self):
+        self._lock = asyncio.Lock()
+        await asyncio.to_thread(self._open)
+        self._last_event_id = await self._run(self._max_event_id)
+        self._poller = asyncio.create_task(self._poll_loop())
+        logger.info(f"🗄️ Общее состояние: SQLite {self.path}")
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return _decode(await self._run(self._read, key))
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None):
+        await self._run(self._write, key, _encode(value), ttl)
+
+    async def delete(self, key: str) -> bool:
+        return await self._run(self._delete, key)
+
+    async def compare_and_set(self, key: str, expected: Optional[Dict[str, Any]],
+                              value: Optional[Dict[str, Any]], ttl: Optional[float] = None) -> bool:
+        encoded = None if value is None else _encode(value)
+        return await self._run(self._compare_and_set, key, expected, encoded, ttl)
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        self.published += 1
+        await self._run(self._insert_event, channel, _encode(message))
+
+    # --- внутреннее (выполняется в потоке) ---
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        if self._conn is None:
+            raise StateBackendError('SQLite хранилище не запущено')
+        async with self._lock:
+            try:
+                return await asyncio.to_thread(func, *args)
+            except sqlite3.Error as e:
+                raise StateBackendError(f'Ошибка SQLite: {e}') from e
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SQLITE_SCHEMA)
+
+    def _read(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, key: str, encoded: str, ttl: Optional[float]):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, encoded, time.time() + ttl if ttl else None)
+        )
+
+    def _delete(self, key: str) -> bool:
+        return self._conn.execute("DELETE FROM state WHERE key = ?", (key,)).rowcount > 0
+
+    def _compare_and_set(self, key: str, expected: Optional[Dict[str, Any]],
+                         encoded: Optional[str], ttl: Optional[float]) -> bool:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _decode(self._read(key)) != expected:
+                self._conn.execute("ROLLBACK")
+                return False
+            if encoded is None:
+                self._delete(key)
+            else:
+                self._write(key, encoded, ttl)
+            self._conn.execute("COMMIT")
+            return True
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _insert_event(self, channel: str, encoded: str):
+        self._conn.execute(
+            "INSERT INTO events (channel, message, created_at) VALUES (?, ?, ?)",
+            (channel, encoded, time.time())
+        )
+
+    def _max_event_id(self) -> int:
+        return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def _read_events(self, after_id: int) -> List[Tuple[int, str, str]]:
+        return self._conn.execute(
+            "SELECT id, channel, message FROM events WHERE id > ? ORDER BY id", (after_id,)
+        ).fetchall()
+
+    def _cleanup(self):
+        now = time.time()
+        self._conn.execute("DELETE FROM events WHERE created_at < ?", (now - self.event_retention,))
+        self._conn.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    async def _poll_loop(self):
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                for event_id, channel, message in await self._run(self._read_events, self._last_event_id):
+                    self._last_event_id = event_id
+                    if channel in self._handlers:
+                        self._dispatch(channel, _decode(message))
+                if time.monotonic() - last_cleanup >= self.event_retention:
+                    last_cleanup = time.monotonic()
+                    await self._run(self._cleanup)
+            except StateBackendError as e:
+                logger.error(f"❌ Ошибка чтения событий SQLite: {e}")
+
+
+def create_state_backend(kind: Optional[str] = None) -> StateBackend:
+    """Создает хранилище состояния по STATE_BACKEND"""
+    kind = (kind or config.STATE_BACKEND).lower()
+    if kind == BACKEND_REDIS:
+        return RedisStateBackend()
+    if kind == BACKEND_SQLITE:
+        return SqliteStateBackend()
+    if kind != BACKEND_MEMORY:
+        logger.error(f"❌ Неизвестный STATE_BACKEND={kind}, используется состояние в памяти")
+    return InMemoryStateBackend()
+
+
+_shared_backend: Optional[StateBackend] = None
+
+
+def get_state_backend() -> StateBackend:
+    """Возвращает общее для процесса хранилище состояния"""
+    global _shared_backend
+    if _shared_backend is None:
+        _shared_backend = create_state_backend()
+    return _shared_backend
@@ -0,0 +1,172 @@
+"""Глобальный лимит одновременных запросов к каждой системе с честной очередью пользователей"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class _TargetQueue:
+    """Состояние одной системы: активные запросы и очереди пользователей"""
+
+    __slots__ = ('limit', 'active', 'queues', 'granted', 'queued_total', 'max_depth')
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # Порядок ключей - порядок обхода round-robin
+        self.queues: 'OrderedDict[Any, Deque[asyncio.Future]]' = OrderedDict()
+        self.granted = 0
+        self.queued_total = 0
+        self.max_depth = 0
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def position(self, user_key: Any, waiter: asyncio.Future) -> int:
+        """Позиция ожидания (1 - следующий) с учетом обхода round-robin"""
+        queue = self.queues.get(user_key)
+        if not queue or waiter not in queue:
+            return 0
+        k = queue.index(waiter)
+
+        ahead = 0
+        passed_own = False
+        for key, other in self.queues.items():
+            if key == user_key:
+                passed_own = True
+            # Полные круги до k-го, плюс пользователи раньше в текущем круге
+            ahead += min(len(other), k)
+            if not passed_own and len(other) > k:
+                ahead += 1
+        return ahead + 1
+
+
+class TargetConcurrencyScheduler:
+    """
+    Ограничивает число одновременных запросов к каждой системе
+
+    Когда лимит системы исчерпан, запросы встают в очередь своего пользователя,
+    а освободившийся слот достается пользователям по кругу (round-robin):
+    один пользователь с девятью шагами не вытеснит остальных.
+    """
+
+    def __init__(self, default_limit: Optional[int] = None, limits: Optional[Dict[str, int]] = None):
+        self.default_limit = default_limit or config.WEBHOOK_TARGET_CONCURRENCY
+        self.limits = dict(config.WEBHOOK_TARGET_LIMITS if limits is None else limits)
+        self._targets: Dict[str, _TargetQueue] = {}
+
+    @asynccontextmanager
+    async def slot(self, target: str, user_key: Any,
+                   on_queued: Optional[Callable[[int], Awaitable[None]]] = None):
+        """Удерживает слот системы на время запроса"""
+        await self.acquire(target, user_key, on_queued)
+        try:
+            yield
+        finally:
+            self.release(target)
+
+    async def acquire(self, target: str, user_key: Any,
+                      on_queued: Optional[Callable[[int], Awaitable[None]]] = None):
+        """Занимает слот системы; если мест нет - ждет своей очереди"""
+        state = self._get_target(target)
+        if state.active < state.limit and not state.queues:
+            state.active += 1
+            state.granted += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        state.queues.setdefault(user_key, deque()).append(waiter)
+        state.queued_total += 1
+        state.max_depth = max(state.max_depth, state.depth())
+
+        try:
+            if on_queued is not None:
+                try:
+                    await on_queued(state.position(user_key, waiter))
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось сообщить позицию в очереди {target}: {e}")
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже выдан - возвращаем его следующему
+                self.release(target)
+            else:
+                self._remove_waiter(state, user_key, waiter)
+            raise
+
+    def release(self, target: str):
+        """Освобождает слот и передает его следующему пользователю по кругу"""
+        state = self._targets[target]
+        state.active -= 1
+        self._grant_next(state)
+
+    def get_queue_position(self, target: str, user_key: Any) -> int:
+        """Позиция первого ожидающего запроса пользователя (0 - не в очереди)"""
+        state = self._targets.get(target)
+        if not state or not state.queues.get(user_key):
+            return 0
+        return state.position(user_key, state.queues[user_key][0])
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Метрики по системам: лимит, активные, глубина очереди"""
+        return {
+            target: {
+                'limit': state.limit,
+                'active': state.active,
+                'queued': state.depth(),
+                'queued_users': len(state.queues),
+                'granted_total': state.granted,
+                'queued_total': state.queued_total,
+                'max_queue_depth': state.max_depth
+            }
+            for target, state in self._targets.items()
+        }
+
+    def _get_target(self, target: str) -> _TargetQueue:
+        state = self._targets.get(target)
+        if state is None:
+            state = _TargetQueue(self.limits.get(target, self.default_limit))
+            self._targets[target] = state
+        return state
+
+    def _grant_next(self, state: _TargetQueue):
+        while state.active < state.limit and state.queues:
+            user_key, queue = next(iter(state.queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                state.queues.move_to_end(user_key)
+            else:
+                del state.queues[user_key]
+
+            if waiter.done():
+                continue
+            state.active += 1
+            state.granted += 1
+            waiter.set_result(None)
+
+    @staticmethod
+    def _remove_waiter(state: _TargetQueue, user_key: Any, waiter: asyncio.Future):
+        queue = state.queues.get(user_key)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del state.queues[user_key]
+
+
+_shared_scheduler: Optional[TargetConcurrencyScheduler] = None
+
+
+def get_target_scheduler() -> TargetConcurrencyScheduler:
+    """Возвращает общий для процесса планировщик систем"""
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        _shared_scheduler = TargetConcurrencyScheduler()
+    return _shared_scheduler
@@ -0,0 +1,282 @@
+"""Планировщик исходящих запросов к Telegram Bot API: глобальный и по-чатовые лимиты"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+import config
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета (меньше - важнее)
+PRIORITY_INTERACTIVE = 0   # Ответы на действия пользователя
+PRIORITY_NOTIFICATION = 1  # Готовая таблица, итоги анализа
+PRIORITY_PROGRESS = 2      # Обновления прогресса
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_NOTIFICATION: 'notification',
+    PRIORITY_PROGRESS: 'progress'
+}
+
+# Методы, которые по умолчанию считаются обновлением прогресса
+_PROGRESS_ENDPOINTS = frozenset({'editMessageText', 'editMessageReplyMarkup', 'sendChatAction'})
+
+
+class TelegramQueueFull(Exception):
+    """Очередь исходящих запросов своего приоритета переполнена"""
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - сейчас)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class _PriorityQueue:
+    """Очередь одного приоритета: ожидающие запросы по чатам, обход по кругу"""
+
+    __slots__ = ('chats', 'size', 'max_size', 'max_depth', 'granted', 'rejected', 'wait_total')
+
+    def __init__(self, max_size: int):
+        self.chats: 'OrderedDict[Any, Deque[asyncio.Future]]' = OrderedDict()
+        self.size = 0
+        self.max_size = max_size
+        self.max_depth = 0
+        self.granted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+
+
+class TelegramRateLimiter(BaseRateLimiter[Union[int, Dict[str, Any]]]):
+    """
+    Проактивное соблюдение лимитов Telegram для всех запросов бота
+
+    Подключается через ApplicationBuilder().rate_limiter(...), поэтому через него
+    проходят все send_message, reply_text, edit_message_text и т.д.
+
+    - глобальная корзина: global_rate запросов в секунду на бота
+    - корзина чата: chat_rate в секунду для личных чатов,
+      group_rate_per_minute в минуту для групп (chat_id < 0)
+    - запросы ждут в очередях по приоритету; освободившийся токен достается
+      самому важному запросу, чей чат не исчерпал лимит, а внутри приоритета -
+      чатам по кругу
+    - очереди ограничены queue_max запросами каждая; переполнение -
+      TelegramQueueFull
+    - RetryAfter приостанавливает все отправки на указанное время, запрос
+      повторяется не больше max_retries раз
+    """
+
+    def __init__(self, global_rate: Optional[float] = None, chat_rate: Optional[float] = None,
+                 chat_burst: Optional[int] = None, group_rate_per_minute: Optional[float] = None,
+                 queue_max: Optional[int] = None, max_retries: Optional[int] = None):
+        self.global_rate = global_rate or config.TELEGRAM_GLOBAL_RATE
+        self.chat_rate = chat_rate or config.TELEGRAM_CHAT_RATE
+        self.chat_burst = chat_burst or config.TELEGRAM_CHAT_BURST
+        self.group_rate = (group_rate_per_minute or config.TELEGRAM_GROUP_RATE_PER_MINUTE) / 60.0
+        self.queue_max = queue_max or config.TELEGRAM_QUEUE_MAX
+        self.max_retries = config.TELEGRAM_MAX_RETRY_AFTER if max_retries is None else max_retries
+
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._queues: List[_PriorityQueue] = [_PriorityQueue(self.queue_max) for _ in PRIORITY_NAMES]
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.retry_after_total = 0
+
+    # --- BaseRateLimiter ---
+
+    async def initialize(self) -> None:
+        self._ensure_dispatcher()
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        # Ожидающие запросы больше не будут выполнены
+        for queue in self._queues:
+            for waiters in queue.chats.values():
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.cancel()
+            queue.chats.clear()
+            queue.size = 0
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Union[int, Dict[str, Any]]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        priority = self._priority(endpoint, rate_limit_args)
+        chat_id = data.get('chat_id')
+
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_total += 1
+                self._pause(float(e.retry_after))
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"⏳ Telegram RetryAfter {e.retry_after} сек для {endpoint} "
+                               f"(повтор {attempt + 1}/{self.max_retries})")
+
+    # --- очередь ---
+
+    async def acquire(self, chat_id: Any, priority: int = PRIORITY_INTERACTIVE):
+        """Ждет разрешения на запрос в чат chat_id"""
+        self._ensure_dispatcher()
+        queue = self._queues[priority]
+        if queue.size >= queue.max_size:
+            queue.rejected += 1
+            raise TelegramQueueFull(f"Очередь Telegram ({PRIORITY_NAMES[priority]}) переполнена: {queue.size}")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.chats.setdefault(chat_id, deque()).append(waiter)
+        queue.size += 1
+        queue.max_depth = max(queue.max_depth, queue.size)
+        self._wakeup.set()
+
+        enqueued = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if not waiter.done():
+                waiter.cancel()
+            raise
+        queue.wait_total += time.monotonic() - enqueued
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'queues': {
+                PRIORITY_NAMES[priority]: {
+                    'depth': queue.size,
+                    'max_depth': queue.max_depth,
+                    'granted': queue.granted,
+                    'rejected': queue.rejected,
+                    'avg_wait_ms': round(queue.wait_total / queue.granted * 1000, 1) if queue.granted else 0.0
+                }
+                for priority, queue in enumerate(self._queues)
+            },
+            'tracked_chats': len(self._chats),
+            'retry_after_total': self.retry_after_total,
+            'paused_for_seconds': round(max(0.0, self._paused_until - time.monotonic()), 1)
+        }
+
+    # --- внутреннее ---
+
+    def _priority(self, endpoint: str, rate_limit_args: Optional[Union[int, Dict[str, Any]]]) -> int:
+        if isinstance(rate_limit_args, dict):
+            rate_limit_args = rate_limit_args.get('priority')
+        if isinstance(rate_limit_args, int) and rate_limit_args in PRIORITY_NAMES:
+            return rate_limit_args
+        return PRIORITY_PROGRESS if endpoint in _PROGRESS_ENDPOINTS else PRIORITY_INTERACTIVE
+
+    def _pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch_loop())
+
+    def _chat_bucket(self, chat_id: Any) -> Optional[TokenBucket]:
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def _dispatch_loop(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            if not any(queue.size for queue in self._queues):
+                self._wakeup.clear()
+                self._prune_chats(now)
+                await self._wakeup.wait()
+                continue
+
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            chat_wait = self._grant_next(now)
+            if chat_wait is not None:
+                # Все ожидающие чаты исчерпали лимит - ждем ближайший или новый запрос
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=chat_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _grant_next(self, now: float) -> Optional[float]:
+        """Выдает разрешение одному запросу; если некому - время до ближайшего"""
+        min_wait = None
+        for queue in self._queues:
+            for chat_id in list(queue.chats):
+                bucket = self._chat_bucket(chat_id)
+                wait = bucket.wait_time(now) if bucket is not None else 0.0
+                if wait > 0:
+                    min_wait = wait if min_wait is None else min(min_wait, wait)
+                    continue
+
+                waiters = queue.chats[chat_id]
+                waiter = waiters.popleft()
+                queue.size -= 1
+                if waiters:
+                    queue.chats.move_to_end(chat_id)
+                else:
+                    del queue.chats[chat_id]
+                if waiter.done():  # Отменен, пока ждал
+                    return None
+
+                if bucket is not None:
+                    bucket.take()
+                self._global.take()
+                queue.granted += 1
+                waiter.set_result(None)
+                return None
+        return min_wait
+
+    def _prune_chats(self, now: float):
+        """Забывает чаты с полной корзиной: их состояние совпадает с новым"""
+        if len(self._chats) > 10000:
+            self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.is_full(now)}
@@ -0,0 +1,129 @@
+"""Получение обновлений Telegram через webhook на порту webhook сервера бота"""
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Any, Dict, List, Optional
+from telegram import Update
+from telegram.ext import Application
+import config
+
+logger = logging.getLogger(__name__)
+
+# Режимы TELEGRAM_MODE
+MODE_POLLING = 'polling'
+MODE_WEBHOOK = 'webhook'
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class TelegramUpdateIngress:
+    """
+    Прием обновлений Telegram, пришедших HTTP запросом
+
+    - запрос без правильного секрета (заголовок X-Telegram-Bot-Api-Secret-Token)
+      отклоняется; если секрет не настроен, отклоняется любой запрос -
+      иначе кто угодно мог бы прислать обновление от имени любого пользователя
+    - тело - одно обновление или массив обновлений (например, от
+      промежуточного сервиса); массив попадает в очередь Application целиком,
+      без ожидания между элементами
+    - обработка идет в Application как при polling: HTTP ответ отдается,
+      как только обновления поставлены в очередь
+    """
+
+    def __init__(self, application: Application, secret_token: Optional[str] = None):
+        self.application = application
+        self.secret_token = secret_token if secret_token is not None else config.TELEGRAM_WEBHOOK_SECRET
+
+        self.updates_received = 0
+        self.batches_received = 0
+        self.max_batch = 0
+        self.rejected_requests = 0
+        self.invalid_updates = 0
+
+    def verify(self, headers) -> bool:
+        """Проверяет секрет запроса (без секрета в конфигурации запросы не принимаются)"""
+        received = headers.get(SECRET_HEADER, '')
+        if self.secret_token and hmac.compare_digest(received.encode(), self.secret_token.encode()):
+            return True
+        self.rejected_requests += 1
+        return False
+
+    async def feed(self, payload: Any) -> int:
+        """Ставит обновления из тела запроса в очередь Application, возвращает их число"""
+        items: List[Dict[str, Any]] = payload if isinstance(payload, list) else [payload]
+        updates = []
+        for item in items:
+            try:
+                update = Update.de_json(item, self.application.bot)
+            except Exception as e:
+                update = None
+                logger.warning(f"⚠️ Некорректное обновление Telegram: {e}")
+            if update is None:
+                self.invalid_updates += 1
+                continue
+            updates.append(update)
+
+        queue = self.application.update_queue
+        for update in updates:
+            queue.put_nowait(update)
+
+        self.updates_received += len(updates)
+        self.batches_received += 1
+        self.max_batch = max(self.max_batch, len(updates))
+        return len(updates)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'updates_received': self.updates_received,
+            'batches_received': self.batches_received,
+            'max_batch': self.max_batch,
+            'rejected_requests': self.rejected_requests,
+            'invalid_updates': self.invalid_updates,
+            'queue_size': self.application.update_queue.qsize()
+        }
+
+
+def webhook_url() -> str:
+    """Адрес, который регистрируется в Telegram"""
+    base = (config.TELEGRAM_WEBHOOK_URL or '').rstrip('/')
+    path = config.TELEGRAM_WEBHOOK_PATH
+    return base if base.endswith(path) else f"{base}{path}"
+
+
+async def run_webhook_mode(application: Application, bot) -> None:
+    """
+    Запускает бота в режиме webhook
+
+    Отдельного сервера не поднимается: обновления принимает webhook сервер
+    бота (тот же порт, что и для N8N). Хуки post_init/post_shutdown
+    вызываются здесь, как это делает run_polling.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остановка по Ctrl+C через KeyboardInterrupt
+
+    async with application:
+        bot.telegram_ingress = TelegramUpdateIngress(application)
+        await bot.post_init(application)
+        await application.start()
+
+        url = webhook_url()
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=config.TELEGRAM_WEBHOOK_SECRET,
+            max_connections=config.TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True  # Пропускаем старые обновления при запуске
+        )
+        logger.info(f"🪝 Обновления Telegram принимаются через webhook: {url}")
+
+        try:
+            await stop_event.wait()
+        finally:
+            await application.stop()
+            await bot.post_shutdown(application)
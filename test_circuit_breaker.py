@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Тест выключателей систем: при сбое системы шаги завершаются сразу,
+а после паузы пробный запрос закрывает выключатель
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from circuit_breaker import CircuitBreakerRegistry, CLOSED, OPEN, HALF_OPEN
+from retry_policy import RetryPolicy
+from sequential_webhook_service import SequentialWebhookService
+from http_client_pool import close_http_client
+
+
+def test_state_transitions():
+    """closed -> open -> half_open -> open (удвоенная пауза) -> closed"""
+    registry = CircuitBreakerRegistry(failure_threshold=2, open_seconds=0.05,
+                                      open_max_seconds=1, half_open_probes=1)
+    breaker = registry.get('webhook_1')
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.is_open() and not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert not breaker.is_open()
+    assert breaker.allow_request()          # Пробный запрос
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()      # Второй пробный не пропускается
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.open_for == 0.1
+
+    time.sleep(0.11)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+
+    stats = registry.get_stats()['webhook_1']
+    print(f"Статистика: {stats}")
+    assert stats['opened_total'] == 2
+    assert stats['rejected_total'] == 2
+    assert registry.get_open_targets() == {}
+
+
+def test_abandoned_probe_frees_slot():
+    """Отмененный пробный запрос не блокирует следующие пробы"""
+    registry = CircuitBreakerRegistry(failure_threshold=1, open_seconds=0.01, half_open_probes=1)
+    breaker = registry.get('webhook_1')
+    breaker.record_failure()
+    time.sleep(0.02)
+
+    assert breaker.allow_request()
+    breaker.record_abandoned()
+    assert breaker.allow_request()
+
+
+async def start_failing_system():
+    """Локальная система, отвечающая 500"""
+    received = []
+
+    async def handler(request):
+        received.append(await request.json())
+        return web.json_response({'error': 'down'}, status=500)
+
+    app = web.Application()
+    app.router.add_post('/hook', handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/hook', received
+
+
+def test_open_circuit_fails_fast_without_sending():
+    """После открытия выключателя запросы в систему не отправляются"""
+
+    async def run():
+        runner, url, received = await start_failing_system()
+        service = SequentialWebhookService()
+        service.circuit_breakers = CircuitBreakerRegistry(failure_threshold=2, open_seconds=60)
+        service.retry_policy = RetryPolicy(max_attempts=1)
+        service.webhooks = {'webhook_1': url}
+        service.dependencies = {'webhook_1': []}
+        service.step_pause_seconds = 0
+        messages = []
+
+        async def progress(text):
+            messages.append(text)
+
+        try:
+            for user_id in (1, 2):
+                results = await service.send_webhooks_sequentially(user_id, {}, {}, progress)
+                assert results == {'webhook_1': False}
+            assert len(received) == 2
+
+            started = time.perf_counter()
+            results = await service.send_webhooks_sequentially(3, {}, {}, progress)
+            elapsed = time.perf_counter() - started
+            print(f"Отказ при открытом выключателе: {elapsed * 1000:.1f} мс")
+
+            assert results == {'webhook_1': False}
+            assert len(received) == 2
+            assert elapsed < 0.5
+            assert any('недоступна' in text for text in messages)
+        finally:
+            await close_http_client()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_state_transitions()
+    test_abandoned_probe_frees_slot()
+    test_open_circuit_fails_fast_without_sending()
+    print("✅ Все тесты пройдены")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Тест центрального планировщика дедлайнов
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from deadline_scheduler import DeadlineScheduler
+from sequential_webhook_service import SequentialWebhookService, WebhookCompletionRegistry
+
+
+def test_deadlines_fire_in_order_and_cancel():
+    """Дедлайны срабатывают по порядку, отмененные не срабатывают"""
+
+    async def run():
+        scheduler = DeadlineScheduler()
+        fired = []
+
+        scheduler.schedule(0.03, fired.append, 'c')
+        scheduler.schedule(0.01, fired.append, 'a')
+        cancelled = scheduler.schedule(0.02, fired.append, 'b')
+        assert scheduler.get_pending_count() == 3
+
+        assert cancelled.cancel()
+        assert scheduler.get_pending_count() == 2
+
+        await asyncio.sleep(0.06)
+        stats = scheduler.get_stats()
+        print(f"Статистика: {stats}")
+
+        assert fired == ['a', 'c']
+        assert stats['pending'] == 0
+        assert stats['fired'] == 2
+        assert stats['cancelled'] == 1
+        assert stats['lateness_max_ms'] >= 0
+
+    asyncio.run(run())
+
+
+def test_many_deadlines_use_single_timer():
+    """Тысячи дедлайнов не создают задач; отмена сразу уменьшает счетчик"""
+
+    async def run():
+        scheduler = DeadlineScheduler()
+        tasks_before = len(asyncio.all_tasks())
+        deadlines = [scheduler.schedule(300, lambda: None) for _ in range(5000)]
+
+        assert len(asyncio.all_tasks()) == tasks_before
+        assert scheduler.get_pending_count() == 5000
+
+        for deadline in deadlines:
+            deadline.cancel()
+        assert scheduler.get_pending_count() == 0
+
+    asyncio.run(run())
+
+
+def test_webhook_wait_times_out_and_cancels_on_response():
+    """Ожидание 'ready' завершается таймаутом, а ранний ответ снимает дедлайн"""
+
+    async def run():
+        service = SequentialWebhookService()
+        service.deadline_scheduler = DeadlineScheduler()
+        service.pending_webhooks[1] = {'webhook_responses': {}}
+
+        waiter = service.completion_registry.register(1, 'webhook_1')
+        assert await service._wait_for_webhook_response('webhook_1', 1, waiter, timeout_seconds=0.01) is False
+        service.completion_registry.discard(1, 'webhook_1', waiter)
+
+        waiter = service.completion_registry.register(1, 'webhook_2')
+        asyncio.get_running_loop().call_later(0.01, service.handle_webhook_response,
+                                              {'webhook_id': 'webhook_2', 'user_id': '1', 'status': 'ready'})
+        assert await service._wait_for_webhook_response('webhook_2', 1, waiter, timeout_seconds=60) is True
+        service.completion_registry.discard(1, 'webhook_2', waiter)
+
+        assert service.deadline_scheduler.get_pending_count() == 0
+        assert service.get_waiters_count() == 0
+
+    asyncio.run(run())
+
+
+def test_late_discard_keeps_newer_waiter():
+    """discard от прежней попытки не снимает ожидание, зарегистрированное заново"""
+
+    async def run():
+        registry = WebhookCompletionRegistry()
+        old = registry.register(1, 'webhook_1')
+        new = registry.register(1, 'webhook_1')
+        registry.discard(1, 'webhook_1', old)
+        assert old.cancelled() and not new.done()
+        assert registry.get_waiters_count() == 1
+
+        assert registry.resolve(1, 'webhook_1', {'status': 'ready'}) is True
+        assert (await new) == {'status': 'ready'}
+        registry.discard(1, 'webhook_1', new)
+        assert registry.get_waiters_count() == 0
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_deadlines_fire_in_order_and_cancel()
+    test_many_deadlines_use_single_timer()
+    test_webhook_wait_times_out_and_cancels_on_response()
+    test_late_discard_keeps_newer_waiter()
+    print("🎉 Все тесты пройдены успешно!")
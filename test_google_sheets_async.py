@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Тест асинхронного клиента Google Sheets на локальной заглушке Sheets API:
+кэш и фоновое обновление токена, ограничение параллельности, повтор после
+401 и синхронная обертка GoogleMinimalService
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+
+from google_minimal_service import GoogleMinimalService
+from google_sheets_async import AsyncSheetsClient, SheetsApiError
+
+
+class FakeCredentials:
+    """Учетные данные в духе google-auth: token, expiry (наивное UTC) и refresh()"""
+
+    def __init__(self, lifetime=3600.0):
+        self.lifetime = lifetime
+        self.token = None
+        self.expiry = None
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.expiry = now + timedelta(seconds=self.lifetime)
+
+
+class FakeSheetsApi:
+    """Заглушка Sheets API: create, values.update, values.append и batchUpdate"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.valid_tokens = None   # None - принимается любой токен
+        self.reject_grid_data = False  # Отклонять create с данными листов (400)
+        self.fail_appends = 0          # Столько следующих values.append ответят append_status
+        self.append_status = 503
+        self.appended = []             # Пакеты values.append по порядку
+        self.spreadsheets = {}
+        self.created = 0
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v4/spreadsheets', self.create)
+        app.router.add_put('/v4/spreadsheets/{id}/values/{range}', self.update_values)
+        app.router.add_post('/v4/spreadsheets/{id}/values/{range}:append', self.append_values)
+        app.router.add_post('/v4/spreadsheets/{id}:batchUpdate', self.batch_update)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _enter(self, request, name):
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if self.valid_tokens is not None and token not in self.valid_tokens:
+            return web.json_response({'error': {'code': 401, 'message': 'Invalid Credentials'}}, status=401)
+        self.calls.append(name)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return None
+
+    async def create(self, request):
+        denied = await self._enter(request, 'create')
+        if denied is not None:
+            return denied
+        body = await request.json()
+        if self.reject_grid_data and 'sheets' in body:
+            return web.json_response({'error': {'code': 400, 'message': 'Invalid sheets[0].data'}}, status=400)
+        self.created += 1
+        spreadsheet_id = f'sheet-{self.created}'
+        sheets = body.get('sheets') or [{'properties': {'sheetId': 0, 'title': 'Лист1'}}]
+        self.spreadsheets[spreadsheet_id] = {
+            'properties': body.get('properties', {}), 'sheets': sheets, 'values': {}, 'requests': []
+        }
+        response = {'spreadsheetId': spreadsheet_id, 'properties': body.get('properties', {}), 'sheets': sheets}
+        if request.query.get('fields'):
+            # Маска ответа: только id таблицы и листов
+            response = {'spreadsheetId': spreadsheet_id,
+                        'sheets': [{'properties': {'sheetId': sheet['properties']['sheetId']}} for sheet in sheets]}
+        return web.json_response(response)
+
+    async def update_values(self, request):
+        denied = await self._enter(request, 'values.update')
+        if denied is not None:
+            return denied
+        spreadsheet = self.spreadsheets.get(request.match_info['id'])
+        if spreadsheet is None:
+            return web.json_response({'error': {'code': 404, 'message': 'Requested entity was not found.'}},
+                                     status=404)
+        assert request.query['valueInputOption'] == 'RAW'
+        spreadsheet['values'][request.match_info['range']] = (await request.json())['values']
+        return web.json_response({'updatedRange': request.match_info['range']})
+
+    async def append_values(self, request):
+        denied = await self._enter(request, 'values.append')
+        if denied is not None:
+            return denied
+        if self.fail_appends:
+            self.fail_appends -= 1
+            return web.json_response({'error': {'code': self.append_status, 'message': 'Append failed.'}},
+                                     status=self.append_status)
+        assert request.query['insertDataOption'] == 'INSERT_ROWS'
+        self.appended.append((await request.json())['values'])
+        return web.json_response({'spreadsheetId': request.match_info['id'],
+                                  'updates': {'updatedRows': len(self.appended[-1])}})
+
+    async def batch_update(self, request):
+        denied = await self._enter(request, 'batchUpdate')
+        if denied is not None:
+            return denied
+        spreadsheet = self.spreadsheets.get(request.match_info['id'])
+        if spreadsheet is None:
+            return web.json_response({'error': {'code': 404, 'message': 'Requested entity was not found.'}},
+                                     status=404)
+        body = await request.json()
+        spreadsheet['requests'].extend(body['requests'])
+        return web.json_response({'spreadsheetId': request.match_info['id'],
+                                  'replies': [{} for _ in body['requests']]})
+
+
+USER_DATA = {
+    'profession': 'Психолог',
+    'segmentation': 'Сегменты',
+    'ideal_client': 'Клиент'
+}
+
+
+def test_token_cached_and_concurrency_bounded():
+    """Один токен на все запросы, не больше max_concurrency запросов одновременно"""
+
+    async def run():
+        api = FakeSheetsApi(delay=0.02)
+        await api.start()
+        credentials = FakeCredentials()
+        client = AsyncSheetsClient(credentials, base_url=api.url, max_concurrency=4)
+        try:
+            results = await asyncio.gather(*(
+                client.create_spreadsheet({'properties': {'title': f'T{i}'}}) for i in range(20)
+            ))
+            assert len({result['spreadsheetId'] for result in results}) == 20
+            assert credentials.refreshes == 1
+            assert api.max_in_flight == 4
+            stats = client.get_stats()
+            assert stats['requests'] == 20 and stats['max_in_flight'] == 4
+
+            try:
+                await client.update_values('missing', 'A1', [['x']])
+                assert False, 'ожидалась SheetsApiError'
+            except SheetsApiError as error:
+                assert error.status == 404
+                assert 'not found' in error.message
+        finally:
+            await client.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Токен кэшируется, параллельность ограничена")
+
+
+def test_token_refreshed_in_background():
+    """Токен обновляется до истечения без участия запросов, 401 приводит к обновлению и повтору"""
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        credentials = FakeCredentials(lifetime=0.4)
+        client = AsyncSheetsClient(credentials, base_url=api.url, refresh_margin=0.2)
+        try:
+            await client.create_spreadsheet({'properties': {'title': 'A'}})
+            assert credentials.refreshes == 1
+            await asyncio.sleep(0.5)
+            # Фоновая задача успела обновить токен, запрос его не ждет
+            assert credentials.refreshes >= 2
+            assert client._token_valid(0)
+
+            # Сервер отозвал текущий токен: клиент получает новый и повторяет запрос
+            credentials.lifetime = 3600
+            api.valid_tokens = {f'token-{credentials.refreshes + 1}'}
+            await client.create_spreadsheet({'properties': {'title': 'B'}})
+            assert api.calls == ['create', 'create']
+        finally:
+            await client.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Токен обновляется в фоне и после 401")
+
+
+def cell_text(row):
+    return [cell['userEnteredValue']['stringValue'] for cell in row['values']]
+
+
+def test_spreadsheet_created_in_one_request():
+    """Данные, оформление и свойства листа уходят в create; при отказе - один batchUpdate"""
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        service = GoogleMinimalService(credentials=FakeCredentials(), base_url=api.url)
+        try:
+            spreadsheet_id, _ = await service.create_spreadsheet_async(USER_DATA)
+            assert api.calls == ['create']
+            sheet = api.spreadsheets[spreadsheet_id]['sheets'][0]
+            assert sheet['properties']['gridProperties']['frozenRowCount'] == 1
+            rows = sheet['data'][0]['rowData']
+            assert cell_text(rows[0]) == ['🎯 АНАЛИЗ ЦЕЛЕВОЙ АУДИТОРИИ']
+            assert cell_text(rows[2]) == ['Профессия эксперта:', 'Психолог']
+            assert rows[0]['values'][0]['userEnteredFormat']['textFormat']['bold'] is True
+
+            # Сервер не принимает данные в create: пустая таблица + один batchUpdate
+            api.calls.clear()
+            api.reject_grid_data = True
+            spreadsheet_id, _ = await service.create_spreadsheet_async(USER_DATA)
+            assert api.calls == ['create', 'create', 'batchUpdate']
+            requests = api.spreadsheets[spreadsheet_id]['requests']
+            update_cells = next(item['updateCells'] for item in requests if 'updateCells' in item)
+            assert update_cells['start']['sheetId'] == 0
+            assert cell_text(update_cells['rows'][4]) == ['Идеальный клиент:', 'Клиент']
+            assert any('updateSheetProperties' in item for item in requests)
+
+            # Отказ запоминается: следующая таблица - сразу два запроса
+            api.calls.clear()
+            await service.create_spreadsheet_async(USER_DATA)
+            assert api.calls == ['create', 'batchUpdate']
+        finally:
+            await service.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Таблица создается одним запросом")
+
+
+def test_sync_wrapper_keeps_api():
+    """Синхронный create_spreadsheet возвращает (id, название) и работает внутри event loop"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    api = FakeSheetsApi()
+    asyncio.run_coroutine_threadsafe(api.start(), loop).result()
+
+    service = GoogleMinimalService(credentials=FakeCredentials(), base_url=api.url)
+    try:
+        spreadsheet_id, sheet_title = service.create_spreadsheet(USER_DATA)
+        assert spreadsheet_id == 'sheet-1'
+        assert sheet_title.endswith('– Психолог')
+        service._add_data_simple(spreadsheet_id, USER_DATA, '01.01.2026')
+        values = api.spreadsheets['sheet-1']['values']['A1']
+        assert values[2] == ['Профессия эксперта:', 'Психолог']
+
+        # Вызов из корутины (как раньше из обработчика бота) тоже работает
+        async def from_handler():
+            return service.create_spreadsheet(USER_DATA)
+
+        assert asyncio.run(from_handler())[0] == 'sheet-2'
+
+        # Асинхронный вариант использует свой клиент в текущем event loop
+        async def async_variant():
+            result = await service.create_spreadsheet_async(USER_DATA)
+            await service.sheets_client.close()
+            return result
+
+        spreadsheet_id, _ = asyncio.run(async_variant())
+        assert spreadsheet_id == 'sheet-3'
+        assert api.calls.count('create') == 3
+        # Остановка завершает поток и закрывает event loop оберток
+        sync_loop, sync_thread = service._sync_loop, service._sync_thread
+        asyncio.run(service.close())
+        assert not sync_thread.is_alive() and sync_loop.is_closed()
+        assert service._sync_loop is None
+    finally:
+        asyncio.run(service.close())
+        asyncio.run_coroutine_threadsafe(api.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    print("✅ Синхронный API сохранен")
+
+
+if __name__ == '__main__':
+    test_token_cached_and_concurrency_bounded()
+    test_token_refreshed_in_background()
+    test_spreadsheet_created_in_one_request()
+    test_sync_wrapper_keeps_api()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Тест адаптивных таймаутов по наблюдаемым задержкам систем
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from latency_tracker import LatencyTracker, QuantileSketch
+
+
+def test_sketch_quantiles_within_relative_error():
+    """Квантили лог-корзин отличаются от точных не больше чем на gamma"""
+    sketch = QuantileSketch()
+    # Перемешиваем: затухание дает больший вес последним замерам
+    values = [0.1 * i for i in range(1, 1001)]
+    random.Random(42).shuffle(values)
+    for value in values:
+        sketch.add(value)
+
+    p50, p99 = sketch.quantile(0.5), sketch.quantile(0.99)
+    print(f"p50={p50:.2f} p99={p99:.2f}")
+    assert abs(p50 - 50) / 50 < 0.1
+    assert abs(p99 - 99) / 99 < 0.1
+
+
+def test_timeout_follows_observed_latency():
+    """Пока замеров мало - максимум; потом p99 с запасом в пределах"""
+    with tempfile.TemporaryDirectory() as tmp:
+        tracker = LatencyTracker(path=os.path.join(tmp, 'latency.json'))
+        low, high = tracker.bounds['ready']
+
+        assert tracker.timeout('webhook_1', 'ready') == high
+
+        for _ in range(config.TIMEOUT_MIN_SAMPLES):
+            tracker.observe('webhook_1', 'ready', 10.0)
+        adaptive = tracker.timeout('webhook_1', 'ready')
+        print(f"Таймаут после быстрых ответов: {adaptive:.1f} сек")
+        assert low <= adaptive < high
+        assert adaptive >= 10.0 * (1 + tracker.margin_ratio)
+
+        # Очень быстрая система не опускается ниже минимума
+        for _ in range(config.TIMEOUT_MIN_SAMPLES):
+            tracker.observe('webhook_2', 'ready', 0.05)
+        assert tracker.timeout('webhook_2', 'ready') == low
+
+        # Таймауты учитываются и поднимают оценку обратно
+        for _ in range(config.TIMEOUT_MIN_SAMPLES * 2):
+            tracker.observe_timeout('webhook_1', 'ready', high)
+        assert tracker.timeout('webhook_1', 'ready') == high
+
+
+def test_state_survives_restart():
+    """Статистика сохраняется в файл и загружается новым экземпляром"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'state', 'latency.json')
+        tracker = LatencyTracker(path=path)
+        for _ in range(config.TIMEOUT_MIN_SAMPLES):
+            tracker.observe('webhook_3', 'ack', 1.0)
+        tracker.save()
+
+        restored = LatencyTracker(path=path)
+        assert restored.timeout('webhook_3', 'ack') == tracker.timeout('webhook_3', 'ack')
+        assert 'webhook_3|ack' in restored.get_stats()
+
+
+if __name__ == '__main__':
+    test_sketch_quantiles_within_relative_error()
+    test_timeout_follows_observed_latency()
+    test_state_survives_restart()
+    print("✅ Все тесты пройдены")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Тест неблокирующей отправки в N8N: event loop должен оставаться отзывчивым,
+пока N8N медленно отвечает
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from n8n_webhook_service import N8NWebhookService
+from http_client_pool import close_http_client
+
+N8N_DELAY = 1.0
+
+TEST_USER_DATA = {
+    'profession': 'Тест медленного N8N',
+    'segmentation': 'Проверка отзывчивости event loop',
+    'ideal_client': 'Бот, который не зависает'
+}
+
+
+async def start_slow_n8n_stub(status=200):
+    """Локальная заглушка N8N, отвечающая с задержкой"""
+    received = []
+
+    async def handler(request):
+        received.append(await request.json())
+        await asyncio.sleep(N8N_DELAY)
+        return web.json_response({'status': 'accepted'}, status=status)
+
+    app = web.Application()
+    app.router.add_post('/webhook/create-sheets', handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/webhook/create-sheets', received
+
+
+async def measure_loop_while_sending(service, user_id):
+    """Отправляет данные в N8N и параллельно измеряет паузы event loop'а"""
+    max_gap = 0.0
+    sending = True
+
+    async def heartbeat():
+        nonlocal max_gap
+        last = time.perf_counter()
+        while sending:
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            max_gap = max(max_gap, now - last)
+            last = now
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    result = await service.send_data_to_n8n(user_id, TEST_USER_DATA)
+    elapsed = time.perf_counter() - started
+    sending = False
+    await heartbeat_task
+    return result, elapsed, max_gap
+
+
+def test_loop_stays_responsive_while_n8n_is_slow():
+    """Event loop не блокируется на время ответа N8N"""
+
+    async def run():
+        runner, url, received = await start_slow_n8n_stub()
+        try:
+            service = N8NWebhookService()
+            service.set_outgoing_webhook(url)
+
+            result, elapsed, max_gap = await measure_loop_while_sending(service, 12345)
+            print(f"request_id: {result}, ожидание: {elapsed:.2f}s, макс. пауза loop: {max_gap * 1000:.1f}ms")
+
+            assert result and result.startswith('12345_')
+            assert elapsed >= N8N_DELAY
+            assert max_gap < 0.2, f"event loop был заблокирован на {max_gap:.2f}s"
+            assert service.get_pending_requests_count() == 1
+            assert received[0]['request_id'] == result
+        finally:
+            await close_http_client()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_error_status_keeps_return_contract():
+    """При ошибке N8N возвращается False и запрос не остается в ожидающих"""
+
+    async def run():
+        runner, url, _ = await start_slow_n8n_stub(status=500)
+        try:
+            service = N8NWebhookService()
+            service.set_outgoing_webhook(url)
+
+            result, _, max_gap = await measure_loop_while_sending(service, 54321)
+
+            assert result is False
+            assert max_gap < 0.2
+            assert service.get_pending_requests_count() == 0
+        finally:
+            await close_http_client()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_loop_stays_responsive_while_n8n_is_slow()
+    test_error_status_keeps_return_contract()
+    print("🎉 Все тесты пройдены успешно!")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Тест шаблона тела webhook-запроса: результат совпадает с полным
+кодированием словаря и не зависит от содержимого данных пользователя
+"""
+
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import payload_builder
+from payload_builder import PayloadTemplate
+
+USER_DATA = {
+    'profession': 'Психолог "с кавычками" и \\ слешами',
+    'segmentation': 'Женщины 25-45 @@webhook_name@@',
+    'ideal_client': 'Клиентка 🙂\nс переносом строки'
+}
+
+SPREADSHEET_INFO = {
+    'spreadsheet_id': 'SHEET_ID',
+    'spreadsheet_url': 'https://docs.google.com/spreadsheets/d/SHEET_ID',
+    'sheet_title': 'Анализ ЦА',
+    'created_at': datetime(2024, 9, 20, 17, 16, 45)
+}
+
+
+def test_render_produces_expected_body():
+    """Подставленные поля и общие данные корректно декодируются"""
+    template = PayloadTemplate(USER_DATA, SPREADSHEET_INFO, 8098626207)
+
+    for name in ('webhook_1', 'webhook_9'):
+        body = json.loads(template.render(name, f"run_1:{name}"))
+        assert body['webhook_name'] == name
+        assert body['idempotency_key'] == f"run_1:{name}"
+        assert body['user_id'] == '8098626207'
+        assert body['telegram_user_id'] == 8098626207
+        assert body['user_data']['profession'] == USER_DATA['profession']
+        assert body['user_data']['segmentation'] == USER_DATA['segmentation']
+        assert body['user_data']['ideal_client_portrait'] == USER_DATA['ideal_client']
+        assert body['spreadsheet_info']['created_at'] == '2024-09-20T17:16:45'
+        datetime.fromisoformat(body['timestamp'])
+
+    print(f"Пример тела: {template.render('webhook_1', 'run_1:webhook_1')[:120]}...")
+
+
+def test_stdlib_fallback_matches_orjson():
+    """Без orjson тело кодируется стандартным json и декодируется так же"""
+    fast = json.loads(PayloadTemplate(USER_DATA, SPREADSHEET_INFO, 1).render('webhook_2', 'k'))
+
+    saved = payload_builder.orjson
+    payload_builder.orjson = None
+    try:
+        slow = json.loads(PayloadTemplate(USER_DATA, SPREADSHEET_INFO, 1).render('webhook_2', 'k'))
+    finally:
+        payload_builder.orjson = saved
+
+    fast.pop('timestamp')
+    slow.pop('timestamp')
+    assert fast == slow
+
+
+if __name__ == '__main__':
+    test_render_produces_expected_body()
+    test_stdlib_fallback_matches_orjson()
+    print("✅ Все тесты пройдены")
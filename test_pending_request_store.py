@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Тест хранилища N8N запросов: TTL, лимиты и счетчики статусов
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pending_request_store import PendingRequestStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_store(**kwargs):
+    clock = FakeClock()
+    params = dict(ttl_seconds=100, completed_ttl_seconds=10, max_size=1000,
+                  memory_budget_bytes=10 * 1024 * 1024, clock=clock)
+    params.update(kwargs)
+    return PendingRequestStore(**params), clock
+
+
+def test_expired_requests_are_evicted_automatically():
+    """Истекшие запросы удаляются без ручного вызова cleanup"""
+    store, clock = make_store()
+    store.put('a', {'user_id': 1, 'status': 'pending'})
+    clock.now = 50
+    store.put('b', {'user_id': 2, 'status': 'pending'})
+
+    clock.now = 101
+    store.put('c', {'user_id': 3, 'status': 'pending'})
+
+    assert 'a' not in store
+    assert 'b' in store and 'c' in store
+    assert store.get_stats()['evicted_expired'] == 1
+
+
+def test_completed_requests_get_short_ttl():
+    """Завершенный запрос живет completed_ttl_seconds"""
+    store, clock = make_store()
+    store.put('a', {'user_id': 1, 'status': 'pending'})
+    store.update('a', {'status': 'completed'})
+
+    clock.now = 11
+    assert store.get_count('completed') == 0
+    assert 'a' not in store
+
+
+def test_counters_follow_status_changes():
+    """Счетчики статусов ведутся инкрементально"""
+    store, _ = make_store()
+    for i in range(5):
+        store.put(str(i), {'user_id': i, 'status': 'pending'})
+    store.update('0', {'status': 'completed'})
+    store.update('1', {'status': 'completed'})
+    store.pop('2')
+    del store['3']
+
+    assert store.get_count('pending') == 1
+    assert store.get_count('completed') == 2
+    assert len(store) == 3
+
+
+def test_max_size_evicts_earliest_expiring():
+    """При переполнении вытесняются записи, которые истекли бы первыми"""
+    store, clock = make_store(max_size=3)
+    for i in range(5):
+        clock.now = i
+        store.put(str(i), {'user_id': i, 'status': 'pending'})
+
+    assert list(store.keys()) == ['2', '3', '4']
+    assert store.get_stats()['evicted_capacity'] == 2
+
+
+def test_memory_budget_is_respected():
+    """Объем памяти не превышает бюджет"""
+    store, _ = make_store(memory_budget_bytes=20_000)
+    for i in range(500):
+        store.put(str(i), {'user_id': i, 'status': 'pending', 'payload': 'x' * 200})
+
+    stats = store.get_stats()
+    assert stats['memory_bytes'] <= 20_000
+    assert 0 < stats['size'] < 500
+    assert stats['by_status']['pending'] == stats['size']
+
+
+if __name__ == '__main__':
+    test_expired_requests_are_evicted_automatically()
+    test_completed_requests_get_short_ttl()
+    test_counters_follow_status_changes()
+    test_max_size_evicts_earliest_expiring()
+    test_memory_budget_is_respected()
+    print("🎉 Все тесты пройдены успешно!")
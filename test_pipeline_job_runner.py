@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Тест фоновой очереди анализов: обработчик сообщения не ждет анализ,
+анализы одного пользователя идут по очереди, воркеров не больше заданного
+"""
+
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline_job_runner import PipelineJobRunner
+
+
+def test_jobs_of_one_user_are_serialized():
+    """Анализы одного пользователя не пересекаются, разных - идут параллельно"""
+
+    async def run():
+        runner = PipelineJobRunner(workers=4)
+        active = {}
+        overlaps = []
+        log = []
+
+        def job(user_id, label):
+            async def body():
+                if active.get(user_id):
+                    overlaps.append(label)
+                active[user_id] = True
+                await asyncio.sleep(0.05)
+                log.append(label)
+                active[user_id] = False
+            return body
+
+        started = time.perf_counter()
+        for label in ('a1', 'a2', 'a3'):
+            assert runner.submit('a', job('a', label))
+        assert runner.submit('b', job('b', 'b1'))
+
+        while runner.get_stats()['completed'] < 4:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        await runner.stop()
+
+        print(f"Порядок: {log}, {elapsed:.2f} сек")
+        assert not overlaps
+        assert [label for label in log if label.startswith('a')] == ['a1', 'a2', 'a3']
+        assert log.index('b1') == 0 or log.index('b1') == 1  # b не ждет все анализы a
+        assert elapsed >= 0.15
+
+    asyncio.run(run())
+
+
+def test_worker_limit_and_failures():
+    """Одновременно не больше workers анализов; ошибка анализа не останавливает воркер"""
+
+    async def run():
+        runner = PipelineJobRunner(workers=2)
+        running = 0
+        peak = 0
+
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+        async def failing():
+            raise RuntimeError("система недоступна")
+
+        runner.submit(0, failing)
+        for user_id in range(1, 7):
+            runner.submit(user_id, job)
+        while runner.get_stats()['completed'] + runner.get_stats()['failed'] < 7:
+            await asyncio.sleep(0.01)
+        stats = runner.get_stats()
+        await runner.stop()
+
+        print(f"Статистика: {stats}, пик: {peak}")
+        assert peak == 2
+        assert stats['failed'] == 1 and stats['completed'] == 6
+
+    asyncio.run(run())
+
+
+def test_queue_is_bounded():
+    """Переполненная очередь отклоняет новые анализы"""
+
+    async def run():
+        runner = PipelineJobRunner(workers=1, queue_max=2)
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        assert runner.submit(1, blocked)
+        await asyncio.sleep(0)  # Первый анализ забран воркером
+        assert runner.submit(2, blocked)
+        assert runner.submit(3, blocked)
+        assert not runner.submit(4, blocked)
+        assert runner.get_stats()['rejected'] == 1
+        release.set()
+        await runner.stop()
+
+    asyncio.run(run())
+
+
+def test_handle_message_returns_before_pipeline_finishes():
+    """Без N8N обработчик сообщения ставит анализ в очередь и сразу возвращается"""
+    from bot import TargetAudienceBot, WAITING_FOR_IDEAL_CLIENT, PROCESSING
+    from session_store import UserSession
+
+    async def run():
+        bot = TargetAudienceBot()
+        finished = asyncio.Event()
+        replies = []
+
+        async def n8n_unavailable(user_id, data):
+            return False
+
+        async def slow_pipeline(user_id, session, table_status):
+            await asyncio.sleep(0.3)
+            replies.append(f"Таблица: {table_status}")
+            finished.set()
+
+        async def send(chat_id, text, reply_markup=None, max_retries=3):
+            replies.append(text)
+            return True
+
+        bot.n8n_service.send_data_to_n8n = n8n_unavailable
+        bot._start_sequential_webhooks_without_table = slow_pipeline
+        bot.safe_send_message = send
+
+        async def reply_text(text):
+            replies.append(text)
+
+        def make_update(text):
+            return SimpleNamespace(
+                effective_user=SimpleNamespace(id=7),
+                message=SimpleNamespace(text=text, reply_text=reply_text)
+            )
+
+        bot.user_sessions.set(7, UserSession(state=WAITING_FOR_IDEAL_CLIENT, profession='p', segmentation='s'))
+        started = time.perf_counter()
+        await bot.handle_message(make_update('идеальный клиент'), None)
+        handler_time = time.perf_counter() - started
+        assert bot.user_sessions.peek(7).state == PROCESSING
+
+        # Повторное сообщение не запускает второй анализ
+        await bot.handle_message(make_update('еще раз'), None)
+        assert 'уже выполняется' in replies[-1]
+
+        await asyncio.wait_for(finished.wait(), timeout=2)
+        await asyncio.sleep(0.01)
+        await bot.job_runner.stop()
+
+        print(f"Обработчик вернулся за {handler_time * 1000:.1f} мс")
+        assert handler_time < 0.1
+        assert 7 not in bot.user_sessions
+        assert 'Таблица: Не создана (N8N недоступен)' in replies
+        assert not any('Процесс завершен' in text for text in replies)  # Итог только в сообщении прогресса
+
+    asyncio.run(run())
+
+
+def make_bot_update(replies, user_id=7):
+    async def reply_text(text):
+        replies.append(text)
+
+    def make_update(text):
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id),
+            message=SimpleNamespace(text=text, reply_text=reply_text)
+        )
+    return make_update
+
+
+def test_slow_n8n_does_not_hold_handler():
+    """Отправка в N8N выполняется воркером: медленный N8N не задерживает обработчик"""
+    from bot import TargetAudienceBot, WAITING_FOR_IDEAL_CLIENT
+    from session_store import UserSession
+
+    async def run():
+        bot = TargetAudienceBot()
+        replies = []
+        sent = asyncio.Event()
+
+        async def slow_n8n(user_id, data):
+            await asyncio.sleep(0.3)
+            sent.set()
+            return 'req_1'
+
+        async def send(chat_id, text, reply_markup=None, max_retries=3):
+            replies.append(text)
+            return True
+
+        bot.n8n_service.send_data_to_n8n = slow_n8n
+        bot.safe_send_message = send
+        make_update = make_bot_update(replies)
+
+        bot.user_sessions.set(7, UserSession(state=WAITING_FOR_IDEAL_CLIENT, profession='p', segmentation='s'))
+        started = time.perf_counter()
+        await bot.handle_message(make_update('идеальный клиент'), None)
+        handler_time = time.perf_counter() - started
+
+        await asyncio.wait_for(sent.wait(), timeout=2)
+        await asyncio.sleep(0.01)
+        await bot.job_runner.stop()
+
+        print(f"Обработчик вернулся за {handler_time * 1000:.1f} мс")
+        assert handler_time < 0.1
+        assert bot.user_sessions.peek(7).n8n_request_id == 'req_1'
+        assert bot.n8n_request_index == {'req_1': 7}
+        assert 'req_1' in bot.n8n_deadlines
+        bot.n8n_deadlines['req_1'].cancel()
+        assert any('Данные отправлены в N8N' in text for text in replies)
+
+    asyncio.run(run())
+
+
+def test_rejected_analysis_ends_session():
+    """Переполненная очередь не оставляет сессию в PROCESSING"""
+    from bot import TargetAudienceBot, WAITING_FOR_IDEAL_CLIENT
+    from session_store import UserSession
+
+    async def run():
+        bot = TargetAudienceBot()
+        bot.job_runner = PipelineJobRunner(workers=1, queue_max=1)
+        replies = []
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        async def send(chat_id, text, reply_markup=None, max_retries=3):
+            replies.append(text)
+            return True
+
+        bot.safe_send_message = send
+        make_update = make_bot_update(replies)
+
+        # Очередь занята анализами других пользователей
+        bot.job_runner.submit(1, blocked)
+        await asyncio.sleep(0)
+        bot.job_runner.submit(2, blocked)
+
+        bot.user_sessions.set(7, UserSession(state=WAITING_FOR_IDEAL_CLIENT, profession='p', segmentation='s'))
+        await bot.handle_message(make_update('идеальный клиент'), None)
+        assert 'слишком много анализов' in replies[-1]
+        assert 7 not in bot.user_sessions
+
+        # Следующее сообщение не отвечает "анализ уже выполняется"
+        await bot.handle_message(make_update('еще раз'), None)
+        assert '/start' in replies[-1] and 'уже выполняется' not in replies[-1]
+
+        release.set()
+        await bot.job_runner.stop()
+
+    asyncio.run(run())
+
+
+def test_analyses_without_table_reach_master_sheet():
+    """Анализ без таблицы и продолженный после перезапуска тоже записываются в общую таблицу"""
+    from bot import TargetAudienceBot, WAITING_FOR_IDEAL_CLIENT
+    from session_store import UserSession
+
+    async def run():
+        bot = TargetAudienceBot()
+        recorded = []
+        done = asyncio.Event()
+
+        class FakeTelegram:
+            async def send_message(self, chat_id, text, **kwargs):
+                return SimpleNamespace(message_id=1)
+
+            async def edit_message_text(self, *args, **kwargs):
+                return True
+
+        async def n8n_unavailable(user_id, data):
+            return False
+
+        async def systems(**kwargs):
+            return {'webhook_1': True, 'webhook_2': False}
+
+        def record_analysis(user_id, user_data, spreadsheet_url='', systems=''):
+            recorded.append((user_id, user_data['profession'], spreadsheet_url, systems))
+            done.set()
+
+        async def send(chat_id, text, reply_markup=None, max_retries=3):
+            return True
+
+        bot.application = SimpleNamespace(bot=FakeTelegram())
+        bot.n8n_service.send_data_to_n8n = n8n_unavailable
+        bot.sequential_webhook_service.send_webhooks_sequentially = systems
+        bot.google_service.record_analysis = record_analysis
+        bot.safe_send_message = send
+
+        bot.user_sessions.set(7, UserSession(state=WAITING_FOR_IDEAL_CLIENT, profession='p', segmentation='s'))
+        await bot.handle_message(make_bot_update([])('идеальный клиент'), None)
+        await asyncio.wait_for(done.wait(), timeout=2)
+        assert recorded == [(7, 'p', '', '1/2')]
+
+        # Анализ из outbox после перезапуска
+        await bot._resume_pipeline({
+            'run_id': '8_1', 'user_id': 8, 'completed': set(),
+            'user_data': {'profession': 'q', 'segmentation': '', 'ideal_client': ''},
+            'spreadsheet_info': {'spreadsheet_id': 'abc', 'spreadsheet_url': 'https://sheet/abc', 'sheet_title': 't'}
+        })
+        assert recorded[-1] == (8, 'q', 'https://sheet/abc', '1/2')
+        await bot.job_runner.stop()
+
+    asyncio.run(run())
+
+
+def test_rejected_resumed_runs_are_retried():
+    """Анализы из outbox, не поместившиеся в очередь при запуске, ставятся позже"""
+    import bot as bot_module
+    from bot import TargetAudienceBot
+
+    async def run():
+        bot = TargetAudienceBot()
+        bot.job_runner = PipelineJobRunner(workers=1, queue_max=1)
+        resumed = []
+        release = asyncio.Event()
+
+        async def resume(run):
+            await release.wait()
+            resumed.append(run['run_id'])
+
+        bot._resume_pipeline = resume
+        bot_module.RESUME_RETRY_SECONDS = 0.05
+        try:
+            runs = [{'run_id': f'run_{i}', 'user_id': i} for i in range(3)]
+            bot._resume_unfinished_runs(runs)
+            assert bot.job_runner.get_stats()['rejected'] >= 1
+            release.set()
+            for _ in range(200):
+                if len(resumed) == 3:
+                    break
+                await asyncio.sleep(0.01)
+            assert sorted(resumed) == ['run_0', 'run_1', 'run_2']
+        finally:
+            bot_module.RESUME_RETRY_SECONDS = 30
+            await bot.job_runner.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_jobs_of_one_user_are_serialized()
+    test_worker_limit_and_failures()
+    test_queue_is_bounded()
+    test_handle_message_returns_before_pipeline_finishes()
+    test_slow_n8n_does_not_hold_handler()
+    test_rejected_analysis_ends_session()
+    test_analyses_without_table_reach_master_sheet()
+    test_rejected_resumed_runs_are_retried()
+    print("✅ Все тесты пройдены")
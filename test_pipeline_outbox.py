@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Тест outbox анализов: шаги переживают перезапуск, отправка продолжается
+с последнего обработанного webhook'а
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline_outbox import PipelineOutbox
+from sequential_webhook_service import SequentialWebhookService
+from webhook_graph import build_dependency_graph
+
+NAMES = [f'webhook_{i}' for i in range(1, 10)]
+
+
+def make_service(outbox, stop_after=None):
+    service = SequentialWebhookService()
+    service.webhooks = {name: f'http://example.invalid/{name}' for name in NAMES}
+    service.dependencies = build_dependency_graph(NAMES)
+    service.step_pause_seconds = 0
+    service.outbox = outbox
+    sent = []
+
+    async def fake_send(webhook_name, webhook_url, payload, user_id, ready_timeout=None, idempotency_key=None):
+        if stop_after is not None and len(sent) == stop_after:
+            # Имитация падения процесса посреди шага
+            raise asyncio.CancelledError()
+        sent.append(webhook_name)
+        return True
+
+    service._send_webhook_and_wait = fake_send
+    return service, sent
+
+
+async def progress_callback(message):
+    pass
+
+
+def test_unfinished_run_resumes_after_restart():
+    """Прерванный анализ продолжается с первого необработанного webhook'а"""
+
+    async def run(path):
+        # Первый запуск: обработано 4 системы, затем процесс "падает"
+        outbox = PipelineOutbox(path, flush_interval=0.01, batch_size=100)
+        await outbox.start()
+        service, sent = make_service(outbox, stop_after=4)
+        try:
+            await service.send_webhooks_sequentially(
+                42, {'profession': 'Тест'}, {'sheet_title': 'T'}, progress_callback, run_id='42_1')
+        except asyncio.CancelledError:
+            pass
+        assert sent == NAMES[:4]
+        stats = outbox.get_stats()
+        await outbox.close()
+        print(f"Первый запуск: {stats}")
+
+        # Второй запуск: анализ найден в журнале
+        outbox = PipelineOutbox(path, flush_interval=0.01)
+        await outbox.start()
+        runs = await outbox.load_unfinished_runs()
+        assert len(runs) == 1
+        assert runs[0]['user_id'] == 42
+        assert runs[0]['user_data'] == {'profession': 'Тест'}
+        assert runs[0]['completed'] == set(NAMES[:4])
+
+        service, sent = make_service(outbox)
+        results = await service.send_webhooks_sequentially(
+            42, runs[0]['user_data'], runs[0]['spreadsheet_info'], progress_callback,
+            run_id=runs[0]['run_id'], completed=runs[0]['completed'])
+        assert sent == NAMES[4:]
+        assert all(results.values()) and len(results) == 9
+
+        await outbox.flush()
+        assert await outbox.load_unfinished_runs() == []
+        await outbox.close()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(os.path.join(workdir, 'outbox.sqlite3')))
+
+
+def test_writes_are_batched():
+    """Много операций записываются небольшим числом транзакций"""
+
+    async def run(path):
+        outbox = PipelineOutbox(path, flush_interval=10, batch_size=1000)
+        await outbox.start()
+        for i in range(200):
+            outbox.start_run(f'run_{i}', i, {}, {})
+            outbox.record_step(f'run_{i}', 'webhook_1', True)
+        await outbox.flush()
+        stats = outbox.get_stats()
+        await outbox.close()
+
+        assert stats['operations_written'] == 400
+        assert stats['batches_written'] == 1
+
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(os.path.join(workdir, 'outbox.sqlite3')))
+
+
+def test_failed_write_is_retried():
+    """Пакет, который не удалось записать, не теряется и записывается повторно"""
+
+    async def run(path):
+        outbox = PipelineOutbox(path, flush_interval=0.01, batch_size=1000)
+        await outbox.start()
+        write_batch = outbox._write_batch
+        failures = [1]
+
+        def flaky_write(batch):
+            if failures:
+                failures.pop()
+                raise sqlite3.OperationalError('database is locked')
+            write_batch(batch)
+
+        outbox._write_batch = flaky_write
+        outbox.start_run('run_1', 7, {'profession': 'p'}, {})
+        outbox.record_step('run_1', 'webhook_1', True)
+        for _ in range(200):
+            if outbox.get_stats()['batches_written']:
+                break
+            await asyncio.sleep(0.01)
+        stats = outbox.get_stats()
+        assert stats['write_failures'] == 1 and stats['pending_operations'] == 0
+        await outbox.close()
+
+        restarted = PipelineOutbox(path)
+        await restarted.start()
+        runs = await restarted.load_unfinished_runs()
+        await restarted.close()
+        assert [(run['run_id'], run['completed']) for run in runs] == [('run_1', {'webhook_1'})]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(os.path.join(workdir, 'outbox.sqlite3')))
+
+
+if __name__ == '__main__':
+    test_unfinished_run_resumes_after_restart()
+    test_writes_are_batched()
+    test_failed_write_is_retried()
+    print("🎉 Все тесты пройдены успешно!")
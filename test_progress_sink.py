@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Тест вывода прогресса: события анализа объединяются в несколько
+редактирований одного сообщения
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from progress_sink import EditingProgressSink, MessageProgressSink
+
+
+class FakeTelegramBot:
+    """Записывает вызовы Bot API"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.calls.append(('send', text))
+        return SimpleNamespace(message_id=len(self.calls))
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        self.calls.append(('edit', text))
+
+
+async def simulate_analysis(progress, systems=9):
+    """События в том же порядке, что шлет send_webhooks_sequentially"""
+    await progress(f"🚀 Начинаю отправку в {systems} систем...")
+    for i in range(1, systems + 1):
+        await progress(f"📤 Отправляю в систему {i}/{systems} (webhook_{i})...\n⏰ Жду ответа до 3 мин")
+        await asyncio.sleep(0.005)
+        await progress(f"✅ Система {i}/{systems} обработана успешно")
+
+
+def test_analysis_uses_few_api_calls():
+    """Полный анализ из 9 систем - не больше 5 вызовов Bot API"""
+
+    async def run():
+        bot = FakeTelegramBot()
+        progress = EditingProgressSink(bot, 1, header="🎉 Таблица создана!", flush_interval=0.05)
+        await progress.start()
+        await simulate_analysis(progress)
+        await progress.finish("🏁 Процесс завершен!", hint="Напишите /start")
+
+        kinds = [kind for kind, _ in bot.calls]
+        print(f"Вызовы Bot API: {kinds}")
+        assert kinds[0] == 'send' and kinds[-1] == 'send'
+        assert 3 <= len(bot.calls) <= 5
+        # Последнее редактирование содержит все события
+        last_edit = [text for kind, text in bot.calls if kind == 'edit'][-1]
+        assert "✅ Система 9/9 обработана успешно" in last_edit
+        assert "/start" in bot.calls[-1][1]
+
+    asyncio.run(run())
+
+
+def test_unchanged_text_is_not_edited():
+    """Повторная отправка того же состояния пропускается"""
+
+    async def run():
+        bot = FakeTelegramBot()
+        progress = EditingProgressSink(bot, 1, header="Статус", flush_interval=0.01)
+        await progress.start()
+        await progress.start()
+        await progress.finish("Готово")
+        assert [kind for kind, _ in bot.calls] == ['send', 'send']
+        assert progress.skipped_edits == 2
+
+    asyncio.run(run())
+
+
+def test_messages_mode_keeps_old_behaviour():
+    """Режим messages: каждое событие - отдельное сообщение"""
+
+    async def run():
+        bot = FakeTelegramBot()
+        progress = MessageProgressSink(bot, 1, header="Старт")
+        await progress.start()
+        await simulate_analysis(progress, systems=2)
+        await progress.finish("Готово", hint="Напишите /start")
+        assert len(bot.calls) == 1 + 5 + 2
+        assert all(kind == 'send' for kind, _ in bot.calls)
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_analysis_uses_few_api_calls()
+    test_unchanged_text_is_not_edited()
+    test_messages_mode_keeps_old_behaviour()
+    print("✅ Все тесты пройдены")
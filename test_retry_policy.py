@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Тест повторов webhook-запросов: временные ошибки повторяются с тем же
+Idempotency-Key, постоянные - нет, hedging берет первый ответ
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from circuit_breaker import CircuitBreakerRegistry
+from latency_tracker import LatencyTracker
+from retry_policy import RetryBudget, RetryPolicy
+from sequential_webhook_service import SequentialWebhookService
+from http_client_pool import close_http_client
+
+
+def test_budget_limits_retries():
+    """Без новых запросов бюджет повторов заканчивается"""
+    budget = RetryBudget(ratio=0.5, min_per_second=0, capacity=2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_spend()
+    assert budget.exhausted == 1
+
+
+def test_hedge_takes_first_answer():
+    """Медленная первая попытка не задерживает шаг дольше hedge_delay"""
+
+    async def run():
+        policy = RetryPolicy(max_attempts=1, base_delay=0)
+        delays = [1.0, 0.01]
+
+        async def attempt():
+            await asyncio.sleep(delays.pop(0))
+            return 200, '', None
+
+        started = time.perf_counter()
+        result = await policy.call(attempt, 'webhook_1', hedge_delay=0.05)
+        elapsed = time.perf_counter() - started
+        print(f"Ответ с hedging за {elapsed * 1000:.0f} мс, {policy.get_stats()}")
+        assert result[0] == 200
+        assert elapsed < 0.5
+        assert policy.hedges == 1 and policy.hedge_wins == 1
+
+    asyncio.run(run())
+
+
+async def start_flaky_system(statuses, delay=0.0):
+    """Система, отвечающая статусами из списка по очереди, затем 200"""
+    keys = []
+
+    async def handler(request):
+        keys.append((request.headers.get('Idempotency-Key'), (await request.json()).get('idempotency_key')))
+        await asyncio.sleep(delay)
+        status = statuses.pop(0) if statuses else 200
+        return web.json_response({}, status=status, headers={'Retry-After': '0'})
+
+    app = web.Application()
+    app.router.add_post('/hook', handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/hook', keys
+
+
+def make_service(url):
+    service = SequentialWebhookService()
+    service.circuit_breakers = CircuitBreakerRegistry(failure_threshold=10)
+    service.retry_policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.05,
+                                       budget=RetryBudget(ratio=1, min_per_second=0))
+    service.webhooks = {'webhook_1': url}
+    service.dependencies = {'webhook_1': []}
+    service.step_pause_seconds = 0
+
+    # Система "отвечает ready" сразу после успешного POST
+    async def instant_ready(webhook_name, user_id, waiter, timeout_seconds=180):
+        waiter.set_result({'status': 'ready'})
+        return True
+    service._wait_for_webhook_response = instant_ready
+    return service
+
+
+async def noop_progress(text):
+    pass
+
+
+def test_transient_errors_are_retried_with_same_key():
+    """502 и 503 повторяются, ключ идемпотентности одинаковый во всех попытках"""
+
+    async def run():
+        runner, url, keys = await start_flaky_system([502, 503])
+        service = make_service(url)
+        try:
+            results = await service.send_webhooks_sequentially(1, {}, {}, noop_progress, run_id='run_42')
+            print(f"Попытки: {keys}")
+            assert results == {'webhook_1': True}
+            assert len(keys) == 3
+            assert set(keys) == {('run_42:webhook_1', 'run_42:webhook_1')}
+            assert service.retry_policy.retries == 2
+        finally:
+            await close_http_client()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_permanent_error_is_not_retried():
+    """400 - ошибка запроса, повтор не поможет"""
+
+    async def run():
+        runner, url, keys = await start_flaky_system([400])
+        service = make_service(url)
+        try:
+            results = await service.send_webhooks_sequentially(1, {}, {}, noop_progress)
+            assert results == {'webhook_1': False}
+            assert len(keys) == 1
+        finally:
+            await close_http_client()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+class RecordingTracker(LatencyTracker):
+    """Трекер без файла, запоминающий замеры"""
+
+    def __init__(self):
+        super().__init__(path=os.path.join(tempfile.mkdtemp(), 'latency.json'))
+        self.samples = []
+
+    def observe(self, target, kind, seconds):
+        self.samples.append((kind, seconds))
+        super().observe(target, kind, seconds)
+
+
+def test_ready_latency_excludes_ack():
+    """Задержка 'ready' считается от подтверждения POST, как и таймаут ожидания"""
+
+    async def run():
+        runner, url, _ = await start_flaky_system([], delay=0.2)
+        service = make_service(url)
+        service.latency_tracker = tracker = RecordingTracker()
+        try:
+            results = await service.send_webhooks_sequentially(1, {}, {}, noop_progress)
+            assert results == {'webhook_1': True}
+            samples = dict(tracker.samples)
+            assert samples['ack'] >= 0.2
+            assert samples['ready'] < 0.1
+        finally:
+            await close_http_client()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_budget_limits_retries()
+    test_hedge_takes_first_answer()
+    test_transient_errors_are_retried_with_same_key()
+    test_permanent_error_is_not_retried()
+    test_ready_latency_excludes_ack()
+    print("✅ Все тесты пройдены")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Тест хранилища сессий: вытеснение неактивных по TTL, лимит с LRU,
+уведомление владельца и учет памяти
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from session_store import SessionStore, UserSession
+
+
+def test_user_session_is_slotted():
+    """У сессии нет __dict__, user_data собирается из ответов"""
+    session = UserSession(state=1, profession='p', segmentation='s', ideal_client='c')
+    assert not hasattr(session, '__dict__')
+    assert session.user_data == {'profession': 'p', 'segmentation': 's', 'ideal_client': 'c'}
+    try:
+        session.unknown = 1
+        assert False, "Лишнее поле не должно добавляться"
+    except AttributeError:
+        pass
+    print(f"✅ Сессия без __dict__: ~{session.estimate_size()} байт")
+
+
+def test_idle_sessions_are_evicted():
+    """Сессии без активности дольше TTL вытесняются, активные остаются"""
+    evicted = []
+    store = SessionStore(idle_ttl=60, max_sessions=100,
+                         on_evict=lambda user_id, session, reason: evicted.append((user_id, reason)))
+    for user_id in (1, 2, 3):
+        store.set(user_id, UserSession())
+
+    # Пользователь 1 снова активен: переносится в конец порядка
+    now = store.peek(1).last_active
+    store.peek(2).last_active = now - 120
+    store.peek(3).last_active = now - 120
+    assert store.get(1) is not None
+
+    assert store.evict_idle(now + 1) == 2
+    assert sorted(evicted) == [(2, 'idle'), (3, 'idle')]
+    assert 1 in store and len(store) == 1
+    assert store.get_stats()['evicted_idle'] == 2
+    print("✅ Неактивные сессии вытесняются по TTL")
+
+
+def test_cap_evicts_least_recently_active():
+    """При превышении лимита вытесняется самая давно активная сессия"""
+    evicted = []
+    store = SessionStore(idle_ttl=3600, max_sessions=3,
+                         on_evict=lambda user_id, session, reason: evicted.append((user_id, reason)))
+    for user_id in (1, 2, 3):
+        store.set(user_id, UserSession(n8n_request_id=f"req_{user_id}"))
+
+    store.get(1)  # 1 активен, самый старый теперь 2
+    store.set(4, UserSession())
+
+    assert evicted == [(2, 'lru')]
+    assert 2 not in store and len(store) == 3
+    assert store.get_stats()['evicted_lru'] == 1
+    print("✅ Лимит сессий соблюдается вытеснением LRU")
+
+
+def test_pop_does_not_notify():
+    """Явное удаление сессии не считается вытеснением"""
+    evicted = []
+    store = SessionStore(idle_ttl=60, max_sessions=10,
+                         on_evict=lambda *args: evicted.append(args))
+    store.set(1, UserSession())
+    assert store.pop(1) is not None
+    assert store.pop(1) is None
+    assert evicted == []
+    print("✅ pop() не вызывает on_evict")
+
+
+def test_bot_releases_n8n_binding_on_eviction():
+    """Бот снимает привязку N8N запроса у вытесненной сессии"""
+    from bot import TargetAudienceBot, WAITING_FOR_IDEAL_CLIENT
+
+    bot = TargetAudienceBot()
+    bot.user_sessions.max_sessions = 2
+    for user_id in (1, 2):
+        session = UserSession(state=WAITING_FOR_IDEAL_CLIENT)
+        bot._set_session(user_id, session)
+        bot._bind_n8n_request(user_id, session, f"req_{user_id}")
+
+    bot._set_session(3, UserSession())
+
+    assert bot._find_user_by_n8n_request('req_1') is None
+    assert 'req_1' not in bot.n8n_request_index
+    assert bot._find_user_by_n8n_request('req_2') == 2
+    print("✅ Вытеснение сессии снимает привязку N8N")
+
+
+def test_processing_session_is_not_evicted():
+    """Сессия с анализом в очереди или в ожидании таблицы переживает TTL и лимит"""
+    from bot import TargetAudienceBot, PROCESSING
+
+    async def run():
+        bot = TargetAudienceBot()
+        bot.user_sessions.max_sessions = 2
+        session = UserSession(state=PROCESSING, profession='p', segmentation='s', ideal_client='c')
+        bot._set_session(7, session)
+        bot.n8n_service.pending_requests.put('req_7', {'user_id': 7, 'status': 'pending'})
+        await bot.state_backend.set('n8n:req_7', {'user_id': 7, 'status': 'pending'})
+        bot._bind_n8n_request(7, session, 'req_7')
+
+        # Пока ждем таблицу: другие пользователи упираются в лимит, проходит TTL
+        for user_id in (1, 2, 3):
+            bot._set_session(user_id, UserSession())
+        bot.user_sessions.evict_idle(time.monotonic() + bot.user_sessions.idle_ttl * 10)
+        assert 7 in bot.user_sessions
+        assert bot._find_user_by_n8n_request('req_7') == 7
+
+        received = []
+        finished = asyncio.Event()
+
+        async def pipeline(user_id, spreadsheet_info, session):
+            received.append((user_id, session.user_data['profession'], spreadsheet_info['spreadsheet_url']))
+            bot._end_session(user_id, session)
+            finished.set()
+
+        bot._start_sequential_webhooks = pipeline
+        assert await bot.handle_n8n_webhook({
+            'request_id': 'req_7', 'spreadsheet_id': 'id', 'spreadsheet_url': 'url', 'sheet_title': 't'
+        }) is True
+        await asyncio.wait_for(finished.wait(), timeout=2)
+        assert received == [(7, 'p', 'url')]
+        assert 7 not in bot.user_sessions
+
+    asyncio.run(run())
+    print("✅ Сессия с выполняющимся анализом не вытесняется")
+
+
+def test_lost_session_notifies_user():
+    """Таблица пришла, а сессии нет: пользователь узнает об этом, повторный ответ не беспокоит"""
+    from bot import TargetAudienceBot
+
+    async def run():
+        bot = TargetAudienceBot()
+        bot.n8n_service.pending_requests.put('req_7', {'user_id': 7, 'status': 'pending'})
+        await bot.state_backend.set('n8n:req_7', {'user_id': 7, 'status': 'pending'})
+        sent = []
+
+        async def send(chat_id, text, reply_markup=None, max_retries=3):
+            sent.append((chat_id, text))
+            return True
+
+        bot.safe_send_message = send
+        webhook = {'request_id': 'req_7', 'spreadsheet_id': 'id', 'spreadsheet_url': 'url', 'sheet_title': 't'}
+        assert await bot.handle_n8n_webhook(webhook) is False
+        assert await bot.handle_n8n_webhook(webhook) is False
+        assert len(sent) == 1 and sent[0][0] == 7 and '/start' in sent[0][1]
+
+    asyncio.run(run())
+    print("✅ Потерянный анализ не пропадает молча")
+
+
+def test_memory_stats():
+    """Оценка памяти растет с числом сессий"""
+    store = SessionStore(idle_ttl=3600, max_sessions=10000)
+    for user_id in range(2000):
+        store.set(user_id, UserSession(profession='p' * 50))
+    stats = store.get_stats(sample_size=100)
+    assert stats['sessions'] == 2000
+    assert stats['memory_bytes'] > 2000 * sys.getsizeof(UserSession())
+    print(f"✅ Память 2000 сессий: {stats['memory_bytes'] // 1024} КБ")
+
+
+if __name__ == '__main__':
+    test_user_session_is_slotted()
+    test_idle_sessions_are_evicted()
+    test_cap_evicts_least_recently_active()
+    test_pop_does_not_notify()
+    test_bot_releases_n8n_binding_on_eviction()
+    test_processing_session_is_not_evicted()
+    test_lost_session_notifies_user()
+    test_memory_stats()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Тест пакетной записи в общую таблицу: строки многих пользователей уходят
+одним values.append на пакет, неудачная запись повторяется, а строки,
+не отправленные к остановке, сохраняются в файл и дописываются после запуска
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from google_sheets_async import AsyncSheetsClient, SheetsApiError
+from retry_policy import RetryPolicy
+from sheets_write_coalescer import SheetsWriteCoalescer
+from test_google_sheets_async import FakeCredentials, FakeSheetsApi
+
+
+def make_coalescer(client, spill_path='', **kwargs):
+    options = {'flush_interval': 0.05, 'batch_size': 100}
+    options.update(kwargs)
+    return SheetsWriteCoalescer(client, 'master', range_name='Результаты!A1', spill_path=spill_path,
+                                retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.05), **options)
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'условие не выполнилось'
+        await asyncio.sleep(0.01)
+
+
+def test_rows_from_many_users_are_batched():
+    """250 строк от разных пользователей - три запроса, порядок сохранен"""
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        client = AsyncSheetsClient(FakeCredentials(), base_url=api.url)
+        coalescer = make_coalescer(client)
+        await coalescer.start()
+        try:
+            for i in range(250):
+                coalescer.add([f'user-{i % 17}', i])
+            await wait_for(lambda: coalescer.get_stats()['rows_written'] == 250)
+            assert [len(batch) for batch in api.appended] == [100, 100, 50]
+            assert [row[1] for batch in api.appended for row in batch] == list(range(250))
+            assert coalescer.get_stats()['append_requests'] == 3
+        finally:
+            await coalescer.close()
+            await client.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Строки объединены в пакеты")
+
+
+def test_failed_append_is_retried():
+    """Ошибки API не теряют строки: пакет повторяется с backoff"""
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        api.fail_appends = 2
+        client = AsyncSheetsClient(FakeCredentials(), base_url=api.url)
+        coalescer = make_coalescer(client)
+        await coalescer.start()
+        try:
+            for i in range(30):
+                coalescer.add(['user', i])
+            await wait_for(lambda: coalescer.get_stats()['rows_written'] == 30)
+            stats = coalescer.get_stats()
+            assert stats['failed_attempts'] == 2 and not stats['failing']
+            assert [row[1] for batch in api.appended for row in batch] == list(range(30))
+        finally:
+            await coalescer.close()
+            await client.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Неудачная запись повторена")
+
+
+def test_permanent_error_stops_writes_and_spills():
+    """403 не повторяется: строки сохраняются в файл, запросы к API прекращаются"""
+    spill_path = os.path.join(tempfile.mkdtemp(), 'master_rows.jsonl')
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        api.fail_appends = 1000
+        api.append_status = 403
+        client = AsyncSheetsClient(FakeCredentials(), base_url=api.url)
+        coalescer = make_coalescer(client, spill_path=spill_path)
+        await coalescer.start()
+        try:
+            for i in range(30):
+                coalescer.add(['user', i])
+            await wait_for(lambda: coalescer.get_stats()['fatal_error'] is not None)
+            assert 'HTTP 403' in coalescer.get_stats()['fatal_error']
+            assert coalescer.get_stats()['spilled_rows'] == 30
+
+            # Новые строки больше не отправляются
+            coalescer.add(['user', 30])
+            await asyncio.sleep(0.2)
+            assert api.calls.count('values.append') == 1
+        finally:
+            await coalescer.close()
+            await client.close()
+            await api.stop()
+        with open(spill_path, encoding='utf-8') as f:
+            assert len(f.readlines()) == 31
+
+    asyncio.run(run())
+    print("✅ Постоянная ошибка останавливает запись")
+
+
+def test_long_outage_does_not_kill_writer():
+    """Больше 1024 неудачных попыток подряд: backoff не переполняется, запись продолжается"""
+
+    class FlakyClient:
+        def __init__(self, failures):
+            self.failures = failures
+            self.appended = []
+
+        async def append_values(self, spreadsheet_id, range_name, values):
+            if self.failures:
+                self.failures -= 1
+                raise SheetsApiError(503, 'unavailable')
+            self.appended.extend(values)
+
+    async def run():
+        client = FlakyClient(failures=1100)
+        coalescer = SheetsWriteCoalescer(client, 'master', range_name='A1', flush_interval=0.05,
+                                         batch_size=10, spill_path='',
+                                         retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.0))
+        await coalescer.start()
+        try:
+            coalescer.add(['user', 1])
+            await wait_for(lambda: coalescer.get_stats()['rows_written'] == 1, timeout=10)
+            assert coalescer.get_stats()['failed_attempts'] == 1100
+            assert client.appended == [['user', 1]]
+        finally:
+            await coalescer.close()
+
+    asyncio.run(run())
+    print("✅ Долгий сбой API не останавливает запись")
+
+
+def test_unsent_rows_spill_to_file_and_recover():
+    """Пакет, прерванный остановкой, и остаток буфера сохраняются и дописываются после запуска"""
+    spill_path = os.path.join(tempfile.mkdtemp(), 'master_rows.jsonl')
+
+    async def run():
+        api = FakeSheetsApi(delay=0.5)  # Запись зависает - остановка приходится на середину пакета
+        await api.start()
+        client = AsyncSheetsClient(FakeCredentials(), base_url=api.url)
+        coalescer = make_coalescer(client, spill_path=spill_path, batch_size=10)
+        coalescer.FINAL_FLUSH_TIMEOUT = 0.05
+        await coalescer.start()
+        for i in range(25):
+            coalescer.add(['user', i])
+        await wait_for(lambda: coalescer.get_stats()['in_flight'] == 10)
+        await coalescer.close()
+        await client.close()
+        assert coalescer.get_stats()['spilled_rows'] == 25
+        with open(spill_path, encoding='utf-8') as f:
+            assert len(f.readlines()) == 25
+
+        # Прерванный запрос мог дойти до API (доставка "хотя бы один раз") - дожидаемся его
+        await asyncio.sleep(0.6)
+        api.appended.clear()
+
+        # Перезапуск: строки из файла записываются, файл удаляется
+        api.delay = 0.0
+        client = AsyncSheetsClient(FakeCredentials(), base_url=api.url)
+        restarted = make_coalescer(client, spill_path=spill_path, batch_size=10)
+        await restarted.start()
+        try:
+            assert restarted.get_stats()['recovered_rows'] == 25
+            assert not os.path.exists(spill_path)
+            await wait_for(lambda: restarted.get_stats()['rows_written'] == 25)
+            written = [row[1] for batch in api.appended for row in batch]
+            assert written == list(range(25))
+        finally:
+            await restarted.close()
+            await client.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Неотправленные строки сохранены и дописаны после запуска")
+
+
+if __name__ == '__main__':
+    test_rows_from_many_users_are_batched()
+    test_failed_append_is_retried()
+    test_permanent_error_stops_writes_and_spills()
+    test_long_outage_does_not_kill_writer()
+    test_unsent_rows_spill_to_file_and_recover()
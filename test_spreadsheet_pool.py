@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Тест пула пустых таблиц: пополнение до целевой глубины, анализ одним
+batchUpdate в таблицу из пула, рост глубины по спросу в пределах квоты и
+сохранение id таблиц между перезапусками
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from google_minimal_service import GoogleMinimalService
+from google_sheets_async import AsyncSheetsClient
+from spreadsheet_pool import SpreadsheetPool
+from test_google_sheets_async import FakeCredentials, FakeSheetsApi, USER_DATA
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'условие не выполнилось'
+        await asyncio.sleep(0.01)
+
+
+def test_analysis_uses_pooled_spreadsheet():
+    """Анализ берет таблицу из пула: один batchUpdate вместо create, пул пополняется"""
+    path = os.path.join(tempfile.mkdtemp(), 'pool.json')
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        service = GoogleMinimalService(credentials=FakeCredentials(), base_url=api.url, pool_size=2)
+        service.pool.path = path
+        await service.start()
+        try:
+            await wait_for(lambda: service.pool.get_stats()['depth'] == 2)
+            pooled_ids = [entry['spreadsheet_id'] for entry in service.pool._ready]
+            api.calls.clear()
+
+            spreadsheet_id, sheet_title = await service.create_spreadsheet_async(USER_DATA)
+            assert spreadsheet_id == pooled_ids[0]
+            assert api.calls[0] == 'batchUpdate'
+            requests = api.spreadsheets[spreadsheet_id]['requests']
+            rename = requests[0]['updateSpreadsheetProperties']['properties']['title']
+            assert rename == sheet_title
+
+            # Пул пополняется в фоне
+            await wait_for(lambda: service.pool.get_stats()['depth'] == 2)
+            stats = service.pool.get_stats()
+            assert stats['hits'] == 1 and stats['misses'] == 0 and stats['hit_rate'] == 1.0
+        finally:
+            await service.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Анализ заполняет таблицу из пула")
+
+
+def test_pool_persists_ready_spreadsheets():
+    """Готовые таблицы переживают перезапуск и не создаются заново"""
+    path = os.path.join(tempfile.mkdtemp(), 'pool.json')
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        client = AsyncSheetsClient(FakeCredentials(), base_url=api.url)
+        try:
+            pool = SpreadsheetPool(client, target_size=3, path=path)
+            await pool.start()
+            await wait_for(lambda: pool.get_stats()['depth'] == 3)
+            await pool.close()
+            assert api.calls.count('create') == 3
+
+            restarted = SpreadsheetPool(client, target_size=3, path=path)
+            await restarted.start()
+            await asyncio.sleep(0.05)
+            assert restarted.get_stats()['depth'] == 3
+            assert api.calls.count('create') == 3
+            assert restarted.claim()['spreadsheet_id'] == 'sheet-1'
+            await wait_for(lambda: restarted.get_stats()['depth'] == 3)
+            assert api.calls.count('create') == 4
+            await restarted.close()
+        finally:
+            await client.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Пул сохраняется между перезапусками")
+
+
+def test_depth_follows_demand_within_quota():
+    """Всплеск спроса увеличивает глубину, но создание не превышает квоту"""
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        client = AsyncSheetsClient(FakeCredentials(), base_url=api.url)
+        pool = SpreadsheetPool(client, target_size=1, max_size=4, creates_per_minute=3, path='')
+        await pool.start()
+        try:
+            await wait_for(lambda: pool.get_stats()['depth'] == 1)
+            # Пять анализов подряд: один попадает в пул, остальные - промахи
+            results = [pool.claim() for _ in range(5)]
+            assert sum(entry is not None for entry in results) == 1
+            assert pool.desired_depth() == 4
+
+            # Квота 3 в минуту: одна уже потрачена, еще две - и пополнение ждет
+            await wait_for(lambda: pool.get_stats()['quota_waits'] > 0)
+            stats = pool.get_stats()
+            assert stats['created'] == 3 and stats['depth'] == 2
+            assert stats['hit_rate'] == 0.2
+        finally:
+            await pool.close()
+            await client.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Глубина пула растет по спросу в пределах квоты")
+
+
+def test_bot_uses_pool_when_n8n_is_unavailable():
+    """N8N недоступен: бот берет таблицу из пула и запускает анализ с ней"""
+    from bot import TargetAudienceBot, PROCESSING
+    from session_store import UserSession
+
+    path = os.path.join(tempfile.mkdtemp(), 'pool.json')
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        bot = TargetAudienceBot()
+        bot.google_service = GoogleMinimalService(credentials=FakeCredentials(), base_url=api.url, pool_size=1)
+        bot.google_service.pool.path = path
+        await bot.google_service.start()
+        try:
+            await wait_for(lambda: bot.google_service.pool.get_stats()['depth'] == 1)
+            pooled_id = bot.google_service.pool._ready[0]['spreadsheet_id']
+            api.calls.clear()
+
+            received = []
+            sent = []
+
+            async def n8n_unavailable(user_id, data):
+                return None
+
+            async def pipeline(user_id, spreadsheet_info, session):
+                received.append(spreadsheet_info)
+
+            async def without_table(user_id, session, table_status):
+                raise AssertionError('анализ не должен идти без таблицы')
+
+            async def send(chat_id, text, reply_markup=None, max_retries=3):
+                sent.append(text)
+                return True
+
+            bot.n8n_service.send_data_to_n8n = n8n_unavailable
+            bot._start_sequential_webhooks = pipeline
+            bot._start_sequential_webhooks_without_table = without_table
+            bot.safe_send_message = send
+
+            session = UserSession(state=PROCESSING, **USER_DATA)
+            bot.user_sessions.set(7, session)
+            await bot._submit_to_n8n(7, session)
+
+            assert len(received) == 1
+            assert received[0]['spreadsheet_id'] == pooled_id
+            assert received[0]['spreadsheet_url'] == bot.google_service.get_spreadsheet_url(pooled_id)
+            assert api.calls[0] == 'batchUpdate'
+            assert 'Создаю таблицу' in sent[0]
+            assert bot.google_service.pool.get_stats()['hits'] == 1
+            assert 7 not in bot.user_sessions
+        finally:
+            await bot.google_service.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Без N8N бот заполняет таблицу из пула")
+
+
+if __name__ == '__main__':
+    test_analysis_uses_pooled_spreadsheet()
+    test_pool_persists_ready_spreadsheets()
+    test_depth_follows_demand_within_quota()
+    test_bot_uses_pool_when_n8n_is_unavailable()
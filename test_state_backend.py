@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Тест общего состояния реплик: одинаковое поведение хранилищ в памяти,
+Redis (локальный сервер-заглушка по протоколу RESP) и SQLite, атомарность
+compare-and-set между репликами и доставка pub/sub
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from state_backend import InMemoryStateBackend, RedisStateBackend, SqliteStateBackend, StateBackend
+
+
+class FakeRedisServer:
+    """Минимальный сервер RESP: GET/SET PX/DEL, WATCH/MULTI/EXEC, PUBLISH/SUBSCRIBE"""
+
+    def __init__(self):
+        self.values = {}     # key -> (value, expires_at)
+        self.versions = {}   # key -> номер изменения (для WATCH)
+        self.channels = {}   # channel -> set(writer)
+        self.commands = 0
+        self._server = None
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, str):
+            return b'+%s\r\n' % value.encode()
+        if isinstance(value, bytes):
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        return b'*%d\r\n' % len(value) + b''.join(FakeRedisServer._encode(item) for item in value)
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _execute(self, args):
+        command = args[0].upper()
+        if command == b'GET':
+            entry = self.values.get(args[1])
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self.values[args[1]]
+                self._touch(args[1])
+                entry = None
+            return entry[0] if entry else None
+        if command == b'SET':
+            expires_at = None
+            if len(args) == 5 and args[3].upper() == b'PX':
+                expires_at = time.monotonic() + int(args[4]) / 1000
+            self.values[args[1]] = (args[2], expires_at)
+            self._touch(args[1])
+            return 'OK'
+        if command == b'DEL':
+            existed = self.values.pop(args[1], None) is not None
+            self._touch(args[1])
+            return int(existed)
+        if command == b'PUBLISH':
+            writers = self.channels.get(args[1], set())
+            for writer in writers:
+                writer.write(self._encode([b'message', args[1], args[2]]))
+            return len(writers)
+        if command in (b'PING', b'AUTH', b'SELECT'):
+            return 'PONG' if command == b'PING' else 'OK'
+        raise ValueError(command)
+
+    async def _handle(self, reader, writer):
+        watched = {}
+        queued = None
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                self.commands += 1
+                command = args[0].upper()
+                if command == b'WATCH':
+                    watched[args[1]] = self.versions.get(args[1], 0)
+                    out = self._encode('OK')
+                elif command == b'UNWATCH':
+                    watched.clear()
+                    out = self._encode('OK')
+                elif command == b'MULTI':
+                    queued = []
+                    out = self._encode('OK')
+                elif command == b'EXEC':
+                    # Ключ изменили после WATCH - транзакция отменяется (пустой массив)
+                    changed = any(self.versions.get(key, 0) != version for key, version in watched.items())
+                    out = b'*-1\r\n' if changed else self._encode([self._execute(item) for item in queued])
+                    watched.clear()
+                    queued = None
+                elif queued is not None:
+                    queued.append(args)
+                    out = self._encode('QUEUED')
+                elif command == b'SUBSCRIBE':
+                    out = b''
+                    for channel in args[1:]:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        out += self._encode([b'subscribe', channel, 1])
+                else:
+                    out = self._encode(self._execute(args))
+                writer.write(out)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for writers in self.channels.values():
+                writers.discard(writer)
+            writer.close()
+
+
+async def with_replicas(kind, scenario):
+    """Запускает сценарий на двух репликах, разделяющих одно хранилище"""
+    if kind == 'memory':
+        backend = InMemoryStateBackend()
+        await scenario(backend, backend)
+        return
+
+    if kind == 'redis':
+        server = FakeRedisServer()
+        await server.start()
+        url = f'redis://127.0.0.1:{server.port}/0'
+        replicas = [RedisStateBackend(url=url, prefix='test:') for _ in range(2)]
+    else:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'state.sqlite3')
+        replicas = [SqliteStateBackend(path=path, poll_interval=0.01) for _ in range(2)]
+
+    for replica in replicas:
+        await replica.start()
+    try:
+        await scenario(*replicas)
+    finally:
+        for replica in replicas:
+            await replica.close()
+        if kind == 'redis':
+            await server.stop()
+
+
+KINDS = ('memory', 'redis', 'sqlite')
+
+
+def test_values_and_ttl():
+    """get/set/delete и истечение TTL одинаковы во всех хранилищах"""
+
+    async def scenario(a, b):
+        await a.set('user:1', {'state': 2, 'profession': 'Психолог'})
+        assert await b.get('user:1') == {'state': 2, 'profession': 'Психолог'}
+        assert await b.delete('user:1') is True
+        assert await a.get('user:1') is None
+        assert await a.delete('user:1') is False
+
+        await a.set('short', {'v': 1}, ttl=0.05)
+        assert await b.get('short') == {'v': 1}
+        await asyncio.sleep(0.1)
+        assert await b.get('short') is None
+
+    for kind in KINDS:
+        asyncio.run(with_replicas(kind, scenario))
+        print(f"✅ {kind}: значения и TTL")
+
+
+def test_incomplete_backend_is_rejected():
+    """Хранилище без обязательных методов не создается"""
+
+    class NoPublish(StateBackend):
+        async def get(self, key):
+            return None
+
+        async def set(self, key, value, ttl=None):
+            pass
+
+        async def delete(self, key):
+            return False
+
+        async def compare_and_set(self, key, expected, value, ttl=None):
+            return False
+
+    try:
+        NoPublish()
+        assert False, 'ожидалась TypeError'
+    except TypeError as error:
+        assert 'publish' in str(error)
+    print("✅ Неполное хранилище отклоняется при создании")
+
+
+def test_compare_and_set_is_atomic_across_replicas():
+    """Конкурентные инкременты через CAS не теряются, переход выполняет ровно одна реплика"""
+
+    async def scenario(a, b):
+        await a.set('counter', {'n': 0})
+
+        async def increment(backend):
+            while True:
+                current = await backend.get('counter')
+                if await backend.compare_and_set('counter', current, {'n': current['n'] + 1}):
+                    return
+
+        await asyncio.gather(*(increment(a if i % 2 else b) for i in range(40)))
+        assert (await a.get('counter'))['n'] == 40
+
+        # Создание ключа: expected=None - только если ключа нет
+        assert await a.compare_and_set('lock', None, {'owner': 'a'})
+        assert not await b.compare_and_set('lock', None, {'owner': 'b'})
+        # Удаление по ожидаемому значению
+        assert not await b.compare_and_set('lock', {'owner': 'b'}, None)
+        assert await b.compare_and_set('lock', {'owner': 'a'}, None)
+        assert await a.get('lock') is None
+
+        # Ответ N8N пришел на обе реплики одновременно: завершает запрос только один
+        await a.set('n8n:req', {'user_id': 7, 'status': 'pending'})
+        claims = await asyncio.gather(*(
+            (a if i % 2 else b).transition('n8n:req', 'status', 'pending', {'status': 'completed'})
+            for i in range(10)
+        ))
+        assert sum(claim is not None for claim in claims) == 1
+        assert (await b.get('n8n:req'))['status'] == 'completed'
+
+    for kind in KINDS:
+        asyncio.run(with_replicas(kind, scenario))
+        print(f"✅ {kind}: compare-and-set атомарен между репликами")
+
+
+def test_publish_reaches_other_replica():
+    """Сообщение, опубликованное одной репликой, получают подписчики другой"""
+
+    async def scenario(a, b):
+        received = asyncio.Queue()
+
+        async def handler(message):
+            await received.put(message)
+
+        b.subscribe('webhook_response', handler)
+        await asyncio.sleep(0.05)  # Подписка Redis устанавливается в фоне
+
+        await a.publish('webhook_response', {'webhook_id': 'webhook_1', 'user_id': '7', 'status': 'ready'})
+        await a.publish('other_channel', {'ignored': True})
+        message = await asyncio.wait_for(received.get(), timeout=2)
+        assert message == {'webhook_id': 'webhook_1', 'user_id': '7', 'status': 'ready'}
+        await asyncio.sleep(0.05)
+        assert received.empty()
+
+    for kind in KINDS:
+        asyncio.run(with_replicas(kind, scenario))
+        print(f"✅ {kind}: pub/sub доставляет сообщения другой реплике")
+
+
+def test_ready_response_routed_to_replica_running_the_analysis():
+    """Ответ системы, принятый не той репликой, будит шаг на реплике с анализом"""
+    from bot import TargetAudienceBot, CHANNEL_WEBHOOK_RESPONSE
+
+    async def scenario(a, b):
+        replicas = []
+        for backend in (a, b):
+            bot = TargetAudienceBot()
+            bot.state_backend = backend
+            backend.subscribe(CHANNEL_WEBHOOK_RESPONSE, bot._on_shared_webhook_response)
+            replicas.append(bot)
+        owner, other = replicas
+        await asyncio.sleep(0.05)
+
+        service = owner.sequential_webhook_service
+        service.pending_webhooks[7] = {'webhook_responses': {}}
+        waiter = service.completion_registry.register(7, 'webhook_1')
+
+        response = {'webhook_id': 'webhook_1', 'user_id': '7', 'status': 'ready'}
+        assert await other.handle_webhook_response(response) is True
+        result = await asyncio.wait_for(waiter, timeout=2)
+        assert result['status'] == 'ready'
+
+    asyncio.run(with_replicas('redis', scenario))
+    print("✅ Ответ системы доставлен реплике, которая выполняет анализ")
+
+
+def test_session_survives_switching_replicas():
+    """Сообщения одного диалога могут приходить на разные реплики"""
+    from session_store import SessionStore, UserSession
+
+    async def scenario(a, b):
+        store_a = SessionStore(backend=a)
+        store_b = SessionStore(backend=b)
+
+        store_a.set(7, UserSession(state=1))
+        await asyncio.sleep(0.05)  # Запись в хранилище идет фоновой задачей
+
+        session = await store_b.load(7)
+        session.profession = 'Психолог'
+        session.state = 2
+        store_b.save(7, session)
+        await asyncio.sleep(0.05)
+
+        session = await store_a.load(7)
+        assert (session.state, session.profession) == (2, 'Психолог')
+
+        # Устаревшая копия на реплике b не удаляет сессию, уже измененную репликой a
+        stale = store_b.peek(7)
+        session.state = 3
+        store_a.save(7, session)
+        await asyncio.sleep(0.05)
+        store_b.discard(7, stale)
+        await asyncio.sleep(0.05)
+        assert (await store_a.load(7)).state == 3
+
+    asyncio.run(with_replicas('sqlite', scenario))
+    print("✅ Сессия переживает переход между репликами")
+
+
+def test_timeout_after_adopt_does_not_restore_session():
+    """Анализ завершила другая реплика: поздний таймаут N8N не возвращает сессию в хранилище"""
+    from bot import TargetAudienceBot, PROCESSING
+    from session_store import SessionStore, UserSession
+
+    def make_bot(backend):
+        bot = TargetAudienceBot()
+        bot.state_backend = backend
+        bot.n8n_service.state_backend = backend
+        bot.user_sessions = SessionStore(on_evict=bot._on_session_evicted, backend=backend)
+        return bot
+
+    async def scenario(a, b):
+        bot_a, bot_b = make_bot(a), make_bot(b)
+
+        # Реплика a приняла ответы и отправила запрос в N8N
+        session = UserSession(state=PROCESSING, profession='p', segmentation='s', ideal_client='c')
+        bot_a.user_sessions.set(7, session)
+        bot_a.n8n_service.pending_requests.put('req_1', {'user_id': 7, 'status': 'pending'})
+        await a.set('n8n:req_1', {'user_id': 7, 'status': 'pending'})
+        bot_a._bind_n8n_request(7, session, 'req_1')
+        bot_a.user_sessions.save(7, session)
+        await asyncio.sleep(0.05)
+
+        # Ответ N8N пришел на реплику b: она выполняет анализ и завершает сессию
+        finished = asyncio.Event()
+
+        async def pipeline(user_id, spreadsheet_info, session):
+            bot_b._end_session(user_id, session)
+            finished.set()
+
+        bot_b._start_sequential_webhooks = pipeline
+        assert await bot_b.handle_n8n_webhook({
+            'request_id': 'req_1', 'spreadsheet_id': 'id', 'spreadsheet_url': 'url', 'sheet_title': 't'
+        }) is True
+        await asyncio.wait_for(finished.wait(), timeout=2)
+        await asyncio.sleep(0.05)
+        assert await a.get('session:7') is None
+
+        # На реплике a срабатывает дедлайн N8N: запрос уже обработан, сессия не пишется обратно
+        await bot_a._n8n_timeout_handler(7, 'req_1')
+        await asyncio.sleep(0.05)
+        assert await a.get('session:7') is None
+        assert bot_a.user_sessions.peek(7) is None
+        assert 'req_1' not in bot_a.n8n_request_index
+
+        # Устаревшая копия, сохраняемая после завершения сессии, тоже не воскрешает ее
+        stale = UserSession(state=PROCESSING)
+        bot_b.user_sessions.set(8, stale)
+        await asyncio.sleep(0.05)
+        current = await bot_a.user_sessions.load(8)
+        bot_a._end_session(8, current)
+        await asyncio.sleep(0.05)
+        stale.profession = 'p'
+        bot_b.user_sessions.save(8, stale)
+        await asyncio.sleep(0.05)
+        assert await b.get('session:8') is None
+        assert bot_b.user_sessions.peek(8) is None
+        assert bot_b.user_sessions.get_stats()['stale_saves'] == 1
+
+        await bot_a.job_runner.stop()
+        await bot_b.job_runner.stop()
+
+    asyncio.run(with_replicas('sqlite', scenario))
+    print("✅ Поздний таймаут N8N не восстанавливает завершенную сессию")
+
+
+if __name__ == '__main__':
+    test_values_and_ttl()
+    test_incomplete_backend_is_rejected()
+    test_compare_and_set_is_atomic_across_replicas()
+    test_publish_reaches_other_replica()
+    test_ready_response_routed_to_replica_running_the_analysis()
+    test_session_survives_switching_replicas()
+    test_timeout_after_adopt_does_not_restore_session()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика систем: лимит одновременных запросов и честная очередь
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from target_scheduler import TargetConcurrencyScheduler
+
+
+def test_limit_and_round_robin_between_users():
+    """Слоты выдаются пользователям по кругу, лимит не превышается"""
+
+    async def run():
+        scheduler = TargetConcurrencyScheduler(default_limit=1, limits={})
+        order = []
+        positions = {}
+        max_active = 0
+
+        async def request(user, n):
+            nonlocal max_active
+
+            async def on_queued(position):
+                positions[(user, n)] = position
+
+            async with scheduler.slot('webhook_1', user, on_queued=on_queued):
+                max_active = max(max_active, scheduler.get_stats()['webhook_1']['active'])
+                order.append((user, n))
+                await asyncio.sleep(0.01)
+
+        # Пользователь A приходит первым с тремя запросами, затем B и C
+        tasks = [asyncio.create_task(request('A', n)) for n in range(3)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(request('B', 0)), asyncio.create_task(request('C', 0))]
+        await asyncio.gather(*tasks)
+
+        print(f"Порядок: {order}, позиции: {positions}")
+        assert max_active == 1
+        assert order == [('A', 0), ('A', 1), ('B', 0), ('C', 0), ('A', 2)]
+        assert positions[('B', 0)] == 2
+        assert positions[('C', 0)] == 3
+        assert scheduler.get_stats()['webhook_1']['queued'] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_queue():
+    """Отмененный запрос уходит из очереди и не занимает слот"""
+
+    async def run():
+        scheduler = TargetConcurrencyScheduler(default_limit=1, limits={})
+        await scheduler.acquire('webhook_2', 'A')
+
+        waiting = asyncio.create_task(scheduler.acquire('webhook_2', 'B'))
+        await asyncio.sleep(0)
+        assert scheduler.get_queue_position('webhook_2', 'B') == 1
+
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        scheduler.release('webhook_2')
+
+        stats = scheduler.get_stats()['webhook_2']
+        assert stats['active'] == 0
+        assert stats['queued'] == 0
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_limit_and_round_robin_between_users()
+    test_cancelled_waiter_leaves_queue()
+    print("🎉 Все тесты пройдены успешно!")
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика исходящих запросов к Telegram: лимиты, приоритеты,
+ограниченные очереди и повторы после RetryAfter
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from telegram.error import RetryAfter
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from telegram_rate_limiter import (
+    TelegramRateLimiter, TelegramQueueFull, PRIORITY_INTERACTIVE, PRIORITY_PROGRESS
+)
+
+
+async def send(limiter, chat_id, log, label=None, priority=None, endpoint='sendMessage'):
+    """Запрос через limiter так же, как его делает ExtBot"""
+    async def callback():
+        log.append(label if label is not None else chat_id)
+        return True
+    return await limiter.process_request(
+        callback, (), {}, endpoint, {'chat_id': chat_id},
+        {'priority': priority} if priority is not None else None
+    )
+
+
+def test_global_rate_is_enforced():
+    """150 сообщений в разные чаты при лимите 100/с занимают не меньше 0.5 с"""
+
+    async def run():
+        limiter = TelegramRateLimiter(global_rate=100, chat_rate=1, chat_burst=1)
+        log = []
+        started = time.perf_counter()
+        await asyncio.gather(*(send(limiter, chat_id, log) for chat_id in range(1, 151)))
+        elapsed = time.perf_counter() - started
+        await limiter.shutdown()
+
+        print(f"150 запросов за {elapsed:.2f} сек")
+        assert len(log) == 150
+        assert elapsed >= 0.45
+
+    asyncio.run(run())
+
+
+def test_chat_limit_does_not_block_other_chats():
+    """Очередь одного чата не задерживает другие чаты"""
+
+    async def run():
+        limiter = TelegramRateLimiter(global_rate=1000, chat_rate=20, chat_burst=1)
+        log = []
+        busy = [asyncio.create_task(send(limiter, 1, log)) for _ in range(10)]
+        await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        await send(limiter, 2, log)
+        other_chat = time.perf_counter() - started
+
+        await asyncio.gather(*busy)
+        busy_chat = time.perf_counter() - started
+        await limiter.shutdown()
+
+        print(f"Другой чат: {other_chat * 1000:.1f} мс, 10 сообщений в один чат: {busy_chat:.2f} сек")
+        assert other_chat < 0.1
+        assert busy_chat >= 0.4
+
+    asyncio.run(run())
+
+
+def test_interactive_goes_before_progress():
+    """Ответ пользователю обгоняет накопившиеся обновления прогресса"""
+
+    async def run():
+        limiter = TelegramRateLimiter(global_rate=20, chat_rate=1000, chat_burst=1000)
+        log = []
+        # Исчерпываем глобальную корзину
+        await asyncio.gather(*(send(limiter, 100 + i, [], priority=PRIORITY_PROGRESS) for i in range(20)))
+
+        progress = [asyncio.create_task(send(limiter, i, log, f'progress_{i}', PRIORITY_PROGRESS, 'editMessageText'))
+                    for i in range(5)]
+        await asyncio.sleep(0)
+        reply = asyncio.create_task(send(limiter, 42, log, 'reply', PRIORITY_INTERACTIVE))
+        await asyncio.gather(reply, *progress)
+        await limiter.shutdown()
+
+        print(f"Порядок: {log}")
+        assert log.index('reply') <= 1
+        stats = limiter.get_stats()['queues']
+        assert stats['interactive']['granted'] == 1
+        assert stats['progress']['granted'] == 25
+
+    asyncio.run(run())
+
+
+def test_retry_after_is_bounded():
+    """RetryAfter повторяется не больше max_retries раз"""
+
+    async def run():
+        limiter = TelegramRateLimiter(max_retries=2)
+        calls = 0
+
+        async def callback():
+            nonlocal calls
+            calls += 1
+            raise RetryAfter(0)
+
+        try:
+            await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 1}, None)
+            raise AssertionError("RetryAfter должен быть проброшен")
+        except RetryAfter:
+            pass
+        await limiter.shutdown()
+
+        assert calls == 3
+        assert limiter.get_stats()['retry_after_total'] == 3
+
+    asyncio.run(run())
+
+
+def test_queue_is_bounded():
+    """Переполненная очередь приоритета отклоняет новые запросы"""
+
+    async def run():
+        limiter = TelegramRateLimiter(queue_max=2)
+        limiter._pause(10)  # Имитируем паузу после RetryAfter
+        waiting = [asyncio.create_task(limiter.acquire(1, PRIORITY_PROGRESS)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        try:
+            await limiter.acquire(1, PRIORITY_PROGRESS)
+            raise AssertionError("Ожидалось TelegramQueueFull")
+        except TelegramQueueFull:
+            pass
+        # Другие приоритеты не затронуты
+        assert limiter.get_stats()['queues']['interactive']['depth'] == 0
+        assert limiter.get_stats()['queues']['progress']['rejected'] == 1
+
+        await limiter.shutdown()
+        await asyncio.gather(*waiting, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_global_rate_is_enforced()
+    test_chat_limit_does_not_block_other_chats()
+    test_interactive_goes_before_progress()
+    test_retry_after_is_bounded()
+    test_queue_is_bounded()
+    print("✅ Все тесты пройдены")
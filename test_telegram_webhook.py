@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Тест режима webhook для Telegram: проверка секрета, постановка одного
+обновления и массива обновлений в очередь Application
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp.test_utils import TestClient, TestServer
+from telegram.ext import ApplicationBuilder
+
+import config
+from telegram_webhook import SECRET_HEADER, TelegramUpdateIngress
+from webhook_server import WebhookServer
+
+SECRET = 'test_secret-token'
+
+
+def make_update(update_id, text='привет'):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 1700000000,
+            'chat': {'id': 7, 'type': 'private'},
+            'from': {'id': 7, 'is_bot': False, 'first_name': 'Тест'},
+            'text': text
+        }
+    }
+
+
+async def start_client(ingress):
+    server = WebhookServer(SimpleNamespace(telegram_ingress=ingress))
+    client = TestClient(TestServer(server.app))
+    await client.start_server()
+    return client
+
+
+def make_application():
+    # Без initialize: сеть не нужна, обновления только ставятся в очередь
+    return ApplicationBuilder().token('123456:TEST').updater(None).build()
+
+
+def test_secret_token_is_required():
+    """Запрос без секрета или с чужим секретом отклоняется и не попадает в очередь"""
+
+    async def run():
+        application = make_application()
+        ingress = TelegramUpdateIngress(application, secret_token=SECRET)
+        client = await start_client(ingress)
+        try:
+            response = await client.post(config.TELEGRAM_WEBHOOK_PATH, json=make_update(1))
+            assert response.status == 403
+            response = await client.post(config.TELEGRAM_WEBHOOK_PATH, json=make_update(1),
+                                         headers={SECRET_HEADER: 'wrong'})
+            assert response.status == 403
+            assert application.update_queue.qsize() == 0
+            assert ingress.get_stats()['rejected_requests'] == 2
+
+            response = await client.post(config.TELEGRAM_WEBHOOK_PATH, json=make_update(1),
+                                         headers={SECRET_HEADER: SECRET})
+            assert response.status == 200
+            update = application.update_queue.get_nowait()
+            assert update.update_id == 1
+            assert update.message.text == 'привет'
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    print("✅ Секрет webhook'а проверяется")
+
+
+def test_unconfigured_secret_rejects_everything():
+    """Без секрета в конфигурации обновления не принимаются"""
+
+    async def run():
+        application = make_application()
+        ingress = TelegramUpdateIngress(application, secret_token='')
+        client = await start_client(ingress)
+        try:
+            for headers in ({}, {SECRET_HEADER: ''}, {SECRET_HEADER: 'anything'}):
+                response = await client.post(config.TELEGRAM_WEBHOOK_PATH, json=make_update(1), headers=headers)
+                assert response.status == 403
+            assert application.update_queue.qsize() == 0
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    print("✅ Без секрета обновления отклоняются")
+
+
+def test_batch_is_queued_at_once():
+    """Массив обновлений попадает в очередь целиком, некорректные элементы пропускаются"""
+
+    async def run():
+        application = make_application()
+        ingress = TelegramUpdateIngress(application, secret_token=SECRET)
+        client = await start_client(ingress)
+        try:
+            batch = [make_update(i, f'сообщение {i}') for i in range(10, 15)] + ['мусор']
+            response = await client.post(config.TELEGRAM_WEBHOOK_PATH, json=batch,
+                                         headers={SECRET_HEADER: SECRET})
+            assert response.status == 200
+            assert (await response.json())['accepted'] == 5
+
+            queued = [application.update_queue.get_nowait().update_id for _ in range(5)]
+            assert queued == [10, 11, 12, 13, 14]
+            stats = ingress.get_stats()
+            assert stats['max_batch'] == 5
+            assert stats['invalid_updates'] == 1
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    print("✅ Пакет обновлений поставлен в очередь")
+
+
+def test_route_disabled_in_polling_mode():
+    """В режиме polling маршрут обновлений не принимает запросы"""
+
+    async def run():
+        client = await start_client(None)
+        try:
+            response = await client.post(config.TELEGRAM_WEBHOOK_PATH, json=make_update(1))
+            assert response.status == 404
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    print("✅ В режиме polling маршрут выключен")
+
+
+if __name__ == '__main__':
+    test_secret_token_is_required()
+    test_unconfigured_secret_rejects_everything()
+    test_batch_is_queued_at_once()
+    test_route_disabled_in_polling_mode()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Тест режима вкладок: первый анализ пользователя создает его таблицу,
+следующие добавляются вкладками одним batchUpdate, id таблицы сохраняется
+между перезапусками, удаленная таблица заменяется новой
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from google_minimal_service import GoogleMinimalService, SHEETS_MODE_USER_TABS
+from test_google_sheets_async import FakeCredentials, FakeSheetsApi, USER_DATA
+from user_spreadsheets import UserSpreadsheetIndex
+
+
+def make_service(api, path):
+    service = GoogleMinimalService(credentials=FakeCredentials(), base_url=api.url, mode=SHEETS_MODE_USER_TABS)
+    service.user_index = UserSpreadsheetIndex(path)
+    return service
+
+
+def test_repeat_analysis_adds_tab():
+    """Повторный анализ - новая вкладка в той же таблице, без create"""
+    path = os.path.join(tempfile.mkdtemp(), 'user_spreadsheets.json')
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        service = make_service(api, path)
+        try:
+            first_id, first_tab = await service.create_spreadsheet_async(USER_DATA, user_id=7)
+            assert api.calls == ['create']
+            assert first_tab.startswith('1. [')
+            assert api.spreadsheets[first_id]['properties']['title'] == 'Анализы ЦА – пользователь 7'
+            assert api.spreadsheets[first_id]['sheets'][0]['properties']['title'] == first_tab
+
+            api.calls.clear()
+            second_id, second_tab = await service.create_spreadsheet_async(USER_DATA, user_id=7)
+            assert second_id == first_id
+            assert second_tab.startswith('2. [') and second_tab != first_tab
+            assert api.calls == ['batchUpdate']
+            requests = api.spreadsheets[first_id]['requests']
+            added = requests[0]['addSheet']['properties']
+            assert added['title'] == second_tab
+            assert requests[1]['updateCells']['start']['sheetId'] == added['sheetId']
+
+            # Другой пользователь получает свою таблицу
+            other_id, _ = await service.create_spreadsheet_async(USER_DATA, user_id=8)
+            assert other_id != first_id
+        finally:
+            await service.close()
+
+        # После перезапуска таблица пользователя известна из файла
+        restarted = make_service(api, path)
+        try:
+            api.calls.clear()
+            third_id, third_tab = await restarted.create_spreadsheet_async(USER_DATA, user_id=7)
+            assert third_id == first_id and third_tab.startswith('3. [')
+            assert api.calls == ['batchUpdate']
+        finally:
+            await restarted.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Повторный анализ добавлен вкладкой")
+
+
+def test_deleted_spreadsheet_is_replaced():
+    """Если таблицу пользователя удалили, создается новая и запоминается"""
+    path = os.path.join(tempfile.mkdtemp(), 'user_spreadsheets.json')
+
+    async def run():
+        api = FakeSheetsApi()
+        await api.start()
+        service = make_service(api, path)
+        try:
+            old_id, _ = await service.create_spreadsheet_async(USER_DATA, user_id=7)
+            del api.spreadsheets[old_id]
+
+            api.calls.clear()
+            new_id, tab_title = await service.create_spreadsheet_async(USER_DATA, user_id=7)
+            assert new_id != old_id
+            assert api.calls == ['batchUpdate', 'create']
+            assert tab_title.startswith('1. [')
+            assert service.user_index.get(7) == new_id
+        finally:
+            await service.close()
+            await api.stop()
+
+    asyncio.run(run())
+    print("✅ Удаленная таблица пользователя заменена новой")
+
+
+if __name__ == '__main__':
+    test_repeat_analysis_adds_tab()
+    test_deleted_spreadsheet_is_replaced()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Тест графа зависимостей webhook'ов и параллельной отправки по нему
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from webhook_graph import build_dependency_graph, descendants
+from sequential_webhook_service import SequentialWebhookService
+
+NAMES = [f'webhook_{i}' for i in range(1, 10)]
+STEP_SECONDS = 0.05
+
+
+def test_default_is_sequential_chain():
+    """По умолчанию граф - прежняя строгая цепочка"""
+    graph = build_dependency_graph(NAMES)
+    assert graph['webhook_1'] == []
+    assert graph['webhook_5'] == ['webhook_4']
+    assert descendants(graph, 'webhook_3') == set(NAMES[3:])
+
+
+def test_explicit_graph_and_cycle_detection():
+    """Явный граф разбирается, циклы отклоняются"""
+    graph = build_dependency_graph(NAMES, 'webhook_2:webhook_1;webhook_3:webhook_1,webhook_2;webhook_4:webhook_10')
+    assert graph['webhook_3'] == ['webhook_1', 'webhook_2']
+    assert graph['webhook_4'] == []  # Ненастроенная зависимость пропущена
+    assert graph['webhook_9'] == []
+
+    try:
+        build_dependency_graph(NAMES, 'webhook_1:webhook_3;webhook_3:webhook_2;webhook_2:webhook_1')
+    except ValueError as e:
+        print(f"Цикл обнаружен: {e}")
+    else:
+        raise AssertionError('Цикл не обнаружен')
+
+
+def make_service(dependencies, failing=()):
+    service = SequentialWebhookService()
+    service.webhooks = {name: f'http://example.invalid/{name}' for name in NAMES}
+    service.dependencies = build_dependency_graph(NAMES, dependencies)
+    service.step_pause_seconds = 0
+    sent = []
+
+    async def fake_send(webhook_name, webhook_url, payload, user_id, ready_timeout=None, idempotency_key=None):
+        sent.append(webhook_name)
+        await asyncio.sleep(STEP_SECONDS)
+        return webhook_name not in failing
+
+    service._send_webhook_and_wait = fake_send
+    return service, sent
+
+
+async def run_service(service):
+    async def progress_callback(message):
+        pass
+
+    started = time.perf_counter()
+    results = await service.send_webhooks_sequentially(1, {}, {}, progress_callback)
+    return results, time.perf_counter() - started
+
+
+def test_independent_branches_run_concurrently():
+    """Независимые webhook'и идут параллельно, неудача останавливает только свою ветку"""
+    # webhook_1 -> (webhook_2..webhook_5); webhook_6 -> webhook_7; webhook_8, webhook_9 независимы
+    dependencies = ('webhook_2:webhook_1;webhook_3:webhook_1;webhook_4:webhook_1;webhook_5:webhook_1;'
+                    'webhook_7:webhook_6')
+
+    async def run():
+        chain_service, _ = make_service('chain')
+        dag_service, _ = make_service(dependencies)
+        _, chain_time = await run_service(chain_service)
+        results, dag_time = await run_service(dag_service)
+        print(f"Цепочка: {chain_time:.2f}s, граф: {dag_time:.2f}s")
+
+        assert all(results.values())
+        assert list(results) == NAMES
+        assert dag_time * 2.5 < chain_time
+
+        failing_service, sent = make_service(dependencies, failing={'webhook_6'})
+        results, _ = await run_service(failing_service)
+        assert results['webhook_6'] is False
+        assert results['webhook_7'] is False and 'webhook_7' not in sent
+        assert all(results[name] for name in NAMES if name not in ('webhook_6', 'webhook_7'))
+
+    asyncio.run(run())
+
+
+def test_chain_stops_on_first_failure():
+    """В режиме цепочки неудача останавливает все последующие системы"""
+
+    async def run():
+        service, sent = make_service('chain', failing={'webhook_3'})
+        results, _ = await run_service(service)
+        assert sent == ['webhook_1', 'webhook_2', 'webhook_3']
+        assert [name for name, ok in results.items() if ok] == ['webhook_1', 'webhook_2']
+        assert len(results) == 9
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    test_default_is_sequential_chain()
+    test_explicit_graph_and_cycle_detection()
+    test_independent_branches_run_concurrently()
+    test_chain_stops_on_first_failure()
+    print("🎉 Все тесты пройдены успешно!")
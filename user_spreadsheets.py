@@ -0,0 +1,74 @@
+"""Таблица анализов каждого пользователя (режим вкладок), сохраняется в файл"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class UserSpreadsheetIndex:
+    """
+    user_id -> {'spreadsheet_id', 'tabs', 'updated_at'}
+
+    Файл JSON перезаписывается атомарно при каждом изменении: изменения
+    редкие (одно на анализ), а потеря записи означала бы лишнюю таблицу.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = config.SHEETS_USER_INDEX_PATH if path is None else path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def get(self, user_id) -> Optional[str]:
+        """ID таблицы пользователя или None"""
+        entry = self._entries.get(str(user_id))
+        return entry['spreadsheet_id'] if entry else None
+
+    def tab_count(self, user_id) -> int:
+        """Сколько вкладок анализов уже в таблице пользователя"""
+        entry = self._entries.get(str(user_id))
+        return entry['tabs'] if entry else 0
+
+    def set(self, user_id, spreadsheet_id: str):
+        self._entries[str(user_id)] = {'spreadsheet_id': spreadsheet_id, 'tabs': 1, 'updated_at': time.time()}
+        self._save()
+
+    def tab_added(self, user_id):
+        entry = self._entries.get(str(user_id))
+        if entry is not None:
+            entry['tabs'] += 1
+            entry['updated_at'] = time.time()
+            self._save()
+
+    def remove(self, user_id):
+        if self._entries.pop(str(user_id), None) is not None:
+            self._save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось загрузить таблицы пользователей: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить таблицы пользователей: {e}")
@@ -0,0 +1,99 @@
+"""Граф зависимостей между webhook'ами (какие системы ждут ответа других)"""
+import logging
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Специальные значения WEBHOOK_DEPENDENCIES
+CHAIN = 'chain'        # Строгая цепочка webhook_1 -> webhook_2 -> ... (по умолчанию)
+PARALLEL = 'parallel'  # Все webhook'и независимы
+
+
+def parse_dependencies(spec: str) -> Dict[str, List[str]]:
+    """
+    Разбирает описание зависимостей
+
+    Формат: "webhook_2:webhook_1;webhook_4:webhook_2,webhook_3"
+    (webhook_2 ждет webhook_1, webhook_4 ждет webhook_2 и webhook_3)
+    """
+    dependencies: Dict[str, List[str]] = {}
+    for item in spec.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        if ':' not in item:
+            raise ValueError(f"Некорректная зависимость '{item}', ожидается 'webhook:dep1,dep2'")
+        name, _, deps = item.partition(':')
+        dependencies.setdefault(name.strip(), []).extend(d.strip() for d in deps.split(',') if d.strip())
+    return dependencies
+
+
+def build_dependency_graph(webhook_names: List[str], spec: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    Строит граф {webhook: [зависимости]} для настроенных webhook'ов
+
+    Пустое значение или 'chain' дает прежнюю строгую цепочку в порядке конфигурации.
+    Зависимости от ненастроенных webhook'ов игнорируются. Цикл - ValueError.
+    """
+    spec = (spec or CHAIN).strip()
+
+    if spec.lower() == CHAIN:
+        return {name: ([webhook_names[i - 1]] if i else []) for i, name in enumerate(webhook_names)}
+    if spec.lower() == PARALLEL:
+        return {name: [] for name in webhook_names}
+
+    configured = set(webhook_names)
+    graph: Dict[str, List[str]] = {name: [] for name in webhook_names}
+    for name, deps in parse_dependencies(spec).items():
+        if name not in configured:
+            logger.warning(f"⚠️ Зависимости для ненастроенного webhook'а {name} пропущены")
+            continue
+        for dep in deps:
+            if dep not in configured:
+                logger.warning(f"⚠️ {name}: зависимость от ненастроенного webhook'а {dep} пропущена")
+            elif dep == name:
+                raise ValueError(f"Webhook {name} не может зависеть сам от себя")
+            elif dep not in graph[name]:
+                graph[name].append(dep)
+
+    topological_order(graph)  # Проверка на циклы
+    return graph
+
+
+def topological_order(graph: Dict[str, List[str]]) -> List[str]:
+    """Порядок, в котором зависимости идут раньше зависящих; цикл - ValueError"""
+    order: List[str] = []
+    state: Dict[str, int] = {}  # 1 - в обработке, 2 - готово
+
+    def visit(name: str, path: List[str]):
+        if state.get(name) == 2:
+            return
+        if state.get(name) == 1:
+            cycle = path[path.index(name):] + [name]
+            raise ValueError(f"Цикл в зависимостях webhook'ов: {' -> '.join(cycle)}")
+        state[name] = 1
+        for dep in graph[name]:
+            visit(dep, path + [name])
+        state[name] = 2
+        order.append(name)
+
+    for name in graph:
+        visit(name, [])
+    return order
+
+
+def descendants(graph: Dict[str, List[str]], name: str) -> Set[str]:
+    """Все webhook'и, которые прямо или косвенно зависят от name"""
+    dependents: Dict[str, List[str]] = {}
+    for node, deps in graph.items():
+        for dep in deps:
+            dependents.setdefault(dep, []).append(node)
+
+    result: Set[str] = set()
+    stack = list(dependents.get(name, []))
+    while stack:
+        node = stack.pop()
+        if node not in result:
+            result.add(node)
+            stack.extend(dependents.get(node, []))
+    return result
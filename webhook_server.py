@@ -1,207 +1,234 @@
-"""Flask сервер для приема входящих webhook'ов"""
-from flask import Flask, request, jsonify
+"""aiohttp сервер для приема входящих webhook'ов в event loop бота"""
+from aiohttp import web
+import json
 import logging
 import asyncio
-import threading
-import concurrent.futures
-from typing import Optional
+import config
 
 logger = logging.getLogger(__name__)
 
 class WebhookServer:
     def __init__(self, bot_instance, host='0.0.0.0', port=8080):
         self.bot = bot_instance
-        self.app = Flask(__name__)
+        self.app = web.Application()
         self.host = host
         self.port = port
+        self._runner = None
         self.setup_routes()
-        
+
     def setup_routes(self):
         """Настройка маршрутов для webhook'ов"""
-        
-        @self.app.route('/webhook/n8n/spreadsheet', methods=['POST'])
-        def handle_n8n_spreadsheet():
-            """Обрабатывает входящий webhook от N8N с информацией о таблице"""
-            try:
-                data = request.get_json()
-                if not data:
-                    return jsonify({'error': 'No JSON data provided'}), 400
-                
-                logger.info(f"📨 Получен N8N webhook: {data}")
-                
-                # Детальное логирование полученных данных
-                logger.info(f"🔍 N8N webhook детали:")
-                logger.info(f"  - request_id: {data.get('request_id', 'НЕ УКАЗАН')}")
-                logger.info(f"  - status: {data.get('status', 'НЕ УКАЗАН')}")
-                logger.info(f"  - spreadsheet_id: {data.get('spreadsheet_id', 'НЕ УКАЗАН')}")
-                logger.info(f"  - spreadsheet_url: {data.get('spreadsheet_url', 'НЕ УКАЗАН')}")
-                logger.info(f"  - sheet_title: {data.get('sheet_title', 'НЕ УКАЗАН')}")
-                logger.info(f"  - error_message: {data.get('error_message', 'НЕТ')}")
-                
-                # Запускаем обработку в asyncio
-                try:
-                    # Пытаемся получить текущий loop
-                    loop = asyncio.get_running_loop()
-                    # Используем run_coroutine_threadsafe для безопасного выполнения
-                    future = asyncio.run_coroutine_threadsafe(self.bot.handle_n8n_webhook(data), loop)
-                    success = future.result(timeout=10)
-                except RuntimeError:
-                    # Если нет активного loop, создаем новый
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    success = loop.run_until_complete(self.bot.handle_n8n_webhook(data))
-                    loop.close()
-                
-                if success:
-                    return jsonify({'status': 'success', 'message': 'N8N webhook processed'}), 200
-                else:
-                    return jsonify({'status': 'error', 'message': 'Failed to process N8N webhook'}), 500
-                    
-            except Exception as e:
-                logger.error(f"❌ Ошибка обработки N8N webhook: {e}")
-                return jsonify({'error': str(e)}), 500
-        
-        @self.app.route('/webhook/system/response', methods=['POST'])
-        def handle_system_response():
-            """Обрабатывает ответы от систем (ready статус)"""
-            try:
-                data = request.get_json()
-                if not data:
-                    return jsonify({'error': 'No JSON data provided'}), 400
-                
-                logger.info(f"📨 Получен ответ от системы: {data}")
-                
-                # Запускаем обработку в asyncio
-                try:
-                    # Пытаемся получить текущий loop
-                    loop = asyncio.get_running_loop()
-                    # Используем run_coroutine_threadsafe для безопасного выполнения
-                    future = asyncio.run_coroutine_threadsafe(self.bot.handle_webhook_response(data), loop)
-                    success = future.result(timeout=10)
-                except RuntimeError:
-                    # Если нет активного loop, создаем новый
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    success = loop.run_until_complete(self.bot.handle_webhook_response(data))
-                    loop.close()
-                
-                if success:
-                    return jsonify({'status': 'success', 'message': 'System response processed'}), 200
-                else:
-                    return jsonify({'status': 'error', 'message': 'Failed to process system response'}), 500
-                    
-            except Exception as e:
-                logger.error(f"❌ Ошибка обработки ответа системы: {e}")
-                return jsonify({'error': str(e)}), 500
-        
-        @self.app.route('/health', methods=['GET'])
-        def health_check():
-            """Проверка здоровья сервера"""
-            return jsonify({
-                'status': 'healthy',
-                'bot_running': True,
-                'endpoints': [
-                    '/webhook/n8n/spreadsheet',
-                    '/webhook/system/response',
-                    '/health'
-                ]
-            }), 200
-        
-        @self.app.route('/', methods=['GET'])
-        def root():
-            """Корневой маршрут"""
-            return jsonify({
-                'service': 'Telegram Bot Webhook Server',
-                'version': '1.0',
-                'endpoints': {
-                    'n8n_spreadsheet': '/webhook/n8n/spreadsheet',
-                    'system_response': '/webhook/system/response', 
-                    'health': '/health'
-                }
-            }), 200
-    
-    def start_server(self):
-        """Запускает Flask сервер в отдельном потоке"""
-        def run_server():
-            logger.info(f"🚀 Запуск webhook сервера на {self.host}:{self.port}")
-            self.app.run(
-                host=self.host,
-                port=self.port,
-                debug=False,
-                use_reloader=False,
-                threaded=True
-            )
-        
-        # Запускаем сервер в отдельном потоке
-        server_thread = threading.Thread(target=run_server, daemon=True)
-        server_thread.start()
-        logger.info(f"✅ Webhook сервер запущен в фоновом потоке")
-        
-        return server_thread
+        self.app.router.add_post('/webhook/n8n/spreadsheet', self.handle_n8n_spreadsheet)
+        self.app.router.add_post('/webhook/system/response', self.handle_system_response)
+        self.app.router.add_post(config.TELEGRAM_WEBHOOK_PATH, self.handle_telegram_update)
+        self.app.router.add_get('/health', self.health_check)
+        self.app.router.add_get('/', self.root)
+
+    @staticmethod
+    async def _read_json(request: web.Request):
+        """Читает JSON из тела запроса, None если данных нет или они некорректны"""
+        try:
+            return await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+
+    async def handle_n8n_spreadsheet(self, request: web.Request) -> web.Response:
+        """Обрабатывает входящий webhook от N8N с информацией о таблице"""
+        try:
+            data = await self._read_json(request)
+            if not data:
+                return web.json_response({'error': 'No JSON data provided'}, status=400)
+
+            logger.info(f"📨 Получен N8N webhook: {data}")
+
+            # Детальное логирование полученных данных
+            logger.info(f"🔍 N8N webhook детали:")
+            logger.info(f"  - request_id: {data.get('request_id', 'НЕ УКАЗАН')}")
+            logger.info(f"  - status: {data.get('status', 'НЕ УКАЗАН')}")
+            logger.info(f"  - spreadsheet_id: {data.get('spreadsheet_id', 'НЕ УКАЗАН')}")
+            logger.info(f"  - spreadsheet_url: {data.get('spreadsheet_url', 'НЕ УКАЗАН')}")
+            logger.info(f"  - sheet_title: {data.get('sheet_title', 'НЕ УКАЗАН')}")
+            logger.info(f"  - error_message: {data.get('error_message', 'НЕТ')}")
+
+            # Обработчик выполняется прямо в event loop бота
+            success = await self.bot.handle_n8n_webhook(data)
+
+            if success:
+                return web.json_response({'status': 'success', 'message': 'N8N webhook processed'})
+            else:
+                return web.json_response({'status': 'error', 'message': 'Failed to process N8N webhook'}, status=500)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки N8N webhook: {e}")
+            return web.json_response({'error': str(e)}, status=500)
+
+    async def handle_system_response(self, request: web.Request) -> web.Response:
+        """Обрабатывает ответы от систем (ready статус)"""
+        try:
+            data = await self._read_json(request)
+            if not data:
+                return web.json_response({'error': 'No JSON data provided'}, status=400)
+
+            logger.info(f"📨 Получен ответ от системы: {data}")
+
+            success = await self.bot.handle_webhook_response(data)
+
+            if success:
+                return web.json_response({'status': 'success', 'message': 'System response processed'})
+            else:
+                return web.json_response({'status': 'error', 'message': 'Failed to process system response'}, status=500)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки ответа системы: {e}")
+            return web.json_response({'error': str(e)}, status=500)
+
+    async def handle_telegram_update(self, request: web.Request) -> web.Response:
+        """Принимает обновления Telegram (режим TELEGRAM_MODE=webhook)"""
+        ingress = getattr(self.bot, 'telegram_ingress', None)
+        if ingress is None:
+            return web.json_response({'error': 'Telegram webhook mode is disabled'}, status=404)
+
+        if not ingress.verify(request.headers):
+            logger.warning(f"⛔ Обновление Telegram с неверным секретом от {request.remote}")
+            return web.json_response({'error': 'Invalid secret token'}, status=403)
+
+        data = await self._read_json(request)
+        if not data:
+            return web.json_response({'error': 'No JSON data provided'}, status=400)
+
+        # Обновления только ставятся в очередь Application: Telegram получает ответ сразу
+        accepted = await ingress.feed(data)
+        return web.json_response({'status': 'success', 'accepted': accepted})
+
+    async def health_check(self, request: web.Request) -> web.Response:
+        """Проверка здоровья сервера"""
+        sequential_service = self.bot.sequential_webhook_service
+        return web.json_response({
+            'status': 'healthy',
+            'bot_running': True,
+            'webhook_waiters': {
+                'total': sequential_service.get_waiters_count(),
+                'by_webhook': sequential_service.completion_registry.get_waiters_by_webhook()
+            },
+            'deadlines': sequential_service.deadline_scheduler.get_stats(),
+            'targets': sequential_service.target_scheduler.get_stats(),
+            'latency': sequential_service.latency_tracker.get_stats(),
+            'circuits': sequential_service.circuit_breakers.get_stats(),
+            'retries': sequential_service.retry_policy.get_stats(),
+            'telegram': self.bot.rate_limiter.get_stats() if hasattr(self.bot, 'rate_limiter') else None,
+            'pipelines': self.bot.job_runner.get_stats() if hasattr(self.bot, 'job_runner') else None,
+            'sessions': self.bot.user_sessions.get_stats() if hasattr(self.bot, 'user_sessions') else None,
+            'state': self.bot.state_backend.get_stats() if hasattr(self.bot, 'state_backend') else None,
+            'sheets_pool': self.bot.google_service.pool.get_stats() if getattr(getattr(self.bot, 'google_service', None), 'pool', None) else None,
+            'master_sheet': self.bot.google_service.master_writer.get_stats() if getattr(getattr(self.bot, 'google_service', None), 'master_writer', None) else None,
+            'telegram_webhook': self.bot.telegram_ingress.get_stats() if getattr(self.bot, 'telegram_ingress', None) else None,
+            'endpoints': [
+                '/webhook/n8n/spreadsheet',
+                '/webhook/system/response',
+                config.TELEGRAM_WEBHOOK_PATH,
+                '/health'
+            ]
+        })
+
+    async def root(self, request: web.Request) -> web.Response:
+        """Корневой маршрут"""
+        return web.json_response({
+            'service': 'Telegram Bot Webhook Server',
+            'version': '1.0',
+            'endpoints': {
+                'n8n_spreadsheet': '/webhook/n8n/spreadsheet',
+                'system_response': '/webhook/system/response',
+                'telegram_updates': config.TELEGRAM_WEBHOOK_PATH,
+                'health': '/health'
+            }
+        })
+
+    async def start_server(self):
+        """Запускает сервер в текущем event loop (event loop бота)"""
+        logger.info(f"🚀 Запуск webhook сервера на {self.host}:{self.port}")
+
+        # access_log отключен: каждый webhook и так логируется обработчиком
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+
+        logger.info(f"✅ Webhook сервер запущен в event loop бота")
+        return self._runner
+
+    async def stop_server(self):
+        """Останавливает сервер"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("🛑 Webhook сервер остановлен")
 
 
 # Тестирование сервера
-def test_webhook_server():
+async def test_webhook_server():
     """Тестирование webhook сервера"""
-    import requests
-    import time
-    
+    import aiohttp
+
+    from sequential_webhook_service import SequentialWebhookService
+
     # Создаем мок-бота для тестирования
     class MockBot:
+        sequential_webhook_service = SequentialWebhookService()
+
         async def handle_n8n_webhook(self, data):
             print(f"🧪 Тест N8N webhook: {data}")
             return True
-            
+
         async def handle_webhook_response(self, data):
             print(f"🧪 Тест system response: {data}")
             return True
-    
+
     # Запускаем тестовый сервер
     mock_bot = MockBot()
-    server = WebhookServer(mock_bot, port=8081)
-    server.start_server()
-    
-    time.sleep(1)  # Ждем запуска сервера
-    
+    server = WebhookServer(mock_bot, host='127.0.0.1', port=8081)
+    await server.start_server()
+
     print("🧪 ТЕСТИРОВАНИЕ WEBHOOK СЕРВЕРА:")
     print("=" * 50)
-    
+
     base_url = "http://localhost:8081"
-    
-    # Тест health check
-    try:
-        response = requests.get(f"{base_url}/health")
-        print(f"✅ Health check: {response.status_code} - {response.json()}")
-    except Exception as e:
-        print(f"❌ Health check failed: {e}")
-    
-    # Тест N8N webhook
-    try:
-        n8n_data = {
-            "request_id": "test_123",
-            "status": "success",
-            "spreadsheet_id": "TEST_ID",
-            "spreadsheet_url": "https://test.com",
-            "sheet_title": "Test Sheet"
-        }
-        response = requests.post(f"{base_url}/webhook/n8n/spreadsheet", json=n8n_data)
-        print(f"✅ N8N webhook: {response.status_code} - {response.json()}")
-    except Exception as e:
-        print(f"❌ N8N webhook failed: {e}")
-    
-    # Тест system response webhook
-    try:
-        system_data = {
-            "webhook_id": "webhook_1",
-            "status": "ready",
-            "user_id": "12345"
-        }
-        response = requests.post(f"{base_url}/webhook/system/response", json=system_data)
-        print(f"✅ System response: {response.status_code} - {response.json()}")
-    except Exception as e:
-        print(f"❌ System response failed: {e}")
+
+    async with aiohttp.ClientSession() as session:
+        # Тест health check
+        try:
+            async with session.get(f"{base_url}/health") as response:
+                print(f"✅ Health check: {response.status} - {await response.json()}")
+        except Exception as e:
+            print(f"❌ Health check failed: {e}")
+
+        # Тест N8N webhook
+        try:
+            n8n_data = {
+                "request_id": "test_123",
+                "status": "success",
+                "spreadsheet_id": "TEST_ID",
+                "spreadsheet_url": "https://test.com",
+                "sheet_title": "Test Sheet"
+            }
+            async with session.post(f"{base_url}/webhook/n8n/spreadsheet", json=n8n_data) as response:
+                print(f"✅ N8N webhook: {response.status} - {await response.json()}")
+        except Exception as e:
+            print(f"❌ N8N webhook failed: {e}")
+
+        # Тест system response webhook
+        try:
+            system_data = {
+                "webhook_id": "webhook_1",
+                "status": "ready",
+                "user_id": "12345"
+            }
+            async with session.post(f"{base_url}/webhook/system/response", json=system_data) as response:
+                print(f"✅ System response: {response.status} - {await response.json()}")
+        except Exception as e:
+            print(f"❌ System response failed: {e}")
+
+    await server.stop_server()
 
 
 if __name__ == '__main__':
-    test_webhook_server()
-    input("Нажмите Enter для завершения...")
+    asyncio.run(test_webhook_server())
@@ -1,10 +1,11 @@
 """Сервис для отправки данных в вебхуки"""
 import asyncio
 import aiohttp
-import ssl
 import logging
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from http_client_pool import get_http_client
+from target_scheduler import get_target_scheduler
 import config
 
 logger = logging.getLogger(__name__)
@@ -14,18 +15,22 @@ class WebhookService:
         self.webhooks = {k: v for k, v in config.WEBHOOKS.items() if v}  # Только заполненные URL
         self.timeout = aiohttp.ClientTimeout(total=10)  # 10 секунд таймаут
         
-        # SSL контекст с отключенной верификацией для обхода проблем с сертификатами
-        self.ssl_context = ssl.create_default_context()
-        self.ssl_context.check_hostname = False
-        self.ssl_context.verify_mode = ssl.CERT_NONE
+        # Общий пул соединений (keep-alive, DNS кэш, SSL без верификации)
+        self.http_client = get_http_client()
+        
+        # Общий лимит одновременных запросов к каждой системе
+        self.target_scheduler = get_target_scheduler()
     
-    async def send_to_all_webhooks(self, user_data: Dict[str, Any], document_info: Dict[str, Any]) -> Dict[str, bool]:
+    async def send_to_all_webhooks(self, user_data: Dict[str, Any], document_info: Dict[str, Any],
+                                   user_id: Optional[int] = None, progress_callback=None) -> Dict[str, bool]:
         """
         Отправляет данные во все настроенные вебхуки параллельно
         
         Args:
             user_data: Данные пользователя (профессия, сегментация, идеальный клиент)
             document_info: Информация о созданном документе (ID, URL, название)
+            user_id: ID пользователя для честной очереди к системам
+            progress_callback: Функция для уведомления о позиции в очереди
             
         Returns:
             Dict с результатами отправки для каждого вебхука
@@ -40,7 +45,7 @@ class WebhookService:
         # Параллельная отправка во все вебхуки
         tasks = []
         for webhook_name, webhook_url in self.webhooks.items():
-            task = self._send_to_webhook(webhook_name, webhook_url, payload)
+            task = self._send_to_webhook_with_slot(webhook_name, webhook_url, payload, user_id, progress_callback)
             tasks.append(task)
         
         results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -91,6 +96,16 @@ class WebhookService:
             }
         }
     
+    async def _send_to_webhook_with_slot(self, webhook_name: str, webhook_url: str, payload: Dict[str, Any],
+                                         user_id: Optional[int], progress_callback) -> bool:
+        """Отправляет данные в вебхук, дождавшись свободного слота системы"""
+        async def report_queue_position(position: int):
+            if progress_callback is not None:
+                await progress_callback(f"⏳ Система {webhook_name} сейчас занята, вы {position}-й в очереди")
+        
+        async with self.target_scheduler.slot(webhook_name, user_id, on_queued=report_queue_position):
+            return await self._send_to_webhook(webhook_name, webhook_url, payload)
+    
     async def _send_to_webhook(self, webhook_name: str, webhook_url: str, payload: Dict[str, Any]) -> bool:
         """
         Отправляет данные в один вебхук
@@ -104,24 +119,22 @@ class WebhookService:
             True если отправка успешна, False иначе
         """
         try:
-            # Создаем connector с отключенной SSL верификацией
-            connector = aiohttp.TCPConnector(ssl=self.ssl_context)
-            async with aiohttp.ClientSession(timeout=self.timeout, connector=connector) as session:
-                async with session.post(
-                    webhook_url,
-                    json=payload,
-                    headers={
-                        'Content-Type': 'application/json',
-                        'User-Agent': 'TelegramBot-TargetAudience/1.0'
-                    }
-                ) as response:
-                    if response.status in [200, 201, 202]:
-                        logger.info(f"✅ Успешно отправлено в {webhook_name} (статус: {response.status})")
-                        return True
-                    else:
-                        response_text = await response.text()
-                        logger.error(f"❌ Ошибка отправки в {webhook_name}: {response.status} - {response_text}")
-                        return False
+            async with self.http_client.post(
+                webhook_url,
+                json=payload,
+                timeout=self.timeout,
+                headers={
+                    'Content-Type': 'application/json',
+                    'User-Agent': 'TelegramBot-TargetAudience/1.0'
+                }
+            ) as response:
+                if response.status in [200, 201, 202]:
+                    logger.info(f"✅ Успешно отправлено в {webhook_name} (статус: {response.status})")
+                    return True
+                else:
+                    response_text = await response.text()
+                    logger.error(f"❌ Ошибка отправки в {webhook_name}: {response.status} - {response_text}")
+                    return False
                         
         except asyncio.TimeoutError:
             logger.error(f"❌ Таймаут при отправке в {webhook_name}")